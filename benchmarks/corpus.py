@@ -0,0 +1,133 @@
+import functools
+import random
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Tuple
+
+from ruamel.yaml import YAML
+
+GOLDEN_DIR = (
+    Path(__file__).parent.parent / "tests" / "data" / "golden" / "simple" / "default"
+)
+
+
+@dataclass(frozen=True)
+class Corpus:
+    """
+    A named list of files, given as pairs of file names and contents.
+    """
+
+    name: str
+    files: Tuple[Tuple[str, str], ...]
+
+    @property
+    def size(self) -> int:
+        return sum(len(contents.encode("utf-8")) for _, contents in self.files)
+
+
+@functools.lru_cache(maxsize=None)
+def get_golden_inputs() -> Tuple[Tuple[str, str], ...]:
+    yaml = YAML(typ="safe")
+    inputs: List[Tuple[str, str]] = []
+    for golden_path in sorted(GOLDEN_DIR.glob("*.yml")):
+        golden = yaml.load(golden_path.read_text(encoding="utf-8"))
+        inputs.append((f"{golden_path.stem}.talon", golden["input"]))
+    return tuple(inputs)
+
+
+def get_golden_corpus() -> Corpus:
+    """
+    The inputs of the golden tests, as separate files.
+    """
+    return Corpus(name="golden", files=get_golden_inputs())
+
+
+def get_golden_concatenated_corpus() -> Corpus:
+    """
+    The inputs of the golden tests, concatenated into a single file.
+
+    Each file may have its own header, so only the bodies are concatenated.
+    """
+    bodies: List[str] = []
+    for _, contents in get_golden_inputs():
+        lines = contents.splitlines(keepends=True)
+        for index, line in enumerate(lines):
+            if line.strip() == "-":
+                lines = lines[index + 1 :]
+                break
+        bodies.append("".join(lines))
+    return Corpus(
+        name="golden-concatenated", files=(("golden.talon", "\n".join(bodies)),)
+    )
+
+
+def make_synthetic_file(commands: int, *, seed: int = 0) -> str:
+    """
+    Make an unformatted file with the given number of commands.
+    """
+    rng = random.Random(seed)
+    lines: List[str] = [
+        "app:   vscode",
+        "not  mode: sleep",
+        "-",
+        "tag():    user.tabs",
+        "settings():",
+        "    speech.timeout =   0.3",
+        "",
+    ]
+    for index in range(commands):
+        shape = rng.randrange(6)
+        letter = chr(ord("a") + index % 26)
+        if shape == 0:
+            lines.append(f"word {index}:   key(ctrl-{letter})")
+        elif shape == 1:
+            lines.append(f"phrase {index} <user.text>:")
+            lines.append("    insert( text )")
+            lines.append("    key(enter)")
+        elif shape == 2:
+            lines.append(f"# comment for command {index}")
+            lines.append(
+                f'call {index} [<number_small>]: user.action_{letter}("text {index}", 1 +  2)'
+            )
+        elif shape == 3:
+            lines.append(f"(go | move) {index} {{user.direction}}:")
+            lines.append("  edit.line_start()")
+            lines.append("  sleep(50ms)")
+            lines.append(f"  user.move_{letter}(direction)")
+        elif shape == 4:
+            lines.append(f'^anchored {index}$:    "insert {index} "')
+        else:
+            lines.append(f"repeat {index}:  core.repeat_command(number_small  - 1)")
+        if rng.random() < 0.1:
+            lines.append("")
+    lines.append("")
+    return "\n".join(lines)
+
+
+def get_synthetic_corpus(commands: int = 10_000) -> Corpus:
+    """
+    A single synthetic file with the given number of commands.
+    """
+    return Corpus(
+        name=f"synthetic-{commands}",
+        files=((f"synthetic-{commands}.talon", make_synthetic_file(commands)),),
+    )
+
+
+def get_synthetic_tree_corpus(files: int = 5_000) -> Corpus:
+    """
+    Many small files, as in a large user directory.
+
+    The files cycle through the inputs of the golden tests and small synthetic
+    files, so that they are not all the same.
+    """
+    golden_inputs = get_golden_inputs()
+    tree: List[Tuple[str, str]] = []
+    for index in range(files):
+        directory = f"dir{index % 50:02d}"
+        if index % 2 == 0:
+            _, contents = golden_inputs[(index // 2) % len(golden_inputs)]
+        else:
+            contents = make_synthetic_file(20, seed=index)
+        tree.append((f"{directory}/file{index:04d}.talon", contents))
+    return Corpus(name=f"tree-{files}", files=tuple(tree))
@@ -0,0 +1,53 @@
+import functools
+
+import pytest
+from pytest_benchmark.fixture import BenchmarkFixture
+from tree_sitter_talon import Node
+
+from talonfmt._dispatchmethod import dispatchmethod
+from talonfmt.formatter import TalonFormatter
+from tests.test_dispatch import get_corpus_nodes
+
+
+class NoopDispatcher:
+    """
+    Dispatches on the same classes as TalonFormatter.format, but does no work.
+    """
+
+    @dispatchmethod
+    def visit(self, node: Node) -> None:
+        pass
+
+    @functools.singledispatchmethod
+    def visit_functools(self, node: Node) -> None:
+        pass
+
+
+def noop(self: NoopDispatcher, node: Node) -> None:
+    pass
+
+
+for registered_cls in TalonFormatter.format.registry:
+    NoopDispatcher.visit.registry[registered_cls] = noop
+    NoopDispatcher.visit.table[registered_cls] = noop
+    NoopDispatcher.visit_functools.register(registered_cls, noop)  # type: ignore[attr-defined]
+
+
+@pytest.mark.parametrize("implementation", ["dispatchmethod", "functools"])
+def test_dispatch_overhead(benchmark: BenchmarkFixture, implementation: str) -> None:
+    nodes = get_corpus_nodes()
+    dispatcher = NoopDispatcher()
+
+    def run() -> None:
+        if implementation == "dispatchmethod":
+            for node in nodes:
+                dispatcher.visit(node)
+        else:
+            for node in nodes:
+                dispatcher.visit_functools(node)
+
+    benchmark(run)
+    benchmark.extra_info["nodes"] = len(nodes)
+    if benchmark.stats is not None:
+        seconds_per_node = benchmark.stats.stats.mean / len(nodes)
+        benchmark.extra_info["ns_per_node"] = seconds_per_node * 1e9
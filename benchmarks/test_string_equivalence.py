@@ -0,0 +1,35 @@
+from typing import List, Tuple
+
+import pytest
+from pytest_benchmark.fixture import BenchmarkFixture
+from tree_sitter_talon import TalonString
+
+from tests.test_string_equivalence import (
+    assert_equivalent_with_python_ast,
+    golden_string_pairs,
+)
+
+
+@pytest.fixture(scope="module")
+def string_pairs() -> List[Tuple[TalonString, TalonString]]:
+    return golden_string_pairs()
+
+
+def test_string_equivalent_golden(
+    string_pairs: List[Tuple[TalonString, TalonString]], benchmark: BenchmarkFixture
+) -> None:
+    def assert_equivalent() -> None:
+        for string1, string2 in string_pairs:
+            string1.assert_equivalent(string2)
+
+    benchmark(assert_equivalent)
+
+
+def test_string_equivalent_golden_with_python_ast(
+    string_pairs: List[Tuple[TalonString, TalonString]], benchmark: BenchmarkFixture
+) -> None:
+    def assert_equivalent() -> None:
+        for string1, string2 in string_pairs:
+            assert_equivalent_with_python_ast(string1, string2)
+
+    benchmark(assert_equivalent)
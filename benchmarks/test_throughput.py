@@ -0,0 +1,258 @@
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import pytest
+from doc_printer import Doc
+from pytest_benchmark.fixture import BenchmarkFixture
+from tree_sitter_talon import Node, parse
+
+from talonfmt import TalonFmt
+from talonfmt.files import decode, format_contents, format_files
+
+from .corpus import (
+    Corpus,
+    get_golden_concatenated_corpus,
+    get_golden_corpus,
+    get_synthetic_corpus,
+    get_synthetic_tree_corpus,
+)
+
+# The corpora, with the number of rounds for each benchmark
+CORPORA: Dict[str, Tuple[Callable[[], Corpus], int]] = {
+    "golden-concatenated": (get_golden_concatenated_corpus, 5),
+    "synthetic-10000": (get_synthetic_corpus, 3),
+    "tree-5000": (get_synthetic_tree_corpus, 1),
+}
+
+# The corpora used to time each phase separately
+# NOTE: the time per byte for each phase is much the same for the tree, so it is
+#       only used to time formatting as a whole
+PHASE_CORPORA: List[str] = ["golden-concatenated", "synthetic-10000"]
+
+LAYOUTS: Dict[str, Optional[int]] = {
+    "simple": None,
+    "smart80": 80,
+}
+
+_corpora: Dict[str, Corpus] = {}
+
+
+def get_corpus(name: str) -> Tuple[Corpus, int]:
+    get, rounds = CORPORA[name]
+    if name not in _corpora:
+        _corpora[name] = get()
+    return _corpora[name], rounds
+
+
+def run_benchmark(
+    benchmark: BenchmarkFixture,
+    corpus: Corpus,
+    rounds: int,
+    target: Callable[[], Any],
+) -> None:
+    """
+    Run the target and report its throughput.
+    """
+    benchmark.pedantic(target, rounds=rounds, iterations=1, warmup_rounds=0)
+    benchmark.extra_info["files"] = len(corpus.files)
+    benchmark.extra_info["bytes"] = corpus.size
+    if benchmark.stats is not None:
+        mean = benchmark.stats.stats.mean
+        benchmark.extra_info["files_per_second"] = len(corpus.files) / mean
+        benchmark.extra_info["kb_per_second"] = corpus.size / 1024 / mean
+
+
+def parse_corpus(corpus: Corpus) -> List[Node]:
+    return [parse(contents, raise_parse_error=True) for _, contents in corpus.files]
+
+
+def format_corpus(talon_fmt: TalonFmt, asts: List[Node]) -> List[List[Doc]]:
+    indent_size, _ = talon_fmt.resolve_layout(None)
+    talon_formatter = talon_fmt.get_talon_formatter(indent_size)
+    docs: List[List[Doc]] = []
+    for ast in asts:
+        talon_formatter._match_context_comment_buffer.clear()
+        docs.append(list(talon_formatter.format_lines(ast)))
+    return docs
+
+
+def render_corpus(talon_fmt: TalonFmt, docs: List[List[Doc]]) -> List[str]:
+    max_line_width = talon_fmt.max_line_width
+    return [
+        "".join(talon_fmt.render_docs(file_docs, max_line_width=max_line_width))
+        for file_docs in docs
+    ]
+
+
+@pytest.mark.parametrize("corpus_name", PHASE_CORPORA)
+def test_parse(benchmark: BenchmarkFixture, corpus_name: str) -> None:
+    corpus, rounds = get_corpus(corpus_name)
+    run_benchmark(benchmark, corpus, rounds, lambda: parse_corpus(corpus))
+
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+@pytest.mark.parametrize("corpus_name", PHASE_CORPORA)
+def test_format(benchmark: BenchmarkFixture, corpus_name: str, layout: str) -> None:
+    corpus, rounds = get_corpus(corpus_name)
+    talon_fmt = TalonFmt(max_line_width=LAYOUTS[layout])
+    asts = parse_corpus(corpus)
+    run_benchmark(benchmark, corpus, rounds, lambda: format_corpus(talon_fmt, asts))
+
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+@pytest.mark.parametrize("corpus_name", PHASE_CORPORA)
+def test_render(benchmark: BenchmarkFixture, corpus_name: str, layout: str) -> None:
+    corpus, rounds = get_corpus(corpus_name)
+    talon_fmt = TalonFmt(max_line_width=LAYOUTS[layout])
+    docs = format_corpus(talon_fmt, parse_corpus(corpus))
+    run_benchmark(benchmark, corpus, rounds, lambda: render_corpus(talon_fmt, docs))
+
+
+@pytest.mark.parametrize(
+    "corpus_name,layout",
+    [
+        *((corpus_name, layout) for corpus_name in PHASE_CORPORA for layout in LAYOUTS),
+        ("tree-5000", "simple"),
+    ],
+)
+def test_total(benchmark: BenchmarkFixture, corpus_name: str, layout: str) -> None:
+    """
+    Format each file from source, including the safety checks, whose timings
+    are reported per phase.
+    """
+    corpus, rounds = get_corpus(corpus_name)
+    talon_fmt = TalonFmt(safe=True, max_line_width=LAYOUTS[layout])
+    timings: Dict[str, float] = {}
+
+    def on_timing(phase: str, seconds: float) -> None:
+        timings[phase] = timings.get(phase, 0.0) + seconds
+
+    def run() -> List[str]:
+        return [
+            talon_fmt(contents, filename=filename, on_timing=on_timing)
+            for filename, contents in corpus.files
+        ]
+
+    run_benchmark(benchmark, corpus, rounds, run)
+    for phase, seconds in sorted(timings.items()):
+        benchmark.extra_info[phase] = seconds / rounds
+
+
+def write_corpus(corpus: Corpus, root: Path) -> List[Path]:
+    files: List[Path] = []
+    for filename, contents in corpus.files:
+        file = root / filename
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.write_text(contents, encoding="utf-8")
+        files.append(file)
+    return files
+
+
+@pytest.fixture(scope="module")
+def tree(tmp_path_factory: pytest.TempPathFactory) -> Tuple[Corpus, List[Path]]:
+    corpus, _ = get_corpus("tree-5000")
+    return corpus, write_corpus(corpus, tmp_path_factory.mktemp("tree"))
+
+
+@pytest.fixture(scope="module")
+def golden_files(
+    tmp_path_factory: pytest.TempPathFactory,
+) -> Tuple[Corpus, List[Path]]:
+    corpus = get_golden_corpus()
+    return corpus, write_corpus(corpus, tmp_path_factory.mktemp("golden"))
+
+
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_check_tree(
+    benchmark: BenchmarkFixture, tree: Tuple[Corpus, List[Path]], jobs: int
+) -> None:
+    """
+    Check the files on disk, as talonfmt --check does.
+    """
+    corpus, files = tree
+    talon_fmt = TalonFmt()
+
+    def run() -> None:
+        for result in format_files(talon_fmt, files, jobs=jobs, check=True):
+            assert result.error is None, result.error
+
+    run_benchmark(benchmark, corpus, 1, run)
+
+
+@pytest.mark.parametrize("lookahead", [None, 100])
+def test_render_lookahead(
+    benchmark: BenchmarkFixture, lookahead: Optional[int]
+) -> None:
+    """
+    Render aligned short commands, with and without a bounded lookahead.
+    """
+    corpus, rounds = get_corpus("synthetic-10000")
+    talon_fmt = TalonFmt(
+        max_line_width=80, align_short_commands=True, lookahead=lookahead
+    )
+    docs = format_corpus(talon_fmt, parse_corpus(corpus))
+    run_benchmark(benchmark, corpus, rounds, lambda: render_corpus(talon_fmt, docs))
+
+
+@pytest.mark.parametrize("contents_type", ["str", "bytes"])
+def test_read(
+    benchmark: BenchmarkFixture,
+    golden_files: Tuple[Corpus, List[Path]],
+    contents_type: str,
+) -> None:
+    """
+    Read and format the files on disk, passing their contents to the parser
+    either as text or as the bytes read from disk, and report the mean peak
+    memory per file.
+    """
+    corpus, files = golden_files
+    talon_fmt = TalonFmt(safe=False)
+
+    def read(file: Path) -> Union[str, bytes]:
+        if contents_type == "str":
+            return file.read_text(encoding="utf-8")
+        contents, _ = decode(file.read_bytes())
+        return contents
+
+    def run() -> None:
+        for file in files:
+            format_contents(talon_fmt, read(file), encoding="utf-8")
+
+    run_benchmark(benchmark, corpus, 3, run)
+
+    peak_memory: int = 0
+    tracemalloc.start()
+    try:
+        for file in files:
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            format_contents(talon_fmt, read(file), encoding="utf-8")
+            peak_memory += tracemalloc.get_traced_memory()[1] - current
+    finally:
+        tracemalloc.stop()
+    benchmark.extra_info["peak_kb_per_file"] = peak_memory / 1024 / len(files)
+
+
+def test_format_memory(benchmark: BenchmarkFixture) -> None:
+    """
+    Build the documents for the golden files, and report the memory and the
+    number of memory blocks taken up by the documents, and the peak memory.
+    """
+    corpus = get_golden_corpus()
+    talon_fmt = TalonFmt()
+    asts = parse_corpus(corpus)
+    run_benchmark(benchmark, corpus, 3, lambda: format_corpus(talon_fmt, asts))
+
+    tracemalloc.start()
+    try:
+        docs = format_corpus(talon_fmt, asts)
+        docs_memory, peak_memory = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    del docs
+    docs_blocks = sum(stat.count for stat in snapshot.statistics("filename"))
+    benchmark.extra_info["docs_kb"] = docs_memory / 1024
+    benchmark.extra_info["docs_blocks"] = docs_blocks
+    benchmark.extra_info["peak_kb"] = peak_memory / 1024
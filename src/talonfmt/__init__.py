@@ -1,104 +1,1130 @@
+from __future__ import annotations
+
 import sys
-from typing import Optional, Sequence, Union
+from contextlib import closing, contextmanager
+from dataclasses import dataclass, field, fields
+from enum import IntFlag
+from time import perf_counter
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Generator,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+    cast,
+)
 
-from doc_printer import DocRenderer, SimpleDocRenderer, SimpleLayout, SmartDocRenderer
-from tree_sitter_talon import Node, parse
+# NOTE: doc_printer, tree_sitter_talon, and the formatter are imported when
+#       they are first needed, since loading them dominates the startup time
+#       of the command-line interface, e.g., for --help or --version
+if TYPE_CHECKING:
+    import tree_sitter
+    from doc_printer import Doc, DocRenderer
+    from tree_sitter_talon import Node
 
-from .editorconfig import get_indent_size, get_max_line_length
-from .formatter import EmptyMatchContext, TalonFormatter
+    from .formatter import TalonDeclarationGroup, TalonFormatter, TalonSourceFileChild
 
 __version__: str = "1.10.2"
 
 
-def talonfmt(
-    contents: Union[str, bytes, Node],
-    *,
-    filename: Optional[str] = None,
-    encoding: str = "utf-8",
-    safe: Optional[bool] = None,
-    indent_size: Optional[int] = None,
-    max_line_width: Optional[int] = None,
-    align_match_context: bool = False,
-    align_match_context_at: Optional[int] = None,
-    align_short_commands: bool = False,
-    align_short_commands_at: Optional[int] = None,
-    simple_layout: Optional[str] = None,
-    format_comments: bool = False,
-    empty_match_context: str = "keep",
-    preserve_blank_lines: Sequence[str] = ("body", "command"),
-) -> str:
-    # Get max_line_width from .editorconfig
-    if filename is not None and max_line_width is None:
-        max_line_width = get_max_line_length(filename)
-
-    # Get indent_size from .editorconfig
-    if filename is not None and indent_size is None:
-        indent_size = get_indent_size(filename)
-
-    # Set default indent_size
-    if indent_size is None:
-        indent_size = 4
-
-    # Parse (if necessary):
-    if isinstance(contents, Node):
-        ast = contents
-        # If the contents are already an AST node, we must disable the
-        # safety tests, as we don't know if they parse as source code.
-        safe = safe or False
-    elif isinstance(contents, (str, bytes)):
-        ast = parse(contents, encoding=encoding, raise_parse_error=True)
-    else:
-        raise TypeError(type(contents))
+class Safety(IntFlag):
+    Unsafe = 0
+    # Check that parsing the output results in an equivalent AST
+    Equivalence = 1
+    # Check that formatting the output does not change it
+    Idempotence = 2
+    Full = Equivalence | Idempotence
+
+
+# The values of the safe setting, other than None and booleans
+SAFETY_OPTIONS: Dict[str, Safety] = {
+    "none": Safety.Unsafe,
+    "equivalence": Safety.Equivalence,
+    "idempotence": Safety.Idempotence,
+    "full": Safety.Full,
+}
+
+
+def get_safety(safe: Union[None, bool, str]) -> Safety:
+    """
+    Interpret the safe setting.
+    """
+    if safe is None:
+        return Safety.Full if __debug__ else Safety.Unsafe
+    if isinstance(safe, bool):
+        return Safety.Full if safe else Safety.Unsafe
+    return SAFETY_OPTIONS[safe.lower()]
+
+
+def is_unchanged(
+    contents: Union[str, bytes, Node], formatted: str, *, encoding: str
+) -> bool:
+    """
+    Test whether formatting left the contents unchanged.
+
+    If so, the output is equivalent to the input and formatting it again must
+    give the same result, so there is no need to run the safety checks.
+    """
+    if isinstance(contents, str):
+        return contents == formatted
+    if isinstance(contents, bytes):
+        return contents == formatted.encode(encoding, errors="surrogateescape")
+    return False
+
+
+class LimitExceeded(Exception):
+    """
+    Raised if the contents exceed one of the resource limits of TalonFmt.
+    """
+
+
+@contextmanager
+def recursion_limit_exceeded(filename: Optional[str]) -> Iterator[None]:
+    """
+    Raise LimitExceeded, rather than RecursionError, if the contents are
+    nested too deeply to convert their syntax tree.
+    """
+    try:
+        yield None
+    except RecursionError:
+        raise LimitExceeded(
+            f"Cannot format {filename or 'input'}: it is nested too deeply."
+        ) from None
 
-    # Enable align_match_context if align_match_context_at is set:
-    merged_match_context: Union[bool, int]
-    if isinstance(align_match_context_at, int):
-        merged_match_context = align_match_context_at
-    else:
-        merged_match_context = align_match_context
 
-    # Enable align_short_commands if align_short_commands_at is set:
-    merged_short_commands: Union[bool, int]
-    if isinstance(align_short_commands_at, int):
-        merged_short_commands = align_short_commands_at
+# Called with the name and the duration in seconds of each timed phase
+OnTiming = Callable[[str, float], None]
+
+# Called with the name and the increment of each counter
+OnCount = Callable[[str, int], None]
+
+
+@contextmanager
+def timing(phase: str, on_timing: Optional[OnTiming]) -> Iterator[None]:
+    if on_timing is None:
+        yield None
     else:
-        merged_short_commands = align_short_commands
+        start = perf_counter()
+        try:
+            yield None
+        finally:
+            on_timing(phase, perf_counter() - start)
 
-    # Interpret the empty_match_context setting
-    empty_match_context_options: dict[str, EmptyMatchContext] = {
-        "show": EmptyMatchContext.Show,
-        "keep": EmptyMatchContext.Keep,
-        "hide": EmptyMatchContext.Hide,
-    }
 
-    # Create an instance of TalonFormatter
-    talon_formatter = TalonFormatter(
-        indent_size=indent_size,
-        align_match_context=merged_match_context,
-        align_short_commands=merged_short_commands,
-        empty_match_context=empty_match_context_options[empty_match_context],
-        format_comments=format_comments,
-        preserve_blank_lines_in_header="header" in preserve_blank_lines,
-        preserve_blank_lines_in_body="body" in preserve_blank_lines,
-        preserve_blank_lines_in_command="command" in preserve_blank_lines,
+def _profile_render_stream(
+    docs: Iterable[Doc],
+    render_docs: Callable[[Iterable[Doc]], Generator[str, None, None]],
+    *,
+    on_timing: Optional[OnTiming],
+    on_count: Optional[OnCount],
+) -> Generator[str, None, None]:
+    # NOTE: the documents are built lazily while they are rendered, so the time
+    #       spent building them is subtracted from the time spent rendering
+    format_seconds: float = 0.0
+    render_seconds: float = 0.0
+
+    def timed_docs() -> Iterator[Doc]:
+        nonlocal format_seconds
+        doc_iterator = iter(docs)
+        while True:
+            start = perf_counter()
+            try:
+                doc = next(doc_iterator)
+            except StopIteration:
+                return
+            finally:
+                format_seconds += perf_counter() - start
+            yield doc
+
+    chunks = render_docs(timed_docs())
+    try:
+        while True:
+            start = perf_counter()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+            finally:
+                render_seconds += perf_counter() - start
+            yield chunk
+    finally:
+        chunks.close()
+        if on_timing is not None:
+            on_timing("format", format_seconds)
+            on_timing("render", render_seconds - format_seconds)
+
+
+def get_line_starts(contents: Union[str, bytes]) -> List[int]:
+    """
+    Get the offset of the start of each line in the contents.
+    """
+    newline: Union[str, bytes] = "\n" if isinstance(contents, str) else b"\n"
+    line_starts: List[int] = [0]
+    offset = contents.find(newline)  # type: ignore[arg-type]
+    while offset >= 0:
+        line_starts.append(offset + 1)
+        offset = contents.find(newline, offset + 1)  # type: ignore[arg-type]
+    return line_starts
+
+
+def get_last_line(node: Node) -> int:
+    """
+    Get the last line which holds part of the node, which is the line before
+    its end position if the node ends with a newline.
+    """
+    if node.end_position.column == 0:
+        return node.end_position.line - 1
+    return node.end_position.line
+
+
+# The contents of a file, optionally with its file name
+FormatInput = Union[str, bytes, Tuple[Optional[str], Union[str, bytes]]]
+
+
+@dataclass(frozen=True)
+class FormatManyResult:
+    """
+    The result of formatting one of many files, which is either the output or
+    the error raised while formatting the file.
+    """
+
+    filename: Optional[str]
+    output: Optional[str] = None
+    error: Optional[Exception] = None
+
+
+# The values of the empty_match_context setting
+EMPTY_MATCH_CONTEXT: Tuple[str, ...] = ("show", "keep", "hide")
+
+# The values of the simple_layout setting, other than None
+SIMPLE_LAYOUTS: Tuple[str, ...] = ("shortest", "longest")
+
+# The values of the preserve_blank_lines setting
+PRESERVE_BLANK_LINES: Tuple[str, ...] = ("header", "body", "command")
+
+# The default maximum nesting depth of the syntax tree. Converting the syntax
+# tree and the safety checks recurse once or twice per level of nesting, so
+# the default is well below the recursion limit.
+DEFAULT_MAX_NESTING_DEPTH: int = 200
+
+# The maximum total size of the source text of the remembered groups of
+# declarations which formatting left unchanged, in characters
+UNCHANGED_GROUPS_MAX_SIZE: int = 16 * 1024 * 1024
+
+# The maximum number of remembered names of formatted files, see reuses_groups
+FORMATTED_FILENAMES_MAX_COUNT: int = 64 * 1024
+
+
+@dataclass
+class TalonFmt:
+    """
+    A configured instance of talonfmt.
+
+    The formatter and renderer are created on first use and reused for every
+    subsequent call, so an instance should be preferred over repeated calls to
+    talonfmt when formatting many files with the same options.
+
+    An instance also remembers, in memory, the groups of declarations which
+    formatting left unchanged, and reuses them when a file is formatted again,
+    see render_groups. This only speeds up long-lived processes, such as the
+    daemon, the language server, and --watch. A single run of the CLI formats
+    each file once, and relies on the result cache to skip unchanged files.
+    """
+
+    safe: Union[None, bool, str] = None
+    indent_size: Optional[int] = None
+    max_line_width: Optional[int] = None
+    align_match_context: bool = False
+    align_match_context_at: Optional[int] = None
+    align_short_commands: bool = False
+    align_short_commands_at: Optional[int] = None
+    simple_layout: Optional[str] = None
+    format_comments: bool = False
+    empty_match_context: str = "keep"
+    preserve_blank_lines: Sequence[str] = ("body", "command")
+    lookahead: Optional[int] = None
+    max_input_size: Optional[int] = None
+    max_nesting_depth: Optional[int] = DEFAULT_MAX_NESTING_DEPTH
+    max_render_time: Optional[float] = None
+
+    # Formatters by indent_size, which may differ per file due to .editorconfig
+    _talon_formatters: Dict[int, TalonFormatter] = field(
+        default_factory=dict, init=False, repr=False, compare=False
     )
 
-    # Create an instance of DocRenderer
-    def create_doc_renderer(*, verbose: bool = True) -> DocRenderer:
+    # Renderers by max_line_width, which may differ per file due to .editorconfig
+    _doc_renderers: Dict[Optional[int], DocRenderer] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+
+    # The groups of declarations which formatting left unchanged, each with
+    # its layout and source text, see render_groups
+    _unchanged_groups: Set[Tuple[Any, ...]] = field(
+        default_factory=set, init=False, repr=False, compare=False
+    )
+    _unchanged_groups_size: int = field(
+        default=0, init=False, repr=False, compare=False
+    )
+
+    # The names of the files which were formatted, see reuses_groups
+    _formatted_filenames: Set[str] = field(
+        default_factory=set, init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self) -> None:
+        # NOTE: the options are validated once, so invalid options are reported
+        #       before any file is formatted
+        if isinstance(self.safe, str) and self.safe.lower() not in SAFETY_OPTIONS:
+            raise ValueError(f"Invalid value for safe: {self.safe!r}")
+        for name, value, choices in (
+            ("empty_match_context", self.empty_match_context, EMPTY_MATCH_CONTEXT),
+            ("simple_layout", self.simple_layout, (None, *SIMPLE_LAYOUTS)),
+        ):
+            if value not in choices:
+                raise ValueError(f"Invalid value for {name}: {value!r}")
+        for value in self.preserve_blank_lines:
+            if value not in PRESERVE_BLANK_LINES:
+                raise ValueError(f"Invalid value for preserve_blank_lines: {value!r}")
+        for name, minimum in (
+            ("indent_size", 0),
+            ("max_line_width", 1),
+            ("align_match_context_at", 0),
+            ("align_short_commands_at", 0),
+            ("lookahead", 1),
+            ("max_input_size", 0),
+            ("max_nesting_depth", 1),
+            ("max_render_time", 0),
+        ):
+            value = getattr(self, name)
+            if value is not None and value < minimum:
+                raise ValueError(f"Invalid value for {name}: {value!r}")
+
+    def __call__(
+        self,
+        contents: Union[str, bytes, Node],
+        *,
+        filename: Optional[str] = None,
+        encoding: str = "utf-8",
+        on_timing: Optional[OnTiming] = None,
+        on_count: Optional[OnCount] = None,
+    ) -> str:
+        """
+        Format the contents.
+
+        If on_timing is given, it is called with the time spent parsing,
+        formatting, rendering, looking up the .editorconfig, and on each of
+        the safety checks. If on_count is given, it is called with counters,
+        such as the number of declarations and the size of the input.
+
+        If the contents are larger than max_input_size, in bytes, or nested
+        deeper than max_nesting_depth, LimitExceeded is raised. If rendering
+        takes longer than max_render_time, in seconds, the output is rendered
+        with the simple layout instead, which takes linear time. With the
+        safety checks, the whole file is rendered with the simple layout.
+        Without them, the fallback is applied per group of declarations, so
+        only the group that ran out of time and those after it are.
+        """
+        return "".join(
+            self.stream(
+                contents,
+                filename=filename,
+                encoding=encoding,
+                on_timing=on_timing,
+                on_count=on_count,
+            )
+        )
+
+    def stream(
+        self,
+        contents: Union[str, bytes, Node],
+        *,
+        filename: Optional[str] = None,
+        encoding: str = "utf-8",
+        on_timing: Optional[OnTiming] = None,
+        on_count: Optional[OnCount] = None,
+    ) -> Generator[str, None, None]:
+        """
+        Format the contents as a stream of text, one declaration at a time.
+
+        If the safety checks are enabled, they need the whole output, so it is
+        only yielded once it has been checked.
+        """
+        if isinstance(contents, (str, bytes)):
+            if on_count is not None:
+                on_count("input:characters", len(contents))
+            self.check_input_size(contents, filename=filename, encoding=encoding)
+
+        # Whitespace is formatted as the empty string, unless the empty match
+        # context is shown, so there is no need to parse it
+        if isinstance(contents, (str, bytes)) and not contents.strip():
+            if self.empty_match_context != "show":
+                return
+
+        from tree_sitter_talon import Node, parse
+
+        from .renderer import RenderTimeExceeded, check_deadline
+
+        safe = self.safe
+        indent_size, max_line_width = self.resolve_layout(
+            filename, on_timing=on_timing, on_count=on_count
+        )
+        deadline = self.get_render_deadline(max_line_width)
+        reuse_groups = self.reuses_groups(filename)
+
+        # Without safety tests, the output is yielded as it is rendered, and
+        # the source is converted one declaration at a time
+        safety = get_safety(safe)
+        if not safety and isinstance(contents, (str, bytes)):
+            output_characters: int = 0
+            for chunk in self.render_source(
+                contents,
+                filename=filename,
+                encoding=encoding,
+                indent_size=indent_size,
+                max_line_width=max_line_width,
+                deadline=deadline,
+                reuse_groups=reuse_groups,
+                on_timing=on_timing,
+                on_count=on_count,
+            ):
+                output_characters += len(chunk)
+                yield chunk
+            if on_count is not None:
+                on_count("output:characters", output_characters)
+            return
+
+        # Parse (if necessary):
+        if isinstance(contents, Node):
+            ast = contents
+            # If the contents are already an AST node, we must disable the
+            # safety tests, as we don't know if they parse as source code.
+            safe = safe or False
+        elif isinstance(contents, (str, bytes)):
+            with timing("parse", on_timing):
+                ast = self.parse(contents, filename=filename, encoding=encoding)
+        else:
+            raise TypeError(type(contents))
+
+        def render(
+            ast: Node,
+            contents: Union[None, str, bytes] = None,
+            max_line_width: Optional[int] = max_line_width,
+            deadline: Optional[float] = deadline,
+            on_timing: Optional[OnTiming] = None,
+            on_count: Optional[OnCount] = None,
+        ) -> Generator[str, None, None]:
+            return self.render_stream(
+                ast,
+                contents=contents,
+                encoding=encoding,
+                indent_size=indent_size,
+                max_line_width=max_line_width,
+                deadline=deadline,
+                on_timing=on_timing,
+                on_count=on_count,
+            )
+
+        source: Union[None, str, bytes] = None
+        if reuse_groups and isinstance(contents, (str, bytes)):
+            source = contents
+
+        # Without safety tests, the output is yielded as it is rendered
+        safety = get_safety(safe)
+        if not safety:
+            output_characters = 0
+            for chunk in render(ast, source, on_timing=on_timing, on_count=on_count):
+                output_characters += len(chunk)
+                yield chunk
+            if on_count is not None:
+                on_count("output:characters", output_characters)
+            return
+
+        def format_safely(
+            max_line_width: Optional[int], deadline: Optional[float]
+        ) -> str:
+            formatted = "".join(
+                render(
+                    ast,
+                    source,
+                    max_line_width=max_line_width,
+                    deadline=deadline,
+                    on_timing=on_timing,
+                    on_count=on_count,
+                )
+            )
+            check_deadline(deadline)
+
+            # safety tests:
+            if is_unchanged(contents, formatted, encoding=encoding):
+                if on_count is not None:
+                    on_count("safety:skipped", 1)
+            else:
+                with timing("safety:parse", on_timing):
+                    ast_for_formatted = parse(
+                        formatted, encoding=encoding, raise_parse_error=True
+                    )
+
+                # assert: parsing output results in a similar AST
+                # NOTE: rendering loads .formatter, which patches assert_equivalent
+                if Safety.Equivalence in safety:
+                    with timing("safety:equivalence", on_timing):
+                        ast.assert_equivalent(ast_for_formatted)
+
+                # assert: formatting twice results in the same output
+                if Safety.Idempotence in safety:
+                    with timing("safety:idempotence", on_timing):
+                        formatted_twice = "".join(
+                            render(
+                                ast_for_formatted,
+                                max_line_width=max_line_width,
+                                deadline=deadline,
+                            )
+                        )
+                    check_deadline(deadline)
+                    assert (
+                        formatted == formatted_twice
+                    ), f"Formatting {filename or 'input'} twice gives a different result."
+            return formatted
+
+        # NOTE: if the render time is exceeded, part of the output may have been
+        #       rendered with the simple layout, which formatting again would
+        #       not give, so the whole file is rendered with the simple layout
+        with recursion_limit_exceeded(filename):
+            try:
+                formatted = format_safely(max_line_width, deadline)
+            except RenderTimeExceeded:
+                if on_count is not None:
+                    on_count("render:fallback", 1)
+                formatted = format_safely(None, None)
+        if on_count is not None:
+            on_count("output:characters", len(formatted))
+
+        yield formatted
+
+    def format_many(
+        self,
+        inputs: Iterable[FormatInput],
+        *,
+        encoding: str = "utf-8",
+        jobs: int = 1,
+    ) -> Generator[FormatManyResult, None, None]:
+        """
+        Format many files, given as their contents, optionally with their file
+        names, and yield the results in the same order.
+
+        An error raised while formatting one of the files is included in its
+        result, rather than raised. If jobs is greater than one, the files are
+        formatted by that many processes.
+        """
+        if jobs <= 1:
+            for input in inputs:
+                yield self.format_one(input, encoding=encoding)
+            return
+
+        from collections import deque
+        from concurrent.futures import Future, ProcessPoolExecutor
+
+        with ProcessPoolExecutor(
+            max_workers=jobs, initializer=_init_worker, initargs=(self,)
+        ) as executor:
+            # NOTE: only a few files per process are submitted ahead, so the
+            #       inputs are consumed as the results are yielded
+            pending: Deque[Future[FormatManyResult]] = deque()
+            for input in inputs:
+                pending.append(executor.submit(_format_in_worker, input, encoding))
+                if len(pending) >= jobs * 4:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def format_one(self, input: FormatInput, *, encoding: str) -> FormatManyResult:
+        filename: Optional[str] = None
+        if isinstance(input, tuple):
+            filename, contents = input
+        else:
+            contents = input
+        try:
+            output = self(contents, filename=filename, encoding=encoding)
+        except Exception as e:
+            return FormatManyResult(filename=filename, error=e)
+        return FormatManyResult(filename=filename, output=output)
+
+    def check(
+        self,
+        contents: Union[str, bytes],
+        *,
+        filename: Optional[str] = None,
+        encoding: str = "utf-8",
+        on_timing: Optional[OnTiming] = None,
+        on_count: Optional[OnCount] = None,
+    ) -> bool:
+        """
+        Check whether the contents are already formatted.
+
+        The output is compared to the contents while it is rendered, and
+        rendering stops at the first difference. No safety checks are run,
+        since the output is never used.
+        """
+        if on_count is not None:
+            on_count("input:characters", len(contents))
+        self.check_input_size(contents, filename=filename, encoding=encoding)
+
+        if not contents.strip() and self.empty_match_context != "show":
+            return not contents
+
+        indent_size, max_line_width = self.resolve_layout(
+            filename, on_timing=on_timing, on_count=on_count
+        )
+        reuse_groups = self.reuses_groups(filename)
+        with timing("parse", on_timing):
+            ast = self.parse(contents, filename=filename, encoding=encoding)
+        position: int = 0
+        with closing(
+            self.render_stream(
+                ast,
+                contents=contents if reuse_groups else None,
+                encoding=encoding,
+                indent_size=indent_size,
+                max_line_width=max_line_width,
+                deadline=self.get_render_deadline(max_line_width),
+                on_timing=on_timing,
+                on_count=on_count,
+            )
+        ) as chunks:
+            # NOTE: bytes are compared to the encoded output, so they are
+            #       never decoded
+            for chunk in chunks:
+                if isinstance(contents, bytes):
+                    chunk_bytes = chunk.encode(encoding)
+                    if not contents.startswith(chunk_bytes, position):
+                        return False
+                    position += len(chunk_bytes)
+                else:
+                    if not contents.startswith(chunk, position):
+                        return False
+                    position += len(chunk)
+        return position == len(contents)
+
+    def render_stream(
+        self,
+        ast: Node,
+        *,
+        indent_size: int,
+        max_line_width: Optional[int],
+        contents: Union[None, str, bytes] = None,
+        encoding: str = "utf-8",
+        deadline: Optional[float] = None,
+        on_timing: Optional[OnTiming] = None,
+        on_count: Optional[OnCount] = None,
+    ) -> Generator[str, None, None]:
+        """
+        Render an AST as a stream of text, one declaration at a time.
+
+        If on_timing is given, the time spent building the documents is
+        reported as "format", and the time spent rendering them as "render".
+        If the contents from which the AST was parsed are given, any group of
+        declarations which is already formatted is reused, see render_groups.
+        If the deadline passes, the rest is rendered with the simple layout.
+        """
+        from tree_sitter_talon import TalonSourceFile
+
+        talon_formatter = self.get_talon_formatter(indent_size)
+
+        # Discard any state left over from a previous call
+        talon_formatter._match_context_comment_buffer.clear()
+
+        if isinstance(ast, TalonSourceFile):
+            from .formatter import get_source_file_children
+
+            yield from self.render_groups(
+                talon_formatter.group_declarations(get_source_file_children(ast)),
+                contents=contents,
+                encoding=encoding,
+                indent_size=indent_size,
+                max_line_width=max_line_width,
+                deadline=deadline,
+                on_timing=on_timing,
+                on_count=on_count,
+            )
+            return
+
+        docs = (talon_formatter.format(ast),)
+        if deadline is not None:
+            from .renderer import RenderTimeExceeded
+
+            try:
+                text = "".join(
+                    self.render_docs(
+                        docs, max_line_width=max_line_width, deadline=deadline
+                    )
+                )
+            except RenderTimeExceeded:
+                if on_count is not None:
+                    on_count("render:fallback", 1)
+                text = "".join(self.render_docs(docs, max_line_width=None))
+            if text:
+                yield text
+        elif on_timing is None and on_count is None:
+            yield from self.render_docs(docs, max_line_width=max_line_width)
+        else:
+            yield from _profile_render_stream(
+                docs,
+                lambda docs: self.render_docs(docs, max_line_width=max_line_width),
+                on_timing=on_timing,
+                on_count=on_count,
+            )
+
+    def render_source(
+        self,
+        contents: Union[str, bytes],
+        *,
+        filename: Optional[str] = None,
+        encoding: str,
+        indent_size: int,
+        max_line_width: Optional[int],
+        deadline: Optional[float] = None,
+        reuse_groups: bool = True,
+        on_timing: Optional[OnTiming] = None,
+        on_count: Optional[OnCount] = None,
+    ) -> Generator[str, None, None]:
+        """
+        Parse and render source code as a stream of text.
+
+        Unlike render_stream, the syntax tree is converted one declaration at
+        a time, so only the declarations which are being formatted are kept.
+        If reuse_groups is set, any group of declarations which is already
+        formatted is reused, see render_groups.
+        """
+        import tree_sitter_talon
+
+        from .formatter import get_source_file_ts_children
+
+        if isinstance(contents, str):
+            contents_bytes = contents.encode(encoding)
+        else:
+            contents_bytes = contents
+
+        parse_seconds: float = 0.0
+        start = perf_counter()
+        tree = tree_sitter_talon.parser.parse(contents_bytes)
+        self.check_nesting_depth(tree, filename=filename)
+
+        # Raise the same error as parse for contents with parse errors
+        if tree.root_node.has_error:
+            tree_sitter_talon.parse(
+                contents_bytes, encoding=encoding, raise_parse_error=True
+            )
+
+        ts_children = get_source_file_ts_children(tree)
+        lines = [(ts.start_point[0], ts.end_point[0]) for ts in ts_children]
+        parse_seconds += perf_counter() - start
+
+        def children() -> Iterator[TalonSourceFileChild]:
+            nonlocal parse_seconds
+            for ts_child in ts_children:
+                start = perf_counter()
+                with recursion_limit_exceeded(filename):
+                    child = tree_sitter_talon.from_tree_sitter(
+                        ts_child, encoding=encoding, raise_parse_error=True
+                    )
+                parse_seconds += perf_counter() - start
+                yield cast("TalonSourceFileChild", child)
+
+        talon_formatter = self.get_talon_formatter(indent_size)
+
+        # Discard any state left over from a previous call
+        talon_formatter._match_context_comment_buffer.clear()
+
+        # NOTE: the declarations are converted while they are grouped, which
+        #       is not included in the time spent formatting them
+        try:
+            yield from self.render_groups(
+                talon_formatter.group_declarations(children(), lines=lines),
+                contents=contents if reuse_groups else None,
+                encoding=encoding,
+                indent_size=indent_size,
+                max_line_width=max_line_width,
+                deadline=deadline,
+                on_timing=on_timing,
+                on_count=on_count,
+            )
+        finally:
+            if on_timing is not None:
+                on_timing("parse", parse_seconds)
+
+    def render_groups(
+        self,
+        groups: Iterable[TalonDeclarationGroup],
+        *,
+        indent_size: int,
+        max_line_width: Optional[int],
+        contents: Union[None, str, bytes] = None,
+        encoding: str = "utf-8",
+        deadline: Optional[float] = None,
+        on_timing: Optional[OnTiming] = None,
+        on_count: Optional[OnCount] = None,
+    ) -> Generator[str, None, None]:
+        """
+        Render groups of declarations as a stream of text, one group at a time.
+
+        If the contents are given, the source text of each group is compared to
+        its output, and if formatting left it unchanged, it is remembered. The
+        next time the same source text is formatted with the same layout, it
+        is used as is, without building or rendering any documents. The other
+        options are fixed for each instance, so they are not part of the key.
+
+        If the deadline passes while a group is rendered, that group and every
+        group after it are rendered with the simple layout.
+        """
+        from .renderer import RenderTimeExceeded
+
+        talon_formatter = self.get_talon_formatter(indent_size)
+        line_starts: Optional[List[int]] = None
+        if contents is not None:
+            line_starts = get_line_starts(contents)
+
+        # Used to test that the source text of groups does not overlap.
+        previous_line: int = -1
+
+        for group in groups:
+            # NOTE: the source text of a group is made up of whole lines, and
+            #       includes the blank line before it, if any
+            key: Optional[Tuple[Any, ...]] = None
+            source: str = ""
+            if contents is not None and line_starts is not None and group.children:
+                first_line = min(child.start_position.line for child in group.children)
+                first_line -= group.blank_lines[0]
+                last_line = max(map(get_last_line, group.children))
+                if first_line > previous_line:
+                    start = line_starts[first_line]
+                    end = len(contents)
+                    if last_line + 1 < len(line_starts):
+                        end = line_starts[last_line + 1]
+                    span = contents[start:end]
+                    if isinstance(span, bytes):
+                        source = span.decode(encoding)
+                    else:
+                        source = span
+                    key = (
+                        indent_size,
+                        max_line_width,
+                        group.is_header(),
+                        group.short_commands,
+                        tuple(group.blank_lines),
+                        source,
+                    )
+                previous_line = max(previous_line, last_line)
+
+            if key is not None and key in self._unchanged_groups:
+                if on_count is not None:
+                    on_count("format:reused", 1)
+                if source:
+                    yield source
+                continue
+
+            if on_count is not None:
+                on_count("format:groups", 1)
+            docs = talon_formatter.format_declaration_group(group)
+            chunks: Iterator[str]
+            if on_timing is None and on_count is None:
+                chunks = self.render_docs(
+                    docs, max_line_width=max_line_width, deadline=deadline
+                )
+            else:
+                chunks = _profile_render_stream(
+                    docs,
+                    lambda docs: self.render_docs(
+                        docs, max_line_width=max_line_width, deadline=deadline
+                    ),
+                    on_timing=on_timing,
+                    on_count=on_count,
+                )
+            if key is None and deadline is None:
+                yield from chunks
+                continue
+
+            # NOTE: if the deadline is set, the group is rendered as a whole, so
+            #       none of it is yielded before it is rendered with the simple
+            #       layout, which is not remembered under the original layout
+            try:
+                text = "".join(chunks)
+            except RenderTimeExceeded:
+                if on_count is not None:
+                    on_count("render:fallback", 1)
+                key, max_line_width, deadline = None, None, None
+                talon_formatter._match_context_comment_buffer.clear()
+                docs = talon_formatter.format_declaration_group(group)
+                text = "".join(self.render_docs(docs, max_line_width=None))
+            if key is not None and source == text:
+                if (
+                    self._unchanged_groups_size + len(source)
+                    > UNCHANGED_GROUPS_MAX_SIZE
+                ):
+                    self._unchanged_groups.clear()
+                    self._unchanged_groups_size = 0
+                    self._formatted_filenames.clear()
+                self._unchanged_groups.add(key)
+                self._unchanged_groups_size += len(source)
+            if text:
+                yield text
+
+    def reuses_groups(self, filename: Optional[str]) -> bool:
+        """
+        Test whether the groups of declarations in the file should be compared
+        to their output, so that they can be reused, see render_groups.
+
+        Comparing the groups is only worth it if the file is formatted again,
+        such as by the daemon, the language server, or --watch. Hence, it is
+        skipped the first time a file is formatted, and if it has no name.
+        """
+        if filename is None:
+            return False
+        if filename in self._formatted_filenames:
+            return True
+        if len(self._formatted_filenames) >= FORMATTED_FILENAMES_MAX_COUNT:
+            self._formatted_filenames.clear()
+        self._formatted_filenames.add(filename)
+        return False
+
+    def render_docs(
+        self,
+        docs: Iterable[Doc],
+        *,
+        max_line_width: Optional[int],
+        deadline: Optional[float] = None,
+    ) -> Generator[str, None, None]:
+        """
+        Render a series of documents as a stream of text, one document at a time.
+
+        If the deadline, as given by perf_counter, passes, RenderTimeExceeded
+        is raised.
+        """
+        from doc_printer import SimpleDocRenderer
+
+        from .renderer import render_deadline
+
+        doc_renderer = self.get_doc_renderer(max_line_width)
+
+        # Discard any state left over from a previous call
+        if isinstance(doc_renderer, SimpleDocRenderer):
+            doc_renderer.line = 0
+            doc_renderer.column = 0
+
+        for doc in docs:
+            if deadline is not None and isinstance(doc_renderer, SimpleDocRenderer):
+                with render_deadline(doc_renderer, deadline):
+                    text = "".join(token.text for token in doc_renderer.render(doc))
+            else:
+                text = "".join(token.text for token in doc_renderer.render(doc))
+            if text:
+                yield text
+
+    def parse(
+        self,
+        contents: Union[str, bytes],
+        *,
+        filename: Optional[str] = None,
+        encoding: str = "utf-8",
+    ) -> Node:
+        """
+        Parse the contents, and check that they are not nested too deeply.
+        """
+        import tree_sitter_talon
+
+        # NOTE: the depth is checked before the syntax tree is converted, which
+        #       recurses once for each level of nesting
+        if isinstance(contents, str):
+            contents = contents.encode(encoding)
+        tree = tree_sitter_talon.parser.parse(contents)
+        self.check_nesting_depth(tree, filename=filename)
+        with recursion_limit_exceeded(filename):
+            return tree_sitter_talon.from_tree_sitter(
+                tree.root_node, encoding=encoding, raise_parse_error=True
+            )
+
+    def check_input_size(
+        self,
+        contents: Union[str, bytes],
+        *,
+        filename: Optional[str] = None,
+        encoding: str = "utf-8",
+    ) -> None:
+        """
+        Raise LimitExceeded if the contents are larger than max_input_size.
+        """
+        if self.max_input_size is None:
+            return
+        if isinstance(contents, str):
+            size = len(contents.encode(encoding, errors="surrogateescape"))
+        else:
+            size = len(contents)
+        if size > self.max_input_size:
+            raise LimitExceeded(
+                f"Cannot format {filename or 'input'}: its size is {size} bytes, "
+                f"which exceeds the limit of {self.max_input_size} bytes."
+            )
+
+    def check_nesting_depth(
+        self, tree: tree_sitter.Tree, *, filename: Optional[str] = None
+    ) -> None:
+        """
+        Raise LimitExceeded if the syntax tree is deeper than max_nesting_depth.
+        """
+        if self.max_nesting_depth is None:
+            return
+        from .formatter import get_depth
+
+        if get_depth(tree, limit=self.max_nesting_depth) > self.max_nesting_depth:
+            raise LimitExceeded(
+                f"Cannot format {filename or 'input'}: it is nested deeper than "
+                f"the limit of {self.max_nesting_depth} levels."
+            )
+
+    def get_render_deadline(self, max_line_width: Optional[int]) -> Optional[float]:
+        """
+        Get the deadline for rendering a file, as given by perf_counter, if any.
+
+        The simple layout is rendered in linear time, so it has no deadline.
+        """
+        if self.max_render_time is None or max_line_width is None:
+            return None
+        return perf_counter() + self.max_render_time
+
+    @property
+    def options(self) -> Dict[str, Any]:
+        """
+        The options, as passed to the constructor.
+        """
+        return {
+            field.name: getattr(self, field.name)
+            for field in fields(self)
+            if field.init
+        }
+
+    def resolve_layout(
+        self,
+        filename: Optional[str],
+        *,
+        on_timing: Optional[OnTiming] = None,
+        on_count: Optional[OnCount] = None,
+    ) -> Tuple[int, Optional[int]]:
+        """
+        Resolve the indent size and maximum line width for the given file.
+        """
+        max_line_width = self.max_line_width
+        indent_size = self.indent_size
+
+        # Get max_line_width and indent_size from .editorconfig
+        if filename is not None and (max_line_width is None or indent_size is None):
+            from .editorconfig import (
+                get_editorconfig,
+                get_editorconfig_cache_info,
+                get_int_property,
+            )
+
+            if on_count is None:
+                with timing("editorconfig", on_timing):
+                    properties = get_editorconfig(filename)
+            else:
+                # NOTE: the hits and misses of the cache are reported, so the
+                #       profile shows whether the .editorconfig files are reused
+                before = get_editorconfig_cache_info()
+                with timing("editorconfig", on_timing):
+                    properties = get_editorconfig(filename)
+                after = get_editorconfig_cache_info()
+                on_count("editorconfig:lookups", 1)
+                for name, count in vars(after).items():
+                    if count > getattr(before, name):
+                        on_count(f"editorconfig:{name}", count - getattr(before, name))
+            if max_line_width is None:
+                max_line_width = get_int_property(properties, "max_line_length")
+            if indent_size is None:
+                indent_size = get_int_property(properties, "indent_size")
+
+        # Set default indent_size
+        if indent_size is None:
+            indent_size = 4
+
+        return (indent_size, max_line_width)
+
+    def get_talon_formatter(self, indent_size: int) -> TalonFormatter:
+        talon_formatter = self._talon_formatters.get(indent_size, None)
+        if talon_formatter is None:
+            talon_formatter = self.create_talon_formatter(indent_size)
+            self._talon_formatters[indent_size] = talon_formatter
+        return talon_formatter
+
+    def create_talon_formatter(self, indent_size: int) -> TalonFormatter:
+        from .formatter import EmptyMatchContext, TalonFormatter
+
+        # Enable align_match_context if align_match_context_at is set:
+        merged_match_context: Union[bool, int]
+        if isinstance(self.align_match_context_at, int):
+            merged_match_context = self.align_match_context_at
+        else:
+            merged_match_context = self.align_match_context
+
+        # Enable align_short_commands if align_short_commands_at is set:
+        merged_short_commands: Union[bool, int]
+        if isinstance(self.align_short_commands_at, int):
+            merged_short_commands = self.align_short_commands_at
+        else:
+            merged_short_commands = self.align_short_commands
+
+        # Interpret the empty_match_context setting
+        empty_match_context_options: dict[str, EmptyMatchContext] = {
+            "show": EmptyMatchContext.Show,
+            "keep": EmptyMatchContext.Keep,
+            "hide": EmptyMatchContext.Hide,
+        }
+
+        # Create an instance of TalonFormatter
+        return TalonFormatter(
+            indent_size=indent_size,
+            align_match_context=merged_match_context,
+            align_short_commands=merged_short_commands,
+            empty_match_context=empty_match_context_options[self.empty_match_context],
+            format_comments=self.format_comments,
+            preserve_blank_lines_in_header="header" in self.preserve_blank_lines,
+            preserve_blank_lines_in_body="body" in self.preserve_blank_lines,
+            preserve_blank_lines_in_command="command" in self.preserve_blank_lines,
+        )
+
+    def get_doc_renderer(self, max_line_width: Optional[int]) -> DocRenderer:
+        doc_renderer = self._doc_renderers.get(max_line_width, None)
+        if doc_renderer is None:
+            doc_renderer = self.create_doc_renderer(max_line_width)
+            self._doc_renderers[max_line_width] = doc_renderer
+        return doc_renderer
+
+    def create_doc_renderer(
+        self, max_line_width: Optional[int], *, verbose: bool = True
+    ) -> DocRenderer:
+        from doc_printer import SimpleDocRenderer, SimpleLayout, SmartDocRenderer
+
         doc_renderer: DocRenderer
         if max_line_width is None:
             # Resolve --simple-layout
             simple_layout_value: SimpleLayout
             if (
-                simple_layout == "longtest"
-                or align_match_context is not False
-                or align_short_commands is not False
+                self.simple_layout == "longtest"
+                or self.align_match_context is not False
+                or self.align_short_commands is not False
             ):
-                if simple_layout == "shortest":
-                    incompatible_options: list[str]
-                    if align_match_context is not False:
+                if self.simple_layout == "shortest":
+                    incompatible_options: list[str] = []
+                    if self.align_match_context is not False:
                         incompatible_options.append("--align-match-context")
-                    if align_short_commands is not False:
+                    if self.align_short_commands is not False:
                         incompatible_options.append("--align-short-commands")
                     if verbose and incompatible_options:
                         sys.stderr.write(
@@ -110,28 +1136,191 @@ def talonfmt(
             doc_renderer = SimpleDocRenderer(simple_layout=simple_layout_value)
         else:
             # Resolve --simple-layout
-            if verbose and simple_layout is not None:
+            if verbose and self.simple_layout is not None:
                 sys.stderr.write(
                     f"Warning: incompatible options '--max-line-width' and '--simple-layout'\n"
                 )
-            doc_renderer = SmartDocRenderer(max_line_width=max_line_width)
+            if self.lookahead is None:
+                doc_renderer = SmartDocRenderer(max_line_width=max_line_width)
+            else:
+                from .renderer import BoundedSmartDocRenderer
+
+                doc_renderer = BoundedSmartDocRenderer(
+                    max_line_width=max_line_width, lookahead=self.lookahead
+                )
         return doc_renderer
 
-    def render(ast: Node, *, verbose: bool) -> str:
-        doc = talon_formatter.format(ast)
-        return str(create_doc_renderer(verbose=verbose).to_str(doc))
 
-    formatted = render(ast, verbose=True)
+################################################################################
+# Parallel Formatting
+################################################################################
+
+# The instance of TalonFmt owned by a worker process
+_worker_talon_fmt: Optional[TalonFmt] = None
+
+
+def _init_worker(talon_fmt: TalonFmt) -> None:
+    global _worker_talon_fmt
+    _worker_talon_fmt = talon_fmt
+
+
+def _format_in_worker(input: FormatInput, encoding: str) -> FormatManyResult:
+    assert _worker_talon_fmt is not None, "worker was not initialised"
+    return _worker_talon_fmt.format_one(input, encoding=encoding)
 
-    # safety tests:
-    if safe or (safe is None and __debug__):
-        ast_for_formatted = parse(formatted, encoding=encoding, raise_parse_error=True)
-        # assert: parsing output results in a similar AST
-        ast.assert_equivalent(ast_for_formatted)
 
-        # assert: formatting twice results in the same output
-        assert formatted == render(
-            ast_for_formatted, verbose=False
-        ), f"Formatting {filename or 'input'} twice gives a different result."
+################################################################################
+# Functional Interface
+################################################################################
 
-    return formatted
+
+def talonfmt(
+    contents: Union[str, bytes, Node],
+    *,
+    filename: Optional[str] = None,
+    encoding: str = "utf-8",
+    safe: Union[None, bool, str] = None,
+    indent_size: Optional[int] = None,
+    max_line_width: Optional[int] = None,
+    align_match_context: bool = False,
+    align_match_context_at: Optional[int] = None,
+    align_short_commands: bool = False,
+    align_short_commands_at: Optional[int] = None,
+    simple_layout: Optional[str] = None,
+    format_comments: bool = False,
+    empty_match_context: str = "keep",
+    preserve_blank_lines: Sequence[str] = ("body", "command"),
+    lookahead: Optional[int] = None,
+    max_input_size: Optional[int] = None,
+    max_nesting_depth: Optional[int] = DEFAULT_MAX_NESTING_DEPTH,
+    max_render_time: Optional[float] = None,
+    on_timing: Optional[OnTiming] = None,
+    on_count: Optional[OnCount] = None,
+) -> str:
+    talon_fmt = TalonFmt(
+        safe=safe,
+        indent_size=indent_size,
+        max_line_width=max_line_width,
+        align_match_context=align_match_context,
+        align_match_context_at=align_match_context_at,
+        align_short_commands=align_short_commands,
+        align_short_commands_at=align_short_commands_at,
+        simple_layout=simple_layout,
+        format_comments=format_comments,
+        empty_match_context=empty_match_context,
+        preserve_blank_lines=preserve_blank_lines,
+        lookahead=lookahead,
+        max_input_size=max_input_size,
+        max_nesting_depth=max_nesting_depth,
+        max_render_time=max_render_time,
+    )
+    return talon_fmt(
+        contents,
+        filename=filename,
+        encoding=encoding,
+        on_timing=on_timing,
+        on_count=on_count,
+    )
+
+
+def talonfmt_stream(
+    contents: Union[str, bytes, Node],
+    *,
+    filename: Optional[str] = None,
+    encoding: str = "utf-8",
+    safe: Union[None, bool, str] = None,
+    indent_size: Optional[int] = None,
+    max_line_width: Optional[int] = None,
+    align_match_context: bool = False,
+    align_match_context_at: Optional[int] = None,
+    align_short_commands: bool = False,
+    align_short_commands_at: Optional[int] = None,
+    simple_layout: Optional[str] = None,
+    format_comments: bool = False,
+    empty_match_context: str = "keep",
+    preserve_blank_lines: Sequence[str] = ("body", "command"),
+    lookahead: Optional[int] = None,
+    max_input_size: Optional[int] = None,
+    max_nesting_depth: Optional[int] = DEFAULT_MAX_NESTING_DEPTH,
+    max_render_time: Optional[float] = None,
+    on_timing: Optional[OnTiming] = None,
+    on_count: Optional[OnCount] = None,
+) -> Iterator[str]:
+    """
+    Format the contents as a stream of text, one declaration at a time.
+
+    If the safety checks are enabled, the output is only yielded once it has
+    been checked, so only unsafe formatting avoids holding the whole output.
+    """
+    talon_fmt = TalonFmt(
+        safe=safe,
+        indent_size=indent_size,
+        max_line_width=max_line_width,
+        align_match_context=align_match_context,
+        align_match_context_at=align_match_context_at,
+        align_short_commands=align_short_commands,
+        align_short_commands_at=align_short_commands_at,
+        simple_layout=simple_layout,
+        format_comments=format_comments,
+        empty_match_context=empty_match_context,
+        preserve_blank_lines=preserve_blank_lines,
+        lookahead=lookahead,
+        max_input_size=max_input_size,
+        max_nesting_depth=max_nesting_depth,
+        max_render_time=max_render_time,
+    )
+    return talon_fmt.stream(
+        contents,
+        filename=filename,
+        encoding=encoding,
+        on_timing=on_timing,
+        on_count=on_count,
+    )
+
+
+def talonfmt_many(
+    inputs: Iterable[FormatInput],
+    *,
+    encoding: str = "utf-8",
+    jobs: int = 1,
+    safe: Union[None, bool, str] = None,
+    indent_size: Optional[int] = None,
+    max_line_width: Optional[int] = None,
+    align_match_context: bool = False,
+    align_match_context_at: Optional[int] = None,
+    align_short_commands: bool = False,
+    align_short_commands_at: Optional[int] = None,
+    simple_layout: Optional[str] = None,
+    format_comments: bool = False,
+    empty_match_context: str = "keep",
+    preserve_blank_lines: Sequence[str] = ("body", "command"),
+    lookahead: Optional[int] = None,
+    max_input_size: Optional[int] = None,
+    max_nesting_depth: Optional[int] = DEFAULT_MAX_NESTING_DEPTH,
+    max_render_time: Optional[float] = None,
+) -> Iterator[FormatManyResult]:
+    """
+    Format many files, given as their contents, optionally with their file
+    names, and yield the results in the same order.
+
+    The options are validated once, and the formatter and renderer are reused
+    for every file. See TalonFmt.format_many.
+    """
+    talon_fmt = TalonFmt(
+        safe=safe,
+        indent_size=indent_size,
+        max_line_width=max_line_width,
+        align_match_context=align_match_context,
+        align_match_context_at=align_match_context_at,
+        align_short_commands=align_short_commands,
+        align_short_commands_at=align_short_commands_at,
+        simple_layout=simple_layout,
+        format_comments=format_comments,
+        empty_match_context=empty_match_context,
+        preserve_blank_lines=preserve_blank_lines,
+        lookahead=lookahead,
+        max_input_size=max_input_size,
+        max_nesting_depth=max_nesting_depth,
+        max_render_time=max_render_time,
+    )
+    return talon_fmt.format_many(inputs, encoding=encoding, jobs=jobs)
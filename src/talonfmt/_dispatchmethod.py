@@ -0,0 +1,88 @@
+import typing
+from types import MethodType
+from typing import Any, Callable, Dict, Generic, Optional, Type, TypeVar, Union
+
+__all__ = ["dispatchmethod"]
+
+_T = TypeVar("_T")
+
+
+class dispatchmethod(Generic[_T]):
+    """
+    A method which dispatches on the class of its first argument.
+
+    Unlike functools.singledispatchmethod, binding the method does not create a
+    new dispatcher, and the implementations are stored in a flat table, keyed
+    on concrete classes. The implementation for a class that was not
+    registered is resolved via its MRO on first use, and stored in the table.
+    """
+
+    def __init__(self, func: Callable[..., _T]) -> None:
+        self.func = func
+        self.registry: Dict[type, Callable[..., _T]] = {}
+        self.table: Dict[type, Callable[..., _T]] = {}
+        self.__doc__ = func.__doc__
+
+        table = self.table
+        dispatch = self.dispatch
+
+        def method(self: Any, arg: Any, *args: Any, **kwargs: Any) -> _T:
+            impl = table.get(arg.__class__, None)
+            if impl is None:
+                impl = dispatch(arg.__class__)
+            return impl(self, arg, *args, **kwargs)
+
+        self._method = method
+
+    def register(self, method: Callable[..., _T]) -> Callable[..., _T]:
+        """
+        Register an implementation for the class of its first argument, which
+        is taken from its type annotation.
+        """
+        cls = _get_dispatch_class(method)
+        self.registry[cls] = method
+        # NOTE: the new implementation may override those resolved via the MRO
+        self.table.clear()
+        self.table.update(self.registry)
+        return method
+
+    def dispatch(self, cls: type) -> Callable[..., _T]:
+        """
+        Get the implementation for the given class.
+        """
+        impl = self.table.get(cls, None)
+        if impl is None:
+            impl = self.func
+            for base in cls.__mro__:
+                impl_for_base = self.registry.get(base, None)
+                if impl_for_base is not None:
+                    impl = impl_for_base
+                    break
+            self.table[cls] = impl
+        return impl
+
+    @typing.overload
+    def __get__(
+        self, obj: None, cls: Optional[type] = None
+    ) -> "dispatchmethod[_T]": ...
+
+    @typing.overload
+    def __get__(self, obj: object, cls: Optional[type] = None) -> Callable[..., _T]: ...
+
+    def __get__(
+        self, obj: Optional[object], cls: Optional[type] = None
+    ) -> Union["dispatchmethod[_T]", Callable[..., _T]]:
+        if obj is None:
+            return self
+        return MethodType(self._method, obj)
+
+
+def _get_dispatch_class(method: Callable[..., Any]) -> Type[Any]:
+    # NOTE: the first argument is self, the second is dispatched on
+    argument_name = method.__code__.co_varnames[1]
+    cls = typing.get_type_hints(method).get(argument_name, None)
+    if not isinstance(cls, type):
+        raise TypeError(
+            f"Invalid annotation for argument '{argument_name}' of {method.__qualname__}: {cls!r}"
+        )
+    return cls
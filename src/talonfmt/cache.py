@@ -0,0 +1,182 @@
+import functools
+import hashlib
+import json
+import os
+import sys
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, List, Mapping, Optional, Tuple
+
+# The default maximum size of the cache directory, in bytes
+DEFAULT_MAX_SIZE: int = 64 * 1024 * 1024
+
+# The prefixes used to mark cache entries as unchanged or formatted
+_UNCHANGED: bytes = b"="
+_FORMATTED: bytes = b">"
+
+
+def get_default_cache_dir() -> Path:
+    """
+    Get the default cache directory for the current platform.
+    """
+    cache_dir = os.environ.get("TALONFMT_CACHE_DIR", None)
+    if cache_dir:
+        return Path(cache_dir)
+    if sys.platform == "win32":
+        local_app_data = os.environ.get("LOCALAPPDATA", None)
+        if local_app_data:
+            return Path(local_app_data) / "talonfmt" / "Cache"
+    elif sys.platform == "darwin":
+        return Path.home() / "Library" / "Caches" / "talonfmt"
+    xdg_cache_home = os.environ.get("XDG_CACHE_HOME", None)
+    if xdg_cache_home:
+        return Path(xdg_cache_home) / "talonfmt"
+    return Path.home() / ".cache" / "talonfmt"
+
+
+@functools.lru_cache(maxsize=None)
+def _get_package_versions() -> Tuple[Tuple[str, str], ...]:
+    # NOTE: importlib.metadata is slow to import, and only needed for the key
+    from importlib.metadata import PackageNotFoundError, version
+
+    package_versions: List[Tuple[str, str]] = []
+    for package in ("talonfmt", "doc_printer", "tree_sitter_talon"):
+        try:
+            package_versions.append((package, version(package)))
+        except PackageNotFoundError:
+            package_versions.append((package, "unknown"))
+    return tuple(package_versions)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_source_digest() -> str:
+    # NOTE: an editable install may change without a change to its version
+    digest = hashlib.sha256()
+    for path in sorted(Path(__file__).parent.glob("*.py")):
+        digest.update(path.name.encode("utf-8"))
+        digest.update(b"\0")
+        try:
+            digest.update(path.read_bytes())
+        except OSError:
+            pass
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+@dataclass(frozen=True)
+class CacheEntry:
+    # The formatted output, or None if the input was already formatted
+    output: Optional[str]
+
+    @property
+    def unchanged(self) -> bool:
+        return self.output is None
+
+
+@dataclass
+class ResultCache:
+    """
+    A persistent cache of formatting results, keyed by content hash.
+
+    The key for an entry includes the version of talonfmt and its formatting
+    dependencies, a hash of the source of talonfmt, and all options that
+    affect the output, so entries never have to be invalidated explicitly.
+    """
+
+    cache_dir: Path
+    max_size: int = DEFAULT_MAX_SIZE
+
+    def key(self, contents: bytes, *, options: Mapping[str, Any]) -> str:
+        """
+        Compute the cache key for the given file contents and options.
+        """
+        header = json.dumps(
+            {
+                "versions": _get_package_versions(),
+                "source": _get_source_digest(),
+                "options": options,
+            },
+            sort_keys=True,
+            default=str,
+        )
+        digest = hashlib.sha256(header.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(contents)
+        return digest.hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / key
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """
+        Get the cache entry for the given key, if any.
+        """
+        path = self.path(key)
+        try:
+            data = path.read_bytes()
+        except OSError:
+            return None
+        # Mark the entry as recently used, which is used during eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        if data.startswith(_UNCHANGED):
+            return CacheEntry(output=None)
+        if data.startswith(_FORMATTED):
+            return CacheEntry(output=data[len(_FORMATTED) :].decode("utf-8"))
+        return None
+
+    def put(self, key: str, *, output: Optional[str]) -> None:
+        """
+        Store the output for the given key, or None if the input was unchanged.
+        """
+        if output is None:
+            data = _UNCHANGED
+        else:
+            data = _FORMATTED + output.encode("utf-8")
+        path = self.path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # NOTE: write to a temporary file first, so concurrent processes
+            #       never observe partially written entries
+            fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "wb") as handle:
+                    handle.write(data)
+                os.replace(tmp, path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+        except OSError:
+            # NOTE: the cache is an optimisation, so failure to write is not fatal
+            pass
+
+    def prune(self) -> None:
+        """
+        Evict the least recently used entries until the cache fits its maximum size.
+        """
+        entries: List[Tuple[float, int, Path]] = []
+        total_size: int = 0
+        try:
+            for subdir in self.cache_dir.iterdir():
+                if not subdir.is_dir():
+                    continue
+                for path in subdir.iterdir():
+                    stat = path.stat()
+                    entries.append((stat.st_mtime, stat.st_size, path))
+                    total_size += stat.st_size
+        except OSError:
+            return
+        if total_size <= self.max_size:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total_size -= size
+            if total_size <= self.max_size:
+                break
@@ -1,14 +1,15 @@
-import io
-import pathlib
+import os
 import sys
-import tokenize
 from pathlib import Path
-from typing import List, Optional, Tuple, Union
+from time import perf_counter
+from typing import List, Optional, Tuple
 
 import click
-from tree_sitter_talon import ParseError
 
-from . import __version__, talonfmt
+from . import DEFAULT_MAX_NESTING_DEPTH, TalonFmt, __version__
+from .cache import ResultCache, get_default_cache_dir
+from .files import FormatResult, format_contents, format_files
+from .profile import Profile
 
 
 @click.command(name="talonfmt")
@@ -27,6 +28,13 @@ from . import __version__, talonfmt
     default=True,
     show_default=True,
 )
+@click.option(
+    "--safety",
+    type=click.Choice(["equivalence", "idempotence", "full"], case_sensitive=False),
+    default="full",
+    show_default=True,
+    help="Check that the output is equivalent, stable under formatting, or both.",
+)
 @click.option(
     "--indent-size",
     type=int,  # Optional[int]
@@ -37,6 +45,35 @@ from . import __version__, talonfmt
     type=int,  # Optional[int]
     show_default=True,
 )
+@click.option(
+    "--lookahead",
+    type=click.IntRange(min=1),
+    help="Maximum number of lines rendered ahead when choosing a layout with "
+    "--max-line-width. Bounds the time spent on very long files, but a line "
+    "past the lookahead may exceed the maximum line width.  [default: unbounded]",
+)
+@click.option(
+    "--max-input-size",
+    type=click.IntRange(min=0),
+    metavar="BYTES",
+    help="Report files larger than the given size as errors, rather than "
+    "formatting them.  [default: unbounded]",
+)
+@click.option(
+    "--max-nesting-depth",
+    type=click.IntRange(min=1),
+    default=DEFAULT_MAX_NESTING_DEPTH,
+    show_default=True,
+    help="Report files whose syntax tree is nested deeper than the given depth "
+    "as errors, rather than formatting them.",
+)
+@click.option(
+    "--max-render-time",
+    type=click.FloatRange(min=0),
+    metavar="SECONDS",
+    help="Maximum time spent rendering a file with --max-line-width, after "
+    "which it is rendered with the simple layout.  [default: unbounded]",
+)
 @click.option(
     "--simple-layout",
     type=click.Choice(["shortest", "longest"], case_sensitive=False),
@@ -89,11 +126,109 @@ from . import __version__, talonfmt
     default=False,
     show_default=True,
 )
+@click.option(
+    "--check",
+    is_flag=True,
+    default=False,
+    help="Check whether the files are formatted, without writing any output. "
+    "Exits with the same status as --fail-on-change.",
+)
+@click.option(
+    "--exclude",
+    metavar="GLOB",
+    multiple=True,
+    help="Exclude files and directories which match the glob when searching "
+    "directories. Replaces the default excludes, such as .git and node_modules. "
+    "Files ignored by .gitignore are always excluded.",
+)
+@click.option(
+    "--extend-exclude",
+    metavar="GLOB",
+    multiple=True,
+    help="Exclude files and directories which match the glob, in addition to "
+    "the excludes.",
+)
+@click.option(
+    "--changed-since",
+    metavar="REF",
+    help="Only format the files which changed since the given git commit, "
+    "including untracked files. "
+    "Paths outside a git repository are formatted in full.",
+)
+@click.option(
+    "--staged",
+    is_flag=True,
+    default=False,
+    help="Only format the files with changes staged in git. "
+    "Paths outside a git repository are formatted in full.",
+)
 @click.option(
     "--fail-on-error/--no-fail-on-error",
     default=False,
     show_default=True,
 )
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=os.cpu_count() or 1,
+    show_default="number of CPUs",
+    help="Number of processes used to format files.",
+)
+@click.option(
+    "--cache/--no-cache",
+    default=True,
+    show_default=True,
+    help="Cache the results for unchanged files.",
+)
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False, dir_okay=True, writable=True),
+    help="Directory used to store the cache.  [default: user cache directory]",
+)
+@click.option(
+    "--profile/--no-profile",
+    default=False,
+    show_default=True,
+    help="Report the time spent in each phase and on the slowest files.",
+)
+@click.option(
+    "--profile-slowest",
+    type=click.IntRange(min=0),
+    default=10,
+    show_default=True,
+    help="Number of files listed as the slowest by --profile.",
+)
+@click.option(
+    "--profile-json",
+    type=click.Path(file_okay=True, dir_okay=False, writable=True),
+    help="Write the profile, including the time spent on each file, as JSON.",
+)
+@click.option(
+    "--watch",
+    is_flag=True,
+    default=False,
+    help="Watch the paths, and format files in place whenever they are written.",
+)
+@click.option(
+    "--daemon",
+    type=click.Choice(["socket", "stdio"], case_sensitive=False),
+    default=None,
+    help="Run as a daemon, which serves formatting requests on a Unix socket "
+    "or on stdio, using the given options as defaults.",
+)
+@click.option(
+    "--socket",
+    "socket_path",
+    type=click.Path(dir_okay=False),
+    help="Path of the socket used by the daemon.  [default: user runtime directory]",
+)
+@click.option(
+    "--lsp",
+    is_flag=True,
+    default=False,
+    help="Run as a language server on stdio, using the given options.",
+)
 @click.option(
     "--verbose/--quiet",
     default=True,
@@ -108,8 +243,13 @@ def cli(
     *,
     path: Tuple[str, ...],
     safe: bool = True,
+    safety: str,
     indent_size: Optional[int],
     max_line_width: Optional[int],
+    lookahead: Optional[int],
+    max_input_size: Optional[int],
+    max_nesting_depth: Optional[int],
+    max_render_time: Optional[float],
     align_match_context: bool,
     align_match_context_at: Optional[int],
     align_short_commands: bool,
@@ -121,75 +261,199 @@ def cli(
     in_place: bool,
     fail_on_change: bool,
     fail_on_error: bool,
+    check: bool,
+    exclude: Tuple[str, ...],
+    extend_exclude: Tuple[str, ...],
+    changed_since: Optional[str],
+    staged: bool,
+    jobs: int,
+    cache: bool,
+    cache_dir: Optional[str],
+    profile: bool,
+    profile_slowest: int,
+    profile_json: Optional[str],
+    watch: bool,
+    daemon: Optional[str],
+    socket_path: Optional[str],
+    lsp: bool,
     verbose: bool,
 ) -> None:
-    files_changed: List[str] = []
+    talon_fmt = TalonFmt(
+        safe=safety if safe else False,
+        indent_size=indent_size,
+        max_line_width=max_line_width,
+        align_match_context=align_match_context,
+        align_match_context_at=align_match_context_at,
+        align_short_commands=align_short_commands,
+        align_short_commands_at=align_short_commands_at,
+        simple_layout=simple_layout,
+        empty_match_context=empty_match_context,
+        format_comments=format_comments,
+        preserve_blank_lines=preserve_blank_lines,
+        lookahead=lookahead,
+        max_input_size=max_input_size,
+        max_nesting_depth=max_nesting_depth,
+        max_render_time=max_render_time,
+    )
+
+    if lsp:
+        from .lsp import LanguageServer
+
+        exit(LanguageServer(talon_fmt=talon_fmt).serve_stdio())
 
-    def readfile(filename: Path) -> Tuple[str, str]:
-        with filename.open(mode="rb") as fp:
-            bytes_on_disk = fp.read()
-        encoding, _ = tokenize.detect_encoding(io.BytesIO(bytes_on_disk).readline)
-        with io.TextIOWrapper(io.BytesIO(bytes_on_disk), encoding) as wrapper:
-            contents = wrapper.read()
-        return (contents, encoding)
-
-    def format(
-        contents: str, *, encoding: str, filename: Optional[str] = None
-    ) -> Optional[str]:
+    if daemon is not None:
+        from .daemon import Daemon, DaemonError
+
+        talon_fmt_daemon = Daemon(options=talon_fmt.options)
+        if daemon == "stdio":
+            talon_fmt_daemon.serve_stdio()
+        else:
+            try:
+                talon_fmt_daemon.serve_socket(socket_path)
+            except DaemonError as e:
+                sys.stderr.write(f"{e}\n")
+                exit(1)
+        exit(0)
+
+    if watch:
+        from .discovery import DEFAULT_EXCLUDES, FileFinder
+        from .watch import Watcher
+
+        def report_watch(result: FormatResult) -> None:
+            if result.error is not None:
+                sys.stderr.write(result.error)
+            elif result.changed and verbose:
+                sys.stderr.write(f"Fixed {result.filename}\n")
+
+        watcher = Watcher(
+            talon_fmt=talon_fmt,
+            paths=[Path(file_or_dir) for file_or_dir in path or (".",)],
+            file_finder=FileFinder(
+                exclude=(exclude or DEFAULT_EXCLUDES) + extend_exclude
+            ),
+            on_result=report_watch,
+        )
+        if verbose:
+            sys.stderr.write("Watching for changes, press Ctrl+C to stop\n")
         try:
-            output = talonfmt(
-                contents,
-                filename=filename,
-                encoding=encoding,
-                safe=safe,
-                indent_size=indent_size,
-                max_line_width=max_line_width,
-                align_match_context=align_match_context,
-                align_match_context_at=align_match_context_at,
-                align_short_commands=align_short_commands,
-                align_short_commands_at=align_short_commands_at,
-                simple_layout=simple_layout,
-                empty_match_context=empty_match_context,
-                format_comments=format_comments,
-                preserve_blank_lines=preserve_blank_lines,
-            )
-            if contents != output and filename:
-                if verbose:
-                    sys.stderr.write(f"Fixed {filename}\n")
-                files_changed.append(filename)
-            return output
-        except ParseError as e:
-            sys.stderr.write(str(e))
+            watcher.run()
+        except KeyboardInterrupt:
+            pass
+        exit(0)
+
+    files_changed: List[str] = []
+    start = perf_counter()
+    run_profile = Profile()
+
+    def report(result: FormatResult) -> None:
+        run_profile.add(
+            filename=result.filename or "<stdin>",
+            seconds=result.seconds,
+            timings=result.timings,
+            counts=result.counts,
+        )
+        if result.error is not None:
+            sys.stderr.write(result.error)
             if fail_on_error:
                 exit(1)
-        return None
-
-    def format_file(filename: Path) -> None:
-        contents, encoding = readfile(filename)
-        output = format(contents, encoding=encoding, filename=str(filename))
-        if output:
-            if in_place:
-                with filename.open(mode="w") as handle:
-                    handle.write(output)
-            else:
-                sys.stdout.write(output)
+        if result.changed and result.filename:
+            if verbose:
+                if check:
+                    sys.stderr.write(f"Would fix {result.filename}\n")
+                else:
+                    sys.stderr.write(f"Fixed {result.filename}\n")
+            files_changed.append(result.filename)
+
+    def write(result: FormatResult) -> None:
+        if result.output:
+            sys.stdout.write(result.output)
+
+    # Only format the files changed according to git, in the current directory
+    # if no paths are given
+    if (changed_since is not None or staged) and not path:
+        path = (".",)
 
     if path:
+        from .discovery import DEFAULT_EXCLUDES, FileFinder, deduplicate
+
+        file_finder = FileFinder(exclude=(exclude or DEFAULT_EXCLUDES) + extend_exclude)
+        files: List[Path] = []
         for file_or_dir in path:
             file_or_dir_path = Path(file_or_dir)
+            if changed_since is not None or staged:
+                from .git import GitError, get_changed_files
+
+                try:
+                    changed_files = get_changed_files(
+                        file_or_dir_path, since=changed_since, staged=staged
+                    )
+                except GitError as e:
+                    sys.stderr.write(f"{e}\n")
+                    exit(1)
+                if changed_files is not None:
+                    # NOTE: like the files found by walking the directory, the
+                    #       changed files are subject to the excludes
+                    if file_or_dir_path.is_dir():
+                        changed_files = [
+                            file
+                            for file in changed_files
+                            if file_finder.includes(file_or_dir_path, file)
+                        ]
+                    files.extend(changed_files)
+                    continue
             if file_or_dir_path.is_file():
-                format_file(file_or_dir_path)
+                files.append(file_or_dir_path)
             if file_or_dir_path.is_dir():
-                for file in file_or_dir_path.glob("**/*.talon"):
-                    format_file(file)
+                files.extend(file_finder.walk(file_or_dir_path))
+
+        # NOTE: files may be found more than once, via overlapping paths
+        files = deduplicate(files)
+
+        # NOTE: results are reported and written in the order of the files,
+        #       regardless of the order in which the workers finish them
+        result_cache: Optional[ResultCache] = None
+        if cache:
+            result_cache = ResultCache(
+                Path(cache_dir) if cache_dir else get_default_cache_dir()
+            )
+
+        # NOTE: output written to stdout is streamed, if it is formatted in
+        #       this process, to avoid holding all of it in memory
+        for result in format_files(
+            talon_fmt,
+            files,
+            jobs=jobs,
+            cache=result_cache,
+            check=check,
+            in_place=in_place,
+            handle=None if in_place or check else sys.stdout,
+        ):
+            report(result)
+            write(result)
+
+        if result_cache:
+            result_cache.prune()
     else:
         contents = "".join(sys.stdin.readlines())
         encoding = sys.stdin.encoding
-        output = format(contents, encoding=encoding)
-        if output:
-            sys.stdout.write(output)
+        result = format_contents(
+            talon_fmt,
+            contents,
+            encoding=encoding,
+            check=check,
+            handle=None if check else sys.stdout,
+        )
+        report(result)
+        write(result)
+
+    run_profile.seconds = perf_counter() - start
+    if profile:
+        run_profile.write_report(sys.stderr, slowest=profile_slowest)
+    if profile_json:
+        with Path(profile_json).open(mode="w", encoding="utf-8") as handle:
+            run_profile.write_json(handle)
 
-    if fail_on_change and files_changed:
+    if (fail_on_change or check) and files_changed:
         exit(2)
     else:
         exit(0)
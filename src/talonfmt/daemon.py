@@ -0,0 +1,330 @@
+import argparse
+import json
+import os
+import socket
+import stat
+import sys
+import tempfile
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import IO, Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from . import TalonFmt
+
+# The protocol is line-based: each request and response is a JSON object on a
+# single line. A request has the following fields, all of which are optional:
+#
+#   id:       an identifier, which is copied to the response
+#   method:   "format" (default), "check", "ping", or "shutdown"
+#   contents: the contents to format
+#   filename: the file name, which is used to resolve the .editorconfig
+#   options:  options for TalonFmt, which override those of the daemon
+#
+# A response has the field "output" with the formatted contents, or "changed"
+# with the verdict for "check", or "error" with the error message.
+
+Request = Dict[str, Any]
+
+Response = Dict[str, Any]
+
+# The maximum number of instances of TalonFmt kept by the daemon, each for a
+# different set of options
+MAX_TALON_FMTS: int = 8
+
+
+def get_default_socket_path() -> str:
+    """
+    Get the default path for the socket of the daemon.
+
+    If XDG_RUNTIME_DIR is not set, the socket is put in a directory in the
+    temporary directory, which is created so only the user can access it.
+    """
+    socket_path = os.environ.get("TALONFMT_SOCKET", None)
+    if socket_path:
+        return socket_path
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR", None)
+    if runtime_dir:
+        return os.path.join(runtime_dir, "talonfmt.sock")
+    uid = os.getuid() if hasattr(os, "getuid") else 0
+    private_dir = os.path.join(tempfile.gettempdir(), f"talonfmt-{uid}")
+    try:
+        os.mkdir(private_dir, 0o700)
+    except FileExistsError:
+        pass
+    check_owner(private_dir, private=True)
+    return os.path.join(private_dir, "talonfmt.sock")
+
+
+def check_owner(path: str, *, private: bool = False) -> None:
+    """
+    Raise PermissionError if the file is owned by another user, who could
+    read the requests sent to it. If private is set, also raise it if other
+    users have any access to the file.
+    """
+    if not hasattr(os, "getuid"):
+        return
+    try:
+        file_stat = os.lstat(path)
+    except FileNotFoundError:
+        return
+    if file_stat.st_uid != os.getuid():
+        raise PermissionError(f"Refusing to use {path}: it is owned by another user")
+    if private and stat.S_IMODE(file_stat.st_mode) & 0o077:
+        raise PermissionError(f"Refusing to use {path}: other users can access it")
+
+
+class DaemonError(Exception):
+    pass
+
+
+################################################################################
+# Server
+################################################################################
+
+
+@dataclass
+class Daemon:
+    """
+    A long-lived formatter, which keeps its parsers, formatters, and renderers
+    warm between requests.
+    """
+
+    options: Mapping[str, Any] = field(default_factory=dict)
+
+    # Instances of TalonFmt by their options, least recently used first
+    _talon_fmts: "OrderedDict[str, TalonFmt]" = field(
+        default_factory=OrderedDict, init=False, repr=False, compare=False
+    )
+
+    def get_talon_fmt(self, options: Optional[Mapping[str, Any]]) -> TalonFmt:
+        options = {**self.options, **(options or {})}
+        if "preserve_blank_lines" in options:
+            options["preserve_blank_lines"] = tuple(options["preserve_blank_lines"])
+        key = json.dumps(options, sort_keys=True)
+        talon_fmt = self._talon_fmts.get(key, None)
+        if talon_fmt is None:
+            talon_fmt = TalonFmt(**options)
+            self._talon_fmts[key] = talon_fmt
+            if len(self._talon_fmts) > MAX_TALON_FMTS:
+                self._talon_fmts.popitem(last=False)
+        else:
+            self._talon_fmts.move_to_end(key)
+        return talon_fmt
+
+    def handle(self, request: Request) -> Response:
+        response: Response = {"id": request.get("id", None)}
+        method = request.get("method", "format")
+        # NOTE: the daemon must outlive any request, so all errors are reported
+        try:
+            if method == "ping" or method == "shutdown":
+                pass
+            elif method == "format" or method == "check":
+                talon_fmt = self.get_talon_fmt(request.get("options", None))
+                contents = request["contents"]
+                filename = request.get("filename", None)
+                if method == "check":
+                    unchanged = talon_fmt.check(contents, filename=filename)
+                    response["changed"] = not unchanged
+                else:
+                    response["output"] = talon_fmt(contents, filename=filename)
+            else:
+                raise DaemonError(f"Unknown method '{method}'")
+        except Exception as e:
+            response["error"] = str(e) or type(e).__name__
+        return response
+
+    def serve(self, rfile: IO[str], wfile: IO[str]) -> bool:
+        """
+        Serve requests from rfile until the end of the stream.
+
+        Returns False if the daemon received a shutdown request.
+        """
+        for line in rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("Expected a JSON object")
+            except ValueError as e:
+                response: Response = {"id": None, "error": str(e)}
+                request = {}
+            else:
+                response = self.handle(request)
+            wfile.write(json.dumps(response) + "\n")
+            wfile.flush()
+            if request.get("method", None) == "shutdown":
+                return False
+        return True
+
+    def serve_stdio(self) -> None:
+        self.serve(sys.stdin, sys.stdout)
+
+    def serve_socket(self, socket_path: Optional[str] = None) -> None:
+        try:
+            socket_path = socket_path or get_default_socket_path()
+            check_owner(socket_path)
+        except PermissionError as e:
+            raise DaemonError(str(e)) from e
+        # NOTE: a socket left behind by a daemon that crashed would prevent bind
+        if os.path.exists(socket_path):
+            if _is_daemon_running(socket_path):
+                raise DaemonError(f"A daemon is already listening on {socket_path}")
+            os.unlink(socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            server.bind(socket_path)
+            server.listen()
+            running = True
+            while running:
+                connection, _ = server.accept()
+                with connection:
+                    with connection.makefile("r", encoding="utf-8") as rfile:
+                        with connection.makefile("w", encoding="utf-8") as wfile:
+                            try:
+                                running = self.serve(rfile, wfile)
+                            except OSError:
+                                # NOTE: the client disconnected
+                                pass
+        finally:
+            server.close()
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+
+
+def _is_daemon_running(socket_path: str) -> bool:
+    try:
+        with DaemonClient(socket_path) as client:
+            client.request({"method": "ping"})
+        return True
+    except OSError:
+        return False
+
+
+################################################################################
+# Client
+################################################################################
+
+
+class DaemonClient:
+    """
+    A connection to a running daemon.
+    """
+
+    def __init__(self, socket_path: Optional[str] = None, timeout: float = 10.0):
+        self.socket_path = socket_path or get_default_socket_path()
+        # NOTE: a socket owned by another user may not be a daemon of this user
+        check_owner(self.socket_path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.settimeout(timeout)
+        try:
+            self._socket.connect(self.socket_path)
+        except OSError:
+            self._socket.close()
+            raise
+        self._rfile = self._socket.makefile("r", encoding="utf-8")
+        self._wfile = self._socket.makefile("w", encoding="utf-8")
+
+    def __enter__(self) -> "DaemonClient":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._rfile.close()
+        self._wfile.close()
+        self._socket.close()
+
+    def request(self, request: Request) -> Response:
+        self._wfile.write(json.dumps(request) + "\n")
+        self._wfile.flush()
+        line = self._rfile.readline()
+        if not line:
+            raise ConnectionError("The daemon closed the connection")
+        response: Response = json.loads(line)
+        return response
+
+
+def format_with_daemon(
+    contents: str,
+    *,
+    filename: Optional[str] = None,
+    options: Optional[Mapping[str, Any]] = None,
+    socket_path: Optional[str] = None,
+    fallback: bool = True,
+) -> str:
+    """
+    Format the contents using a running daemon.
+
+    If the daemon cannot be reached and fallback is set, the contents are
+    formatted in-process instead.
+    """
+    try:
+        with DaemonClient(socket_path) as client:
+            response = client.request(
+                {"contents": contents, "filename": filename, "options": options or {}}
+            )
+    except (OSError, AttributeError) as e:
+        # NOTE: AttributeError is raised if the platform has no AF_UNIX
+        if not fallback:
+            raise e
+        return _format_in_process(contents, filename=filename, options=options)
+    if "error" in response:
+        raise DaemonError(response["error"])
+    output: str = response["output"]
+    return output
+
+
+def _format_in_process(
+    contents: str,
+    *,
+    filename: Optional[str],
+    options: Optional[Mapping[str, Any]],
+) -> str:
+    try:
+        return Daemon().get_talon_fmt(options)(contents, filename=filename)
+    except Exception as e:
+        raise DaemonError(str(e) or type(e).__name__) from e
+
+
+def _parse_options(pairs: Sequence[str]) -> Tuple[Tuple[str, Any], ...]:
+    options = []
+    for pair in pairs:
+        name, _, value = pair.partition("=")
+        try:
+            options.append((name.replace("-", "_"), json.loads(value)))
+        except ValueError:
+            options.append((name.replace("-", "_"), value))
+    return tuple(options)
+
+
+def client(argv: Optional[List[str]] = None) -> None:
+    """
+    Format standard input using a running daemon, or in-process if there is none.
+    """
+    parser = argparse.ArgumentParser(prog="talonfmt-client")
+    parser.add_argument("--socket", default=None)
+    parser.add_argument("--filename", default=None)
+    parser.add_argument(
+        "--option",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="An option for talonfmt, e.g., --option max_line_width=80",
+    )
+    parser.add_argument("--no-fallback", dest="fallback", action="store_false")
+    args = parser.parse_args(argv)
+    contents = sys.stdin.read()
+    try:
+        output = format_with_daemon(
+            contents,
+            filename=args.filename,
+            options=dict(_parse_options(args.option)),
+            socket_path=args.socket,
+            fallback=args.fallback,
+        )
+    except (OSError, DaemonError) as e:
+        sys.stderr.write(f"{e}\n")
+        exit(1)
+    sys.stdout.write(output)
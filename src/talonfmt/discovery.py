@@ -0,0 +1,227 @@
+import fnmatch
+import os
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+if TYPE_CHECKING:
+    from pathspec import GitIgnoreSpec
+
+# The parsed .gitignore files, each with the directory that contains it
+GitIgnores = List[Tuple[str, "GitIgnoreSpec"]]
+
+# The directories which are excluded by default
+DEFAULT_EXCLUDES: Tuple[str, ...] = (
+    ".direnv",
+    ".eggs",
+    ".git",
+    ".hg",
+    ".mypy_cache",
+    ".nox",
+    ".pytest_cache",
+    ".svn",
+    ".tox",
+    ".venv",
+    "__pycache__",
+    "node_modules",
+    "venv",
+)
+
+
+def deduplicate(files: Iterable[Path]) -> List[Path]:
+    """
+    Remove any file which refers to the same path as a previous file.
+    """
+    seen: Set[str] = set()
+    unique_files: List[Path] = []
+    for file in files:
+        key = os.path.normcase(os.path.abspath(file))
+        if key not in seen:
+            seen.add(key)
+            unique_files.append(file)
+    return unique_files
+
+
+@dataclass
+class FileFinder:
+    """
+    Find the files with the given suffix in a directory tree.
+
+    Directories which match an exclude glob or a .gitignore file are pruned
+    before they are entered. The exclude globs are matched against the name
+    and against the path relative to the directory that is searched.
+    """
+
+    exclude: Sequence[str] = DEFAULT_EXCLUDES
+    gitignore: bool = True
+    suffix: str = ".talon"
+
+    # The parsed .gitignore files by directory, or None if there are none
+    _gitignores: Dict[str, Optional["GitIgnoreSpec"]] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self) -> None:
+        self._exclude_pattern: Optional[re.Pattern[str]] = None
+        if self.exclude:
+            self._exclude_pattern = re.compile(
+                "|".join(fnmatch.translate(glob) for glob in self.exclude)
+            )
+
+    def walk(self, root: Path, *, directories: bool = False) -> Iterator[Path]:
+        """
+        Find the files in the directory tree, in sorted order. If directories
+        is set, the directories which are searched are included as well.
+        """
+        root_str = os.fspath(root)
+        root_abs = os.path.abspath(root_str)
+        ignores: GitIgnores = []
+        if self.gitignore:
+            ignores = self.get_parent_gitignores(root_abs)
+
+        # NOTE: the stack holds the directories which remain to be searched,
+        #       each with its path relative to the root and its .gitignores
+        stack: List[Tuple[str, str, GitIgnores]] = [(root_abs, "", ignores)]
+        while stack:
+            directory, relative, ignores = stack.pop()
+            if directories:
+                yield Path(os.path.join(root_str, relative))
+            if self.gitignore:
+                gitignore = self.get_gitignore(directory)
+                if gitignore is not None:
+                    ignores = [*ignores, (directory, gitignore)]
+            try:
+                with os.scandir(directory) as iterator:
+                    entries = sorted(iterator, key=lambda entry: entry.name)
+            except OSError:
+                continue
+            subdirectories: List[Tuple[str, str, GitIgnores]] = []
+            for entry in entries:
+                entry_relative = f"{relative}{entry.name}"
+                try:
+                    # NOTE: like Path.glob, do not follow symbolic links
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    continue
+                if is_dir:
+                    if not self.is_excluded(
+                        entry.name, entry_relative, is_dir=True
+                    ) and not is_ignored(entry.path, ignores, is_dir=True):
+                        subdirectories.append(
+                            (entry.path, f"{entry_relative}/", ignores)
+                        )
+                elif entry.name.endswith(self.suffix) and entry.is_file():
+                    if not self.is_excluded(
+                        entry.name, entry_relative, is_dir=False
+                    ) and not is_ignored(entry.path, ignores, is_dir=False):
+                        yield Path(os.path.join(root_str, entry_relative))
+            stack.extend(reversed(subdirectories))
+
+    def includes(self, root: Path, path: Path, *, is_dir: bool = False) -> bool:
+        """
+        Test whether walking the directory tree would find the file, or enter
+        the directory if is_dir is set.
+        """
+        root_abs = os.path.abspath(root)
+        path_abs = os.path.abspath(path)
+        if not path_abs.startswith(os.path.join(root_abs, "")):
+            return False
+        if not is_dir and not path_abs.endswith(self.suffix):
+            return False
+        ignores: GitIgnores = []
+        if self.gitignore:
+            ignores = self.get_parent_gitignores(root_abs)
+        parts = path_abs[len(root_abs) :].strip(os.sep).split(os.sep)
+        directory, relative = root_abs, ""
+        for index, part in enumerate(parts):
+            if self.gitignore:
+                gitignore = self.get_gitignore(directory)
+                if gitignore is not None:
+                    ignores = [*ignores, (directory, gitignore)]
+            part_is_dir = is_dir or index < len(parts) - 1
+            part_path = os.path.join(directory, part)
+            if self.is_excluded(
+                part, f"{relative}{part}", is_dir=part_is_dir
+            ) or is_ignored(part_path, ignores, is_dir=part_is_dir):
+                return False
+            directory, relative = part_path, f"{relative}{part}/"
+        return True
+
+    def is_excluded(self, name: str, relative: str, *, is_dir: bool) -> bool:
+        """
+        Test whether a file or directory matches an exclude glob.
+        """
+        if self._exclude_pattern is None:
+            return False
+        match = self._exclude_pattern.match
+        return bool(
+            match(name) or match(relative) or (is_dir and match(f"{relative}/"))
+        )
+
+    def get_gitignore(self, directory: str) -> Optional["GitIgnoreSpec"]:
+        """
+        Get the parsed .gitignore file in the directory, if any.
+        """
+        if directory in self._gitignores:
+            return self._gitignores[directory]
+        gitignore: Optional["GitIgnoreSpec"] = None
+        try:
+            with open(
+                os.path.join(directory, ".gitignore"), encoding="utf-8"
+            ) as handle:
+                lines = handle.read().splitlines()
+        except (OSError, UnicodeDecodeError):
+            pass
+        else:
+            # NOTE: pathspec is slow to import, so only import it when needed
+            from pathspec import GitIgnoreSpec
+
+            gitignore = GitIgnoreSpec.from_lines(lines)
+        self._gitignores[directory] = gitignore
+        return gitignore
+
+    def get_parent_gitignores(self, directory: str) -> GitIgnores:
+        """
+        Get the parsed .gitignore files in the parents of the directory, up to
+        the root of its git repository, if any.
+        """
+        parents: List[str] = []
+        parent = directory
+        while not os.path.exists(os.path.join(parent, ".git")):
+            parent, child = os.path.split(parent)
+            if not child:
+                # NOTE: the directory is not inside a git repository
+                return []
+            parents.append(parent)
+        ignores: GitIgnores = []
+        for parent in reversed(parents):
+            gitignore = self.get_gitignore(parent)
+            if gitignore is not None:
+                ignores.append((parent, gitignore))
+        return ignores
+
+
+def is_ignored(path: str, ignores: GitIgnores, *, is_dir: bool) -> bool:
+    """
+    Test whether a path is matched by any of the given .gitignore files.
+    """
+    for directory, gitignore in ignores:
+        relative = path[len(directory) :].lstrip(os.sep)
+        if os.sep != "/":
+            relative = relative.replace(os.sep, "/")
+        if is_dir:
+            relative = f"{relative}/"
+        if gitignore.match_file(relative):
+            return True
+    return False
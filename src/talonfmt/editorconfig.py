@@ -1,14 +1,171 @@
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, Optional, cast
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+################################################################################
+# Cache Statistics
+################################################################################
+
+
+@dataclass
+class EditorConfigCacheInfo:
+    # Number of .editorconfig files reused without parsing
+    parse_hits: int = 0
+    # Number of .editorconfig files parsed
+    parse_misses: int = 0
+    # Number of files whose properties were reused without matching
+    hits: int = 0
+    # Number of files whose properties were resolved
+    misses: int = 0
+
+
+_cache_info = EditorConfigCacheInfo()
+
+
+def get_editorconfig_cache_info() -> EditorConfigCacheInfo:
+    """
+    Get the statistics for the .editorconfig cache.
+    """
+    return EditorConfigCacheInfo(**vars(_cache_info))
+
 
 try:
-    from editorconfig import EditorConfigError, get_properties
+    from editorconfig import EditorConfigError
+    from editorconfig.handler import EditorConfigHandler
+    from editorconfig.ini import EditorConfigParser
 
-    def get_editorconfig(file: str) -> Dict[str, str]:
+    class _EditorConfigSectionParser(EditorConfigParser):  # type: ignore[misc]
+        """
+        Parse an .editorconfig file into its sections, independent of any file.
+        """
+
+        def __init__(self) -> None:
+            super().__init__("")
+            self.sections: List[Tuple[str, Dict[str, str]]] = []
+
+        def matches_filename(self, config_filename: str, glob: str) -> bool:
+            # NOTE: the parser writes the options for the current section to
+            #       self.options, so we start a new dictionary for each section
+            self.options: Dict[str, str] = OrderedDict()
+            self.sections.append((glob, self.options))
+            return True
+
+    class _EditorConfigFile(NamedTuple):
+        path: str
+        mtime_ns: int
+        root: bool
+        sections: Tuple[Tuple[str, Dict[str, str]], ...]
+        error: bool
+
+    # Parsed .editorconfig files by path, which are reused while unmodified
+    _editorconfig_files: Dict[str, _EditorConfigFile] = {}
+
+    # Resolved properties, shared by all files with the same key
+    _editorconfig_properties: Dict[
+        Tuple[Tuple[Tuple[str, int], ...], str], Dict[str, str]
+    ] = {}
+
+    def _read_editorconfig_file(path: str) -> Optional[_EditorConfigFile]:
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        editorconfig_file = _editorconfig_files.get(path, None)
+        if editorconfig_file is not None and editorconfig_file.mtime_ns == mtime_ns:
+            _cache_info.parse_hits += 1
+            return editorconfig_file
+        _cache_info.parse_misses += 1
+        parser = _EditorConfigSectionParser()
         try:
-            return cast(Dict[str, str], get_properties(Path(file).absolute()) or {})
+            parser.read(path)
+            error = False
         except EditorConfigError:
+            error = True
+        editorconfig_file = _EditorConfigFile(
+            path=path,
+            mtime_ns=mtime_ns,
+            root=parser.root_file,
+            sections=tuple(parser.sections),
+            error=error,
+        )
+        _editorconfig_files[path] = editorconfig_file
+        return editorconfig_file
+
+    def _get_editorconfig_files(directory: str) -> List[_EditorConfigFile]:
+        # NOTE: the files are ordered from the nearest to the root
+        editorconfig_files: List[_EditorConfigFile] = []
+        while True:
+            editorconfig_file = _read_editorconfig_file(
+                os.path.join(directory, ".editorconfig")
+            )
+            if editorconfig_file is not None:
+                editorconfig_files.append(editorconfig_file)
+                if editorconfig_file.root:
+                    break
+            parent = os.path.dirname(directory)
+            if parent == directory:
+                break
+            directory = parent
+        return editorconfig_files
+
+    def _resolve_editorconfig(
+        file: str, editorconfig_files: List[_EditorConfigFile]
+    ) -> Dict[str, str]:
+        if any(editorconfig_file.error for editorconfig_file in editorconfig_files):
             return {}
+        options: Dict[str, str] = OrderedDict()
+        matcher = EditorConfigParser(file)
+        for editorconfig_file in editorconfig_files:
+            file_options: Dict[str, str] = OrderedDict()
+            for glob, section in editorconfig_file.sections:
+                if matcher.matches_filename(editorconfig_file.path, glob):
+                    file_options.update(section)
+            # NOTE: options from nearer files take precedence
+            file_options.update(options)
+            options = file_options
+        handler = EditorConfigHandler(file)
+        handler.options = options
+        handler.preprocess_values()
+        return options
+
+    def get_editorconfig(file: str) -> Dict[str, str]:
+        file = str(Path(file).absolute())
+        directory, basename = os.path.split(file)
+        editorconfig_files = _get_editorconfig_files(directory)
+        # NOTE: unless a section matches on the path, the properties depend
+        #       only on the basename, so files in directories without their
+        #       own sections share their resolved properties
+        uses_path = any(
+            "/" in glob
+            for editorconfig_file in editorconfig_files
+            for glob, _ in editorconfig_file.sections
+        )
+        key = (
+            tuple(
+                (editorconfig_file.path, editorconfig_file.mtime_ns)
+                for editorconfig_file in editorconfig_files
+            ),
+            file if uses_path else basename,
+        )
+        properties = _editorconfig_properties.get(key, None)
+        if properties is not None:
+            _cache_info.hits += 1
+        else:
+            _cache_info.misses += 1
+            properties = _resolve_editorconfig(file, editorconfig_files)
+            _editorconfig_properties[key] = properties
+        return dict(properties)
+
+    def clear_editorconfig_cache() -> None:
+        """
+        Clear the .editorconfig cache and its statistics.
+        """
+        global _cache_info
+        _editorconfig_files.clear()
+        _editorconfig_properties.clear()
+        _cache_info = EditorConfigCacheInfo()
 
 except ModuleNotFoundError as e:
     if e.name != "editorconfig":
@@ -17,18 +174,25 @@ except ModuleNotFoundError as e:
     def get_editorconfig(file: str) -> Dict[str, str]:
         return {}
 
+    def clear_editorconfig_cache() -> None:
+        """
+        Clear the .editorconfig cache and its statistics.
+        """
+        global _cache_info
+        _cache_info = EditorConfigCacheInfo()
 
-def get_indent_size(file: str) -> Optional[int]:
-    indent_size = get_editorconfig(file).get("indent_size", None)
-    if indent_size is not None:
-        return int(indent_size)
+
+def get_int_property(properties: Dict[str, str], name: str) -> Optional[int]:
+    value = properties.get(name, None)
+    if value is not None:
+        return int(value)
     else:
         return None
 
 
+def get_indent_size(file: str) -> Optional[int]:
+    return get_int_property(get_editorconfig(file), "indent_size")
+
+
 def get_max_line_length(file: str) -> Optional[int]:
-    max_line_length = get_editorconfig(file).get("max_line_length", None)
-    if max_line_length is not None:
-        return int(max_line_length)
-    else:
-        return None
+    return get_int_property(get_editorconfig(file), "max_line_length")
@@ -0,0 +1,425 @@
+import io
+import os
+import stat
+import tempfile
+import tokenize
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+from time import perf_counter
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from . import LimitExceeded, TalonFmt, is_unchanged, timing
+from .cache import CacheEntry, ResultCache
+
+
+@dataclass(frozen=True)
+class FormatResult:
+    filename: Optional[str]
+    output: Optional[str]
+    changed: bool = False
+    error: Optional[str] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+    counts: Dict[str, int] = field(default_factory=dict)
+    # The time spent on the file, including reading it and using the cache
+    seconds: float = 0.0
+    # The encoding and newline style of the file, used to write the output
+    encoding: Optional[str] = None
+    newline: str = "\n"
+
+
+def readfile(filename: Path) -> Tuple[Union[str, bytes], str]:
+    with filename.open(mode="rb") as fp:
+        bytes_on_disk = fp.read()
+    return decode(bytes_on_disk)
+
+
+def decode(bytes_on_disk: bytes) -> Tuple[Union[str, bytes], str]:
+    """
+    Detect the encoding of the file contents, and decode them if necessary.
+
+    The parser reads UTF-8, so UTF-8 contents are returned as bytes, unless
+    their newlines must be translated. Otherwise, the contents are decoded.
+    """
+    encoding, _ = tokenize.detect_encoding(io.BytesIO(bytes_on_disk).readline)
+    if encoding == "utf-8" and b"\r" not in bytes_on_disk:
+        return (bytes_on_disk, encoding)
+    with io.TextIOWrapper(io.BytesIO(bytes_on_disk), encoding) as wrapper:
+        contents = wrapper.read()
+    return (contents, encoding)
+
+
+def detect_newline(bytes_on_disk: bytes) -> str:
+    """
+    Detect the newline style from the first line ending, if any.
+    """
+    index = bytes_on_disk.find(b"\n")
+    if index > 0 and bytes_on_disk[index - 1 : index] == b"\r":
+        return "\r\n"
+    if index < 0 and b"\r" in bytes_on_disk:
+        return "\r"
+    return "\n"
+
+
+def write_file(filename: Path, output: str, *, encoding: str, newline: str) -> int:
+    """
+    Write the output to the file in the given encoding and newline style, and
+    return the number of bytes written.
+
+    The output is written to a temporary file, which then replaces the file,
+    so the file is never partially written, and its permissions are kept. If
+    the file is a symbolic link, the file it links to is replaced instead.
+    """
+    if newline != "\n":
+        output = output.replace("\n", newline)
+    data = output.encode(encoding)
+    target = Path(os.path.realpath(filename))
+    fd, tmp = tempfile.mkstemp(dir=target.parent, prefix=f".{target.name}.")
+    try:
+        with os.fdopen(fd, "wb") as handle:
+            handle.write(data)
+        os.chmod(tmp, stat.S_IMODE(target.stat().st_mode))
+        os.replace(tmp, target)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return len(data)
+
+
+def write_stream(
+    chunks: Iterable[str],
+    handle: IO[str],
+    contents: Union[str, bytes],
+    *,
+    encoding: str,
+    buffer: Optional[List[str]] = None,
+) -> bool:
+    """
+    Write the chunks to the handle as they are rendered, and test whether
+    they differ from the contents. If a buffer is given, the chunks are also
+    appended to it.
+    """
+    position: int = 0
+    changed: bool = False
+    for chunk in chunks:
+        if buffer is not None:
+            buffer.append(chunk)
+        if not changed:
+            if isinstance(contents, bytes):
+                chunk_bytes = chunk.encode(encoding)
+                changed = not contents.startswith(chunk_bytes, position)
+                position += len(chunk_bytes)
+            else:
+                changed = not contents.startswith(chunk, position)
+                position += len(chunk)
+        handle.write(chunk)
+    return changed or position != len(contents)
+
+
+def format_contents(
+    talon_fmt: TalonFmt,
+    contents: Union[str, bytes],
+    *,
+    encoding: str,
+    filename: Optional[str] = None,
+    check: bool = False,
+    handle: Optional[IO[str]] = None,
+    buffer: Optional[List[str]] = None,
+    timings: Optional[Dict[str, float]] = None,
+    counts: Optional[Dict[str, int]] = None,
+) -> FormatResult:
+    """
+    Format the contents.
+
+    If a handle is given, the output is written to it as it is rendered,
+    rather than returned as part of the result. If a buffer is also given,
+    the output is appended to it as well.
+    """
+    start = perf_counter()
+    timings = {} if timings is None else timings
+    counts = {} if counts is None else counts
+
+    def on_timing(phase: str, seconds: float) -> None:
+        timings[phase] = timings.get(phase, 0.0) + seconds
+
+    def on_count(name: str, count: int) -> None:
+        counts[name] = counts.get(name, 0) + count
+
+    try:
+        if check:
+            unchanged = talon_fmt.check(
+                contents,
+                filename=filename,
+                encoding=encoding,
+                on_timing=on_timing,
+                on_count=on_count,
+            )
+            return FormatResult(
+                filename=filename,
+                output=None,
+                changed=not unchanged,
+                timings=timings,
+                counts=counts,
+                seconds=perf_counter() - start,
+            )
+        if handle is not None:
+            chunks = talon_fmt.stream(
+                contents,
+                filename=filename,
+                encoding=encoding,
+                on_timing=on_timing,
+                on_count=on_count,
+            )
+            changed = write_stream(
+                chunks, handle, contents, encoding=encoding, buffer=buffer
+            )
+            return FormatResult(
+                filename=filename,
+                output=None,
+                changed=changed,
+                timings=timings,
+                counts=counts,
+                seconds=perf_counter() - start,
+            )
+        output = talon_fmt(
+            contents,
+            filename=filename,
+            encoding=encoding,
+            on_timing=on_timing,
+            on_count=on_count,
+        )
+        return FormatResult(
+            filename=filename,
+            output=output,
+            changed=not is_unchanged(contents, output, encoding=encoding),
+            timings=timings,
+            counts=counts,
+            seconds=perf_counter() - start,
+        )
+    except Exception as e:
+        # NOTE: tree_sitter_talon is only loaded once the contents are parsed
+        from tree_sitter_talon import ParseError
+
+        error: str
+        if isinstance(e, ParseError):
+            error = str(e)
+        elif isinstance(e, LimitExceeded):
+            error = f"{e}\n"
+        else:
+            raise
+        return FormatResult(
+            filename=filename,
+            output=None,
+            error=error,
+            timings=timings,
+            counts=counts,
+            seconds=perf_counter() - start,
+        )
+
+
+def format_file(
+    talon_fmt: TalonFmt,
+    filename: Path,
+    *,
+    cache: Optional[ResultCache] = None,
+    check: bool = False,
+    in_place: bool = False,
+    write: bool = True,
+    handle: Optional[IO[str]] = None,
+) -> FormatResult:
+    """
+    Format the file.
+
+    If in_place is set, the output is written back to the file if it changed,
+    rather than returned as part of the result. If write is not set, the
+    output of a changed file is kept in the result instead, and is written
+    by write_result.
+    """
+    start = perf_counter()
+    timings: Dict[str, float] = {}
+    counts: Dict[str, int] = {}
+
+    def on_timing(phase: str, seconds: float) -> None:
+        timings[phase] = timings.get(phase, 0.0) + seconds
+
+    def on_count(name: str, count: int) -> None:
+        counts[name] = counts.get(name, 0) + count
+
+    with timing("read", on_timing):
+        with filename.open(mode="rb") as fp:
+            bytes_on_disk = fp.read()
+        contents, encoding = decode(bytes_on_disk)
+
+    entry: Optional[CacheEntry] = None
+    if cache is not None:
+        # The cache key includes the options resolved from .editorconfig
+        indent_size, max_line_width = talon_fmt.resolve_layout(
+            str(filename), on_timing=on_timing, on_count=on_count
+        )
+        with timing("cache", on_timing):
+            key = cache.key(
+                bytes_on_disk,
+                options={
+                    **talon_fmt.options,
+                    "indent_size": indent_size,
+                    "max_line_width": max_line_width,
+                    "encoding": encoding,
+                },
+            )
+            entry = cache.get(key)
+        on_count("cache:misses" if entry is None else "cache:hits", 1)
+
+    if entry is not None:
+        output = entry.output
+        if entry.unchanged and not (check or in_place):
+            output = contents if isinstance(contents, str) else bytes_on_disk.decode()
+        result = FormatResult(
+            filename=str(filename),
+            output=None if check else output,
+            changed=not entry.unchanged,
+            timings=timings,
+            counts=counts,
+        )
+    else:
+        # NOTE: the streamed output is only kept if it is needed for the cache
+        buffer: Optional[List[str]] = None
+        if cache is not None and handle is not None:
+            buffer = []
+        result = format_contents(
+            talon_fmt,
+            contents,
+            encoding=encoding,
+            filename=str(filename),
+            check=check,
+            handle=handle,
+            buffer=buffer,
+            timings=timings,
+            counts=counts,
+        )
+        # NOTE: in check mode, the output is only known if the file is unchanged
+        if cache is not None and result.error is None:
+            if not (check and result.changed):
+                if buffer is None:
+                    output = result.output
+                else:
+                    output = "".join(buffer)
+                with timing("cache", on_timing):
+                    cache.put(key, output=output if result.changed else None)
+
+    result = replace(
+        result,
+        seconds=perf_counter() - start,
+        encoding=encoding,
+        newline=detect_newline(bytes_on_disk),
+    )
+    if in_place and write:
+        result = write_result(result)
+    return result
+
+
+def write_result(result: FormatResult) -> FormatResult:
+    """
+    Write the output back to the file, if it changed, and return the result
+    without its output.
+    """
+    # NOTE: the file is only written if it changed, to avoid touching its mtime
+    if not result.changed or result.output is None or result.filename is None:
+        return result
+    assert result.encoding is not None, "the result has no encoding"
+    start = perf_counter()
+    bytes_written = write_file(
+        Path(result.filename),
+        result.output,
+        encoding=result.encoding,
+        newline=result.newline,
+    )
+    seconds = perf_counter() - start
+    timings = result.timings
+    counts = result.counts
+    timings["write"] = timings.get("write", 0.0) + seconds
+    counts["write:files"] = counts.get("write:files", 0) + 1
+    counts["write:bytes"] = counts.get("write:bytes", 0) + bytes_written
+    return replace(result, output=None, seconds=result.seconds + seconds)
+
+
+################################################################################
+# Parallel Formatting
+################################################################################
+
+# The instance of TalonFmt and the settings owned by a worker process
+_worker_talon_fmt: Optional[TalonFmt] = None
+_worker_cache: Optional[ResultCache] = None
+_worker_check: bool = False
+_worker_in_place: bool = False
+
+
+def _init_worker(
+    talon_fmt: TalonFmt, cache: Optional[ResultCache], check: bool, in_place: bool
+) -> None:
+    global _worker_talon_fmt, _worker_cache, _worker_check, _worker_in_place
+    _worker_talon_fmt = talon_fmt
+    _worker_cache = cache
+    _worker_check = check
+    _worker_in_place = in_place
+
+
+def _format_file_in_worker(filename: Path) -> FormatResult:
+    assert _worker_talon_fmt is not None, "worker was not initialised"
+    return format_file(
+        _worker_talon_fmt,
+        filename,
+        cache=_worker_cache,
+        check=_worker_check,
+        in_place=_worker_in_place,
+        write=False,
+    )
+
+
+def format_files(
+    talon_fmt: TalonFmt,
+    files: Sequence[Path],
+    *,
+    jobs: int = 1,
+    cache: Optional[ResultCache] = None,
+    check: bool = False,
+    in_place: bool = False,
+    handle: Optional[IO[str]] = None,
+) -> Iterator[FormatResult]:
+    """
+    Format the files using up to the given number of processes.
+
+    The results are yielded in the same order as the files. If in_place is
+    set, changed files are written by this process, in the same order, as
+    their results are yielded, so a consumer that stops at an error leaves
+    the files after it untouched, whether or not they were formatted. If a
+    handle is given and the files are formatted in this process, the output
+    is written to it as it is rendered, rather than returned as part of the
+    results.
+    """
+    jobs = min(jobs, len(files))
+    if jobs <= 1:
+        for file in files:
+            yield format_file(
+                talon_fmt,
+                file,
+                cache=cache,
+                check=check,
+                in_place=in_place,
+                handle=handle,
+            )
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=_init_worker,
+            initargs=(talon_fmt, cache, check, in_place),
+        ) as executor:
+            chunksize = max(1, len(files) // (jobs * 4))
+            try:
+                for result in executor.map(
+                    _format_file_in_worker, files, chunksize=chunksize
+                ):
+                    yield write_result(result) if in_place else result
+            finally:
+                # NOTE: if the consumer stops early, skip the remaining files
+                executor.shutdown(cancel_futures=True)
@@ -1,24 +1,38 @@
+import codecs
+import functools
 import re
 from dataclasses import dataclass, field
 from enum import IntEnum
-from typing import Iterable, Iterator, List, Optional, Sequence, Type, TypeVar, Union
+from types import GeneratorType
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+    cast,
+)
 
+import tree_sitter
 from doc_printer import (
+    Cat,
     Doc,
     DocLike,
+    Empty,
     Fail,
     Line,
     Space,
     Text,
     alt,
-    angles,
-    braces,
-    brackets,
     cat,
     create_table,
     inline,
     nest,
-    parens,
     row,
     smart_quote,
 )
@@ -72,8 +86,7 @@ from tree_sitter_talon import (
 )
 from typing_extensions import TypeAlias
 
-from ._compat_ast import astparse, astunparse
-from ._compat_singledispatchmethod import singledispatchmethod
+from ._dispatchmethod import dispatchmethod
 
 ################################################################################
 # Patch assert_equivalent
@@ -103,18 +116,172 @@ setattr(
     TalonImplicitString, "assert_equivalent", _TalonImplicitString_assert_equivalent
 )
 
+################################################################################
+# Build Documents
+################################################################################
+
+# NOTE: the documents below are used by many nodes, so they are built once,
+#       rather than parsed from a string by cat for every node
+
+COLON: Doc = Text(":")
+COMMA_SPACE: Doc = cat(Text(","), Space)
+EQUALS: Doc = Text("=")
+HASH: Doc = Text("#")
+PIPE: Doc = cat(Space, Text("|"), Space)
+PLUS: Doc = Text("+")
+STAR: Doc = Text("*")
+LEFT_ANGLE: Doc = Text("<")
+RIGHT_ANGLE: Doc = Text(">")
+LEFT_BRACE: Doc = Text("{")
+RIGHT_BRACE: Doc = Text("}")
+LEFT_BRACKET: Doc = Text("[")
+RIGHT_BRACKET: Doc = Text("]")
+LEFT_PAREN: Doc = Text("(")
+RIGHT_PAREN: Doc = Text(")")
+END_ANCHOR: Doc = Text("$")
+START_ANCHOR: Doc = Text("^")
+AND: Doc = cat(Text("and"), Space)
+NOT: Doc = cat(Text("not"), Space)
+KEY: Doc = Text("key")
+SLEEP: Doc = Text("sleep")
+SETTINGS: Doc = Text("settings():")
+TAG: Doc = Text("tag():")
+END_OF_HEADER: Doc = cat(Text("-"), Line)
+
+RE_WHITESPACE: re.Pattern[str] = re.compile(r"\s")
+
+
+def concat(*docs: Doc) -> Doc:
+    """
+    Concatenate documents, as cat does, but without accepting strings or
+    nested iterables, so the result is built in a single pass.
+    """
+    flat: List[Doc] = []
+    for doc in docs:
+        if isinstance(doc, Cat):
+            flat.extend(doc.docs)
+        elif doc is not Empty:
+            flat.append(doc)
+    if not flat:
+        return Empty
+    if len(flat) == 1:
+        return flat[0]
+    return Cat(tuple(flat))
+
+
+def join(separator: Doc, docs: Iterable[Doc]) -> Doc:
+    """
+    Concatenate documents separated by the separator, as Doc.join does.
+    """
+    separator_docs: Tuple[Doc, ...] = ()
+    if isinstance(separator, Cat):
+        separator_docs = separator.docs
+    elif separator is not Empty:
+        separator_docs = (separator,)
+    flat: List[Doc] = []
+    for index, doc in enumerate(docs):
+        if index > 0:
+            flat.extend(separator_docs)
+        if isinstance(doc, Cat):
+            flat.extend(doc.docs)
+        elif doc is not Empty:
+            flat.append(doc)
+    if not flat:
+        return Empty
+    if len(flat) == 1:
+        return flat[0]
+    return Cat(tuple(flat))
+
+
+def spaced(*docs: Doc) -> Doc:
+    """
+    Concatenate documents separated by a space, as // does, which does not
+    insert a space next to an empty document or an existing space.
+    """
+    result: Doc = Empty
+    for doc in docs:
+        if result is Empty or result is Space:
+            result = doc
+        elif doc is Empty or doc is Space:
+            pass
+        elif (isinstance(result, Cat) and result.docs[-1] is Space) or (
+            isinstance(doc, Cat) and doc.docs[0] is Space
+        ):
+            result = concat(result, doc)
+        else:
+            result = concat(result, Space, doc)
+    return result
+
+
+def words(text: str, *, collapse_whitespace: bool = False) -> Doc:
+    """
+    Split text into words separated by spaces, as Text.words does.
+    """
+    # NOTE: most text is a single word
+    if RE_WHITESPACE.search(text) is None:
+        return Text(text)
+    if collapse_whitespace:
+        pattern = Text.RE_ANY_WHITESPACE
+    else:
+        pattern = Text.RE_ONE_WHITESPACE
+    return join(Space, map(Text, pattern.split(text)))
+
+
+@functools.lru_cache(maxsize=None)
+def _decode_escape_sequence(text: str) -> str:
+    try:
+        return codecs.decode(text, "unicode_escape")
+    except UnicodeDecodeError:
+        return text
+
+
+# The value of a string literal, as a sequence of decoded text and interpolations
+TalonStringValue: TypeAlias = Tuple[Union[str, TalonInterpolation], ...]
+
+# Cache for the values of string literals without interpolations
+_string_values: Dict[str, TalonStringValue] = {}
+
+_string_values_max_size: int = 65536
+
+
+def _get_string_value(node: TalonString) -> TalonStringValue:
+    value = _string_values.get(node.text, None)
+    if value is None:
+        parts: List[Union[str, TalonInterpolation]] = []
+        buffer: List[str] = []
+        for child in node.children:
+            if isinstance(child, TalonStringContent):
+                buffer.append(child.text)
+            elif isinstance(child, TalonStringEscapeSequence):
+                buffer.append(_decode_escape_sequence(child.text))
+            elif isinstance(child, TalonInterpolation):
+                parts.append("".join(buffer))
+                parts.append(child)
+                buffer.clear()
+            else:
+                raise TypeError(type(child))
+        parts.append("".join(buffer))
+        value = tuple(parts)
+        if len(value) == 1:
+            if len(_string_values) >= _string_values_max_size:
+                _string_values.clear()
+            _string_values[node.text] = value
+    return value
+
 
 def _TalonString_assert_equivalent(self: TalonString, other: Node) -> None:
     assert isinstance(other, TalonString)
-    # NOTE: use the Python parser to normalise strings
-    # TODO: write custom logic to normalise strings?
-    try:
-        ast1 = astparse("f" + self.text)
-        ast2 = astparse("f" + other.text)
-    except SyntaxError:
-        ast1 = astparse(self.text)
-        ast2 = astparse(other.text)
-    assert astunparse(ast1) == astunparse(ast2)
+    # NOTE: compare the decoded values, which are independent of the quotes
+    value1 = _get_string_value(self)
+    value2 = _get_string_value(other)
+    if value1 != value2:
+        assert len(value1) == len(value2), f"{self.text} != {other.text}"
+        for part1, part2 in zip(value1, value2):
+            if isinstance(part1, TalonInterpolation):
+                assert isinstance(part2, TalonInterpolation)
+                part1.assert_equivalent(part2)
+            else:
+                assert part1 == part2, f"{self.text} != {other.text}"
 
 
 setattr(TalonString, "assert_equivalent", _TalonString_assert_equivalent)
@@ -137,6 +304,85 @@ TalonBlockLevel: TypeAlias = Union[
 
 NodeVar = TypeVar("NodeVar", bound=Node)
 
+TalonSourceFileChild: TypeAlias = Union[TalonDeclaration, TalonMatches, TalonComment]
+
+# The steps to format a rule or expression, which yield the documents and the
+# child nodes that make up its document, in order
+FormatSteps: TypeAlias = Iterator[Union[Node, Doc]]
+
+
+def get_source_file_children(node: TalonSourceFile) -> List[TalonSourceFileChild]:
+    """
+    Get the children of a source file, flattening any TalonDeclarations node.
+    """
+    children: List[TalonSourceFileChild] = []
+    for child in node.children:
+        if isinstance(child, TalonDeclarations):
+            children.extend(child.children)
+        else:
+            children.append(child)
+    return children
+
+
+def get_source_file_ts_children(tree: tree_sitter.Tree) -> List[tree_sitter.Node]:
+    """
+    Get the children of a source file from its tree-sitter syntax tree,
+    flattening any declarations node, as get_source_file_children does.
+    """
+    ts_children: List[tree_sitter.Node] = []
+    for ts_child in tree.root_node.named_children:
+        if ts_child.type == "declarations":
+            ts_children.extend(ts_child.named_children)
+        else:
+            ts_children.append(ts_child)
+    return ts_children
+
+
+def get_depth(tree: tree_sitter.Tree, *, limit: Optional[int] = None) -> int:
+    """
+    Get the depth of a tree-sitter syntax tree, without recursion. If a limit
+    is given, stop as soon as the depth exceeds it.
+    """
+    cursor = tree.walk()
+    depth: int = 0
+    max_depth: int = 0
+    while True:
+        if cursor.goto_first_child():
+            depth += 1
+            if depth > max_depth:
+                max_depth = depth
+                if limit is not None and max_depth > limit:
+                    return max_depth
+            continue
+        while not cursor.goto_next_sibling():
+            if not cursor.goto_parent():
+                return max_depth
+            depth -= 1
+
+
+@dataclass
+class TalonDeclarationGroup:
+    """
+    A group of children of a source file, which are formatted together.
+
+    The header group holds the match context and any comments before it.
+    Runs of short commands are grouped, so they can be aligned as a table.
+    Every other declaration or comment is a group on its own.
+    """
+
+    children: List[TalonSourceFileChild] = field(default_factory=list)
+    # Whether each child is preceded by a blank line
+    blank_lines: List[bool] = field(default_factory=list)
+    short_commands: bool = False
+
+    def append(self, child: TalonSourceFileChild, extra_blank_line: bool) -> None:
+        self.children.append(child)
+        self.blank_lines.append(extra_blank_line)
+
+    def is_header(self) -> bool:
+        return bool(self.children) and isinstance(self.children[-1], TalonMatches)
+
+
 ################################################################################
 # Formatter
 ################################################################################
@@ -167,7 +413,7 @@ class TalonFormatter:
     def keep_empty_match_context(self) -> bool:
         return self.empty_match_context is EmptyMatchContext.Keep
 
-    @singledispatchmethod
+    @dispatchmethod
     def format(self, node: Node) -> Doc:
         """
         Format any node as a document.
@@ -184,11 +430,57 @@ class TalonFormatter:
                 TalonComment,
             ),
         ):
-            return cat(self.format_lines(node))
+            return concat(*self.format_lines(node))
         else:
-            raise TypeError(type(node))
+            return self.format_nested(node)
+
+    @dispatchmethod
+    def format_steps(self, node: Node) -> Union[Doc, FormatSteps]:
+        """
+        Format any rule or expression as a document, or as a series of steps.
+        """
+        raise TypeError(type(node))
 
-    @singledispatchmethod
+    @format_steps.register
+    def _(self, node: Doc) -> Doc:
+        return node
+
+    def format_nested(self, node: Node) -> Doc:
+        """
+        Format a rule or expression as a document.
+
+        The steps are run from an explicit stack, rather than by recursion, so
+        deeply nested rules and expressions do not exceed the recursion limit.
+        The documents are concatenated as they are emitted, so the document is
+        built in a single pass, rather than once for every level of nesting.
+        """
+        format_steps = self.format_steps
+        result = format_steps(node)
+        # NOTE: GeneratorType is checked rather than Doc, which is an ABC,
+        #       because isinstance is much faster for concrete types
+        if not isinstance(result, GeneratorType):
+            return cast(Doc, result)
+        docs: List[Doc] = []
+        stack: List[FormatSteps] = [cast(FormatSteps, result)]
+        while stack:
+            child = next(stack[-1], None)
+            if child is None:
+                stack.pop()
+                continue
+            result = format_steps(child)
+            if isinstance(result, GeneratorType):
+                stack.append(cast(FormatSteps, result))
+            elif isinstance(result, Cat):
+                docs.extend(result.docs)
+            elif result is not Empty:
+                docs.append(cast(Doc, result))
+        if not docs:
+            return Empty
+        if len(docs) == 1:
+            return docs[0]
+        return Cat(tuple(docs))
+
+    @dispatchmethod
     def format_lines(self, node: TalonBlockLevel) -> Iterator[Doc]:
         """
         Format any block-level node as a series of lines.
@@ -198,12 +490,19 @@ class TalonFormatter:
         else:
             raise TypeError(type(node))
 
-    def format_children(self, children: Iterable[Node]) -> Iterator[Doc]:
-        for child in self.store_comments_with_type(children, node_type=Node):
-            if isinstance(child, Iterable):
-                yield from self.format_children(child)
-            else:
-                yield self.format(child)
+    def format_children(
+        self, children: Iterable[Node], separator: Doc = Empty
+    ) -> FormatSteps:
+        """
+        Format the children of a rule or expression in steps, separated by the
+        separator. Store all the comments.
+        """
+        for index, child in enumerate(
+            self.store_comments_with_type(children, node_type=Node)
+        ):
+            if index > 0:
+                yield separator
+            yield child
 
     ###########################################################################
     # Format: Source Files
@@ -211,94 +510,112 @@ class TalonFormatter:
 
     @format_lines.register
     def _(self, node: TalonSourceFile) -> Iterator[Doc]:
-        # Used to emit the match context separator.
-        in_header: bool = True
+        for group in self.group_declarations(get_source_file_children(node)):
+            yield from self.format_declaration_group(group)
 
+    def group_declarations(
+        self,
+        children: Iterable[TalonSourceFileChild],
+        *,
+        lines: Optional[Sequence[Tuple[int, int]]] = None,
+    ) -> Iterator[TalonDeclarationGroup]:
+        """
+        Group the children of a source file into the units that are formatted
+        together. The start and end line of each child are taken from lines,
+        if given, and from the children otherwise.
+        """
         # Used to buffer comments to ensure that they're split correctly
         # between the header and body.
-        match_context_comment_buffer: List[Doc] = []
-
-        def clear_match_context_comment_buffer() -> Iterator[Doc]:
-            if match_context_comment_buffer:
-                yield from match_context_comment_buffer
-                match_context_comment_buffer.clear()
-
-        if self.align_short_commands is True:
-            # Used to buffer short commands to group them as tables.
-            short_command_buffer: List[Doc] = []
-
-            def clear_short_command_buffer() -> Iterator[Doc]:
-                if short_command_buffer:
-                    table = create_table(short_command_buffer)
-                    if table:
-                        yield alt(cat(short_command_buffer), table)
-                    else:
-                        yield from short_command_buffer
-                    short_command_buffer.clear()
+        header: Optional[TalonDeclarationGroup] = TalonDeclarationGroup()
+
+        # Used to buffer short commands to group them as tables.
+        short_commands: Optional[TalonDeclarationGroup] = None
 
         # Used to insert blank lines.
         previous_line: int = 0
 
-        # Iterate over children, flatten any TalonDeclarations node
-        def children() -> Iterator[Union[TalonDeclaration, TalonMatches, TalonComment]]:
-            for child in node.children:
-                if isinstance(child, TalonDeclarations):
-                    yield from child.children
-                else:
-                    yield child
-
-        for child in children():
-            extra_blank_line: bool = child.start_position.line - previous_line >= 2
+        for index, child in enumerate(children):
+            if lines is None:
+                start_line, end_line = (
+                    child.start_position.line,
+                    child.end_position.line,
+                )
+            else:
+                start_line, end_line = lines[index]
+            extra_blank_line: bool = start_line - previous_line >= 2
 
             # buffer comments in match context
-            if in_header and isinstance(child, TalonComment):
-                if self.preserve_blank_lines_in_body and extra_blank_line:
-                    match_context_comment_buffer.append(Line)
-                match_context_comment_buffer.append(self.format(child))
+            if header is not None and isinstance(child, TalonComment):
+                header.append(child, extra_blank_line)
 
             # format the .talon file match context
             elif isinstance(child, TalonMatches):
-                assert in_header  # must still be in the header
-                yield from clear_match_context_comment_buffer()
-                yield from self.format_lines(child)
-                if (
-                    bool(child.children)
-                    or (child.is_explicit() and self.keep_empty_match_context)
-                    or self.show_empty_match_context
-                ):
-                    yield Text("-") / Line
-                in_header = False
+                assert header is not None  # must still be in the header
+                header.append(child, extra_blank_line)
+                yield header
+                header = None
 
             # format the .talon file body
             else:
                 # for dynamic alignment:
                 #   buffer short commands and clear the short command buffer
                 #   when anything other kind of node is encountered
-                if self.align_short_commands is True:
-                    if isinstance(child, TalonCommandDeclaration) and child.is_short():
-                        if self.preserve_blank_lines_in_body and extra_blank_line:
-                            if not short_command_buffer:
-                                yield Line
-                        short_command_buffer.extend(self.format_lines(child))
-                    else:
-                        yield from clear_short_command_buffer()
-                        if self.preserve_blank_lines_in_body and extra_blank_line:
-                            yield Line
-                        yield from self.format_lines(child)
-
-                # otherwise:
-                #   emit formatted nodes as they are encountered
+                if (
+                    self.align_short_commands is True
+                    and isinstance(child, TalonCommandDeclaration)
+                    and child.is_short()
+                ):
+                    if short_commands is None:
+                        short_commands = TalonDeclarationGroup(short_commands=True)
+                    short_commands.append(child, extra_blank_line)
                 else:
-                    if self.preserve_blank_lines_in_body and extra_blank_line:
-                        yield Line
-                    yield from self.format_lines(child)
+                    if short_commands is not None:
+                        yield short_commands
+                        short_commands = None
+                    yield TalonDeclarationGroup([child], [extra_blank_line])
 
             # update previous line
-            previous_line = child.end_position.line
+            previous_line = end_line
 
         # file ends with a short command, clear the short command buffer
-        if self.align_short_commands is True:
-            yield from clear_short_command_buffer()
+        if short_commands is not None:
+            yield short_commands
+
+    def format_declaration_group(self, group: TalonDeclarationGroup) -> Iterator[Doc]:
+        """
+        Format a group of children of a source file as a series of lines.
+        """
+        if group.is_header():
+            *comments, matches = group.children
+            for comment, extra_blank_line in zip(comments, group.blank_lines):
+                if self.preserve_blank_lines_in_body and extra_blank_line:
+                    yield Line
+                yield self.format(comment)
+            assert isinstance(matches, TalonMatches)
+            yield from self.format_lines(matches)
+            if (
+                bool(matches.children)
+                or (matches.is_explicit() and self.keep_empty_match_context)
+                or self.show_empty_match_context
+            ):
+                yield END_OF_HEADER
+        else:
+            # NOTE: only the first blank line in a group of short commands
+            #       is preserved
+            if self.preserve_blank_lines_in_body and group.blank_lines[0]:
+                yield Line
+            if group.short_commands:
+                short_command_buffer: List[Doc] = []
+                for child in group.children:
+                    short_command_buffer.extend(self.format_lines(child))
+                table = create_table(short_command_buffer)
+                if table:
+                    yield alt(concat(*short_command_buffer), table)
+                else:
+                    yield from short_command_buffer
+            else:
+                for child in group.children:
+                    yield from self.format_lines(child)
 
     ###########################################################################
     # Format: Match Context
@@ -330,13 +647,13 @@ class TalonFormatter:
         pattern = self.format(node.right)
         if isinstance(self.align_match_context, bool):
             yield row(
-                keywords / key / ":",
+                concat(*keywords, key, COLON),
                 pattern,
                 table_type="match",
             )
         else:
             yield row(
-                keywords / key / ":",
+                concat(*keywords, key, COLON),
                 pattern,
                 table_type="match",
                 min_col_widths=(self.align_match_context,),
@@ -347,11 +664,9 @@ class TalonFormatter:
         modifiers: Sequence[TalonMatchModifier],
     ) -> Iterator[Doc]:
         if any(modifier.text == "and" for modifier in modifiers):
-            yield Text("and")
-            yield Space
+            yield AND
         if any(modifier.text == "not" for modifier in modifiers):
-            yield Text("not")
-            yield Space
+            yield NOT
 
     ###########################################################################
     # Format: Tag Import Declaration
@@ -360,7 +675,9 @@ class TalonFormatter:
     @format_lines.register
     def _(self, node: TalonTagImportDeclaration) -> Iterator[Doc]:
         self.assert_only_comments(node.children)
-        yield from self.with_comments("tag():" // self.format(node.right) / Line)
+        yield from self.with_comments(
+            concat(spaced(TAG, self.format(node.right)), Line)
+        )
 
     ###########################################################################
     # Format: Settings Declaration
@@ -369,11 +686,7 @@ class TalonFormatter:
     @format_lines.register
     def _(self, node: TalonSettingsDeclaration) -> Iterator[Doc]:
         assert node.children is None
-        yield "settings():" / nest(
-            self.indent_size,
-            Line,
-            self.format(node.right),
-        )
+        yield concat(SETTINGS, nest(self.indent_size, Line, self.format(node.right)))
 
     ###########################################################################
     # Format: Key Bindings
@@ -403,8 +716,9 @@ class TalonFormatter:
         # select camel left:
         #     user.extend_camel_left()
         #
-        alt1 = cat(
-            rule / ":",
+        alt1 = concat(
+            rule,
+            COLON,
             nest(self.indent_size, Line, script),
         )
 
@@ -422,13 +736,13 @@ class TalonFormatter:
     def format_short_command(self, rule: Doc, script: Doc) -> Doc:
         if isinstance(self.align_short_commands, bool):
             return row(
-                rule / ":",
+                concat(rule, COLON),
                 inline(script),
                 table_type="command",
             )
         else:
             return row(
-                rule / ":",
+                concat(rule, COLON),
                 inline(script),
                 table_type="command",
                 min_col_widths=(self.align_short_commands,),
@@ -460,166 +774,192 @@ class TalonFormatter:
     @format_lines.register
     def _(self, node: TalonAssignmentStatement) -> Iterator[Doc]:
         self.assert_only_comments(node.children)
-        yield self.format(node.left) // "=" // self.format(node.right) / Line
+        yield concat(
+            spaced(self.format(node.left), EQUALS, self.format(node.right)), Line
+        )
 
     @format_lines.register
     def _(self, node: TalonExpressionStatement) -> Iterator[Doc]:
         self.assert_only_comments(node.children)
-        yield self.format(node.expression) / Line
+        yield concat(self.format(node.expression), Line)
 
     ###########################################################################
     # Format: Expressions
     ###########################################################################
 
-    @format.register
-    def _(self, node: TalonAction) -> Doc:
+    @format_steps.register
+    def _(self, node: TalonAction) -> FormatSteps:
         self.assert_only_comments(node.children)
-        return self.format(node.action_name) / parens(self.format(node.arguments))
+        yield node.action_name
+        yield LEFT_PAREN
+        yield node.arguments
+        yield RIGHT_PAREN
 
-    @format.register
-    def _(self, node: TalonArgumentList) -> Doc:
-        return ("," / Space).join(self.format_children(node.children))
+    @format_steps.register
+    def _(self, node: TalonArgumentList) -> FormatSteps:
+        return self.format_children(node.children, COMMA_SPACE)
 
-    @format.register
-    def _(self, node: TalonUnaryOperator) -> Doc:
+    @format_steps.register
+    def _(self, node: TalonUnaryOperator) -> FormatSteps:
         self.assert_only_comments(node.children)
-        return self.format(node.operator) / self.format(node.right)
+        yield node.operator
+        yield node.right
 
-    @format.register
-    def _(self, node: TalonBinaryOperator) -> Doc:
+    @format_steps.register
+    def _(self, node: TalonBinaryOperator) -> FormatSteps:
         self.assert_only_comments(node.children)
-        return (
-            self.format(node.left)
-            // self.format(node.operator)
-            // self.format(node.right)
-        )
-
-    @format.register
+        # NOTE: operators and operands are never empty and never start or end
+        #       with a space, so the operator is always separated by spaces
+        yield node.left
+        yield Space
+        yield node.operator
+        yield Space
+        yield node.right
+
+    @format_steps.register
     def _(self, node: TalonIdentifier) -> Doc:
-        return Text.words(node.text, collapse_whitespace=True)
+        return words(node.text, collapse_whitespace=True)
 
-    @format.register
-    def _(self, node: TalonKeyAction) -> Doc:
+    @format_steps.register
+    def _(self, node: TalonKeyAction) -> FormatSteps:
         self.assert_only_comments(node.children)
-        return "key" / parens(self.format(node.arguments))
+        yield KEY
+        yield LEFT_PAREN
+        yield node.arguments
+        yield RIGHT_PAREN
 
-    @format.register
+    @format_steps.register
     def _(self, node: TalonOperator) -> Doc:
-        return Text.words(node.text, collapse_whitespace=True)
+        return words(node.text, collapse_whitespace=True)
 
-    @format.register
-    def _(self, node: TalonParenthesizedExpression) -> Doc:
-        return parens(
-            self.format(self.get_node(node.children, node_type_name=node.type_name))
-        )
+    @format_steps.register
+    def _(self, node: TalonParenthesizedExpression) -> FormatSteps:
+        child = self.get_node(node.children, node_type_name=node.type_name)
+        yield LEFT_PAREN
+        yield child
+        yield RIGHT_PAREN
 
-    @format.register
-    def _(self, node: TalonSleepAction) -> Doc:
+    @format_steps.register
+    def _(self, node: TalonSleepAction) -> FormatSteps:
         self.assert_only_comments(node.children)
-        return "sleep" / parens(self.format(node.arguments))
+        yield SLEEP
+        yield LEFT_PAREN
+        yield node.arguments
+        yield RIGHT_PAREN
 
-    @format.register
-    def _(self, node: TalonVariable) -> Doc:
+    @format_steps.register
+    def _(self, node: TalonVariable) -> FormatSteps:
         self.assert_only_comments(node.children)
-        return self.format(node.variable_name)
+        yield node.variable_name
 
     ###########################################################################
     # Format: Numbers
     ###########################################################################
 
-    @format.register
+    @format_steps.register
     def _(self, node: TalonFloat) -> Doc:
-        return Text.words(node.text.strip(), collapse_whitespace=True)
+        return words(node.text.strip(), collapse_whitespace=True)
 
-    @format.register
+    @format_steps.register
     def _(self, node: TalonInteger) -> Doc:
-        return Text.words(node.text.strip(), collapse_whitespace=True)
+        return words(node.text.strip(), collapse_whitespace=True)
 
     ###########################################################################
     # Format: Strings
     ###########################################################################
 
-    @format.register
+    @format_steps.register
     def _(self, node: TalonImplicitString) -> Doc:
-        return Text.words(node.text.strip(), collapse_whitespace=True)
+        return words(node.text.strip(), collapse_whitespace=True)
 
-    @format.register
-    def _(self, node: TalonInterpolation) -> Doc:
-        return self.format(self.get_node(node.children, node_type_name=node.type_name))
+    @format_steps.register
+    def _(self, node: TalonInterpolation) -> FormatSteps:
+        yield self.get_node(node.children, node_type_name=node.type_name)
 
-    @format.register
+    @format_steps.register
     def _(self, node: TalonString) -> Doc:
-        return smart_quote(self.format_children(node.children))
+        # NOTE: smart_quote needs the documents for the parts of the string,
+        #       so these are formatted separately
+        return smart_quote(
+            map(
+                self.format_nested,
+                self.store_comments_with_type(node.children, node_type=Node),
+            )
+        )
 
-    @format.register
+    @format_steps.register
     def _(self, node: TalonStringContent) -> Doc:
-        return Text.words(node.text)
+        return words(node.text)
 
-    @format.register
+    @format_steps.register
     def _(self, node: TalonStringEscapeSequence) -> Doc:
-        return Text.words(node.text)
+        return words(node.text)
 
     ###########################################################################
     # Format: Rules
     ###########################################################################
 
-    @format.register
-    def _(self, node: TalonCapture) -> Doc:
+    @format_steps.register
+    def _(self, node: TalonCapture) -> FormatSteps:
         self.assert_only_comments(node.children)
-        return angles(self.format(node.capture_name))
+        yield LEFT_ANGLE
+        yield node.capture_name
+        yield RIGHT_ANGLE
 
-    @format.register
-    def _(self, node: TalonChoice) -> Doc:
-        children = self.format_children(node.children)
-        operator = Space / "|" / Space
-        return operator.join(children)
+    @format_steps.register
+    def _(self, node: TalonChoice) -> FormatSteps:
+        return self.format_children(node.children, PIPE)
 
-    @format.register
+    @format_steps.register
     def _(self, node: TalonEndAnchor) -> Doc:
-        return Text("$")
+        return END_ANCHOR
 
-    @format.register
-    def _(self, node: TalonList) -> Doc:
+    @format_steps.register
+    def _(self, node: TalonList) -> FormatSteps:
         self.assert_only_comments(node.children)
-        return braces(self.format(node.list_name))
+        yield LEFT_BRACE
+        yield node.list_name
+        yield RIGHT_BRACE
 
-    @format.register
-    def _(self, node: TalonOptional) -> Doc:
+    @format_steps.register
+    def _(self, node: TalonOptional) -> FormatSteps:
         child = self.get_node(node.children, node_type_name=node.type_name)
-        return brackets(self.format(child))
+        yield LEFT_BRACKET
+        yield child
+        yield RIGHT_BRACKET
 
-    @format.register
-    def _(self, node: TalonParenthesizedRule) -> Doc:
+    @format_steps.register
+    def _(self, node: TalonParenthesizedRule) -> FormatSteps:
         child = self.get_node(node.children, node_type_name=node.type_name)
-        return parens(self.format(child))
+        yield LEFT_PAREN
+        yield child
+        yield RIGHT_PAREN
 
-    @format.register
-    def _(self, node: TalonRepeat) -> Doc:
-        child = self.get_node(node.children, node_type_name=node.type_name)
-        return self.format(child) / "*"
+    @format_steps.register
+    def _(self, node: TalonRepeat) -> FormatSteps:
+        yield self.get_node(node.children, node_type_name=node.type_name)
+        yield STAR
 
-    @format.register
-    def _(self, node: TalonRepeat1) -> Doc:
-        return (
-            self.format(self.get_node(node.children, node_type_name=node.type_name))
-            / "+"
-        )
+    @format_steps.register
+    def _(self, node: TalonRepeat1) -> FormatSteps:
+        yield self.get_node(node.children, node_type_name=node.type_name)
+        yield PLUS
 
-    @format.register
-    def _(self, node: TalonRule) -> Doc:
-        return cat(self.format_children(node.children))
+    @format_steps.register
+    def _(self, node: TalonRule) -> FormatSteps:
+        return self.format_children(node.children)
 
-    @format.register
-    def _(self, node: TalonSeq) -> Doc:
-        return Space.join(self.format_children(node.children))
+    @format_steps.register
+    def _(self, node: TalonSeq) -> FormatSteps:
+        return self.format_children(node.children, Space)
 
-    @format.register
+    @format_steps.register
     def _(self, node: TalonStartAnchor) -> Doc:
-        return Text("^")
+        return START_ANCHOR
 
-    @format.register
+    @format_steps.register
     def _(self, node: TalonWord) -> Doc:
-        return Text.words(node.text)
+        return words(node.text)
 
     ###########################################################################
     # Format: Comments
@@ -631,13 +971,12 @@ class TalonFormatter:
             # TODO: format blocks of comments so we can:
             #       1. decrease indentation consistently;
             #       2. reflow text
-            return (
-                "#"
-                // Text.words(node.text.lstrip("#"), collapse_whitespace=False)
-                / Line
+            return concat(
+                spaced(HASH, words(node.text.lstrip("#"), collapse_whitespace=False)),
+                Line,
             )
         else:
-            return Text.words(node.text, collapse_whitespace=False) / Line
+            return concat(words(node.text, collapse_whitespace=False), Line)
 
     # Used to buffer comments encountered inline, e.g., inside a binary operator
     _match_context_comment_buffer: List[TalonComment] = field(
@@ -0,0 +1,78 @@
+import subprocess
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+
+class GitError(Exception):
+    pass
+
+
+def _run_git(directory: Path, *args: str) -> "subprocess.CompletedProcess[bytes]":
+    return subprocess.run(
+        ["git", "-C", str(directory), *args],
+        stdin=subprocess.DEVNULL,
+        capture_output=True,
+        check=False,
+    )
+
+
+def is_inside_work_tree(directory: Path) -> bool:
+    """
+    Test whether the directory is inside a git working tree.
+    """
+    try:
+        result = _run_git(directory, "rev-parse", "--is-inside-work-tree")
+    except OSError:
+        # NOTE: git is not installed
+        return False
+    return result.returncode == 0 and result.stdout.strip() == b"true"
+
+
+def get_changed_files(
+    path: Path,
+    *,
+    since: Optional[str] = None,
+    staged: bool = False,
+    suffixes: Sequence[str] = (".talon",),
+) -> Optional[List[Path]]:
+    """
+    Get the files under the path which changed, according to git diff. If
+    the path is a directory, only files with the given suffixes are included.
+
+    If staged is set, only the changes in the index are considered. If since
+    is set, only the changes since the given commit are considered. Unless
+    staged is set, untracked files which are not ignored are included, as
+    they changed since any commit. Deleted files are never included.
+
+    Returns None if the path is not inside a git working tree.
+    """
+    directory = path if path.is_dir() else path.parent
+    if not is_inside_work_tree(directory):
+        return None
+    pathspec = "." if path.is_dir() else path.name
+    args: List[str] = ["diff", "--name-only", "-z", "--relative"]
+    args.append("--diff-filter=ACMR")
+    if staged:
+        args.append("--cached")
+    if since is not None:
+        args.append(since)
+    args.extend(["--", pathspec])
+    # NOTE: with --relative, the names are relative to the directory
+    names = set(_get_names(directory, path, *args))
+    if not staged:
+        args = ["ls-files", "--others", "--exclude-standard", "-z", "--", pathspec]
+        names.update(_get_names(directory, path, *args))
+    files: List[Path] = []
+    for name in sorted(names):
+        if path.is_file() or name.endswith(tuple(suffixes)):
+            files.append(directory / name)
+    return files
+
+
+def _get_names(directory: Path, path: Path, *args: str) -> List[str]:
+    result = _run_git(directory, *args)
+    if result.returncode != 0:
+        message = result.stderr.decode("utf-8", errors="replace").strip()
+        raise GitError(f"git {args[0]} failed for {path}: {message}")
+    stdout = result.stdout.decode("utf-8", errors="surrogateescape")
+    return [name for name in stdout.split("\0") if name]
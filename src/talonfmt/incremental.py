@@ -0,0 +1,250 @@
+import itertools
+import json
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, cast
+
+import tree_sitter
+import tree_sitter_talon
+from tree_sitter_talon import parse
+
+from . import TalonFmt
+from .formatter import (
+    TalonDeclarationGroup,
+    TalonSourceFileChild,
+    get_source_file_ts_children,
+)
+
+# The encoding used to pass the contents to tree-sitter
+_ENCODING: str = "utf-8"
+
+# Identifies a group by its kind, its children, and their preceding blank lines
+_GroupKey = Tuple[bool, Tuple[int, ...], Tuple[bool, ...]]
+
+# Used to assign identifiers to children, which are kept while they are unchanged
+_child_ids: Iterator[int] = itertools.count()
+
+
+@dataclass(frozen=True)
+class TextEdit:
+    """
+    An edit, which replaces the text between start and end by new text.
+
+    The start and end are character offsets into the contents before the edit.
+    """
+
+    start: int
+    end: int
+    text: str
+
+    def apply(self, contents: str) -> str:
+        return contents[: self.start] + self.text + contents[self.end :]
+
+
+@dataclass
+class FormattedDocument:
+    """
+    The contents of a file, its syntax tree, and the formatted output.
+
+    The children of the source file and the output for each group of children
+    are kept, so they can be reused when the document is edited.
+    """
+
+    contents: str
+    output: str
+    tree: tree_sitter.Tree
+    filename: Optional[str] = None
+
+    # The number of groups that were formatted and reused, respectively
+    formatted_groups: int = 0
+    reused_groups: int = 0
+
+    # The options and layout used to format the document
+    _layout: str = field(default="", repr=False, compare=False)
+
+    # The children of the source file, with their identifiers and byte ranges
+    _children: List[TalonSourceFileChild] = field(
+        default_factory=list, repr=False, compare=False
+    )
+    _child_ids: List[int] = field(default_factory=list, repr=False, compare=False)
+    _child_index: Dict[Tuple[int, int, str], int] = field(
+        default_factory=dict, repr=False, compare=False
+    )
+
+    # The output for each group
+    _outputs: Dict[_GroupKey, str] = field(
+        default_factory=dict, repr=False, compare=False
+    )
+
+    @property
+    def changed(self) -> bool:
+        return self.contents != self.output
+
+
+def format_document(
+    talon_fmt: TalonFmt, contents: str, *, filename: Optional[str] = None
+) -> FormattedDocument:
+    """
+    Format the contents, and keep what is needed to reformat them after an edit.
+
+    NOTE: No safety checks are run, regardless of the options.
+    """
+    tree = tree_sitter_talon.parser.parse(contents.encode(_ENCODING))
+    return _format_document(talon_fmt, contents, tree, filename=filename)
+
+
+def reformat_document(
+    talon_fmt: TalonFmt,
+    document: FormattedDocument,
+    edit: TextEdit,
+) -> FormattedDocument:
+    """
+    Apply an edit to a formatted document and reformat it.
+
+    The syntax tree is reparsed incrementally, and only the groups of
+    declarations that overlap with the edit are formatted again. The rest of
+    the output is reused. The syntax tree of the previous document is edited
+    in place, so the previous document must not be reformatted again.
+
+    NOTE: No safety checks are run, regardless of the options.
+    """
+    contents = edit.apply(document.contents)
+    start_byte, start_point = _get_byte_and_point(document.contents, edit.start)
+    old_end_byte, old_end_point = _get_byte_and_point(document.contents, edit.end)
+    new_end_byte, new_end_point = _get_byte_and_point(
+        contents, edit.start + len(edit.text)
+    )
+    old_tree = document.tree
+    old_tree.edit(
+        start_byte=start_byte,
+        old_end_byte=old_end_byte,
+        new_end_byte=new_end_byte,
+        start_point=start_point,
+        old_end_point=old_end_point,
+        new_end_point=new_end_point,
+    )
+    tree = tree_sitter_talon.parser.parse(contents.encode(_ENCODING), old_tree)
+
+    # NOTE: the changed ranges are given in bytes after the edit
+    changed_ranges: List[Tuple[int, int]] = [(start_byte, new_end_byte)]
+    for changed_range in old_tree.changed_ranges(tree):
+        changed_ranges.append((changed_range.start_byte, changed_range.end_byte))
+
+    def get_old_range(start: int, end: int) -> Optional[Tuple[int, int]]:
+        for changed_start, changed_end in changed_ranges:
+            if start <= changed_end and changed_start <= end:
+                return None
+        if end <= start_byte:
+            return (start, end)
+        shift = new_end_byte - old_end_byte
+        return (start - shift, end - shift)
+
+    return _format_document(
+        talon_fmt,
+        contents,
+        tree,
+        filename=document.filename,
+        previous=document,
+        get_old_range=get_old_range,
+    )
+
+
+def _get_byte_and_point(contents: str, offset: int) -> Tuple[int, Tuple[int, int]]:
+    prefix = contents[:offset]
+    row = prefix.count("\n")
+    line = prefix[prefix.rfind("\n") + 1 :]
+    return (len(prefix.encode(_ENCODING)), (row, len(line.encode(_ENCODING))))
+
+
+def _format_document(
+    talon_fmt: TalonFmt,
+    contents: str,
+    tree: tree_sitter.Tree,
+    *,
+    filename: Optional[str],
+    previous: Optional[FormattedDocument] = None,
+    get_old_range: Optional[Callable[[int, int], Optional[Tuple[int, int]]]] = None,
+) -> FormattedDocument:
+    # Raise the same error as talonfmt for contents with parse errors
+    if tree.root_node.has_error:
+        parse(contents, encoding=_ENCODING, raise_parse_error=True)
+
+    indent_size, max_line_width = talon_fmt.resolve_layout(filename)
+    layout = json.dumps(
+        {
+            **talon_fmt.options,
+            "indent_size": indent_size,
+            "max_line_width": max_line_width,
+        },
+        sort_keys=True,
+    )
+    if previous is not None and previous._layout != layout:
+        previous = None
+
+    document = FormattedDocument(
+        contents=contents,
+        output="",
+        tree=tree,
+        filename=filename,
+        _layout=layout,
+    )
+
+    # Convert the children, reusing those that are unchanged
+    ts_children = get_source_file_ts_children(tree)
+    lines: List[Tuple[int, int]] = []
+    for index, ts_child in enumerate(ts_children):
+        lines.append((ts_child.start_point[0], ts_child.end_point[0]))
+        old_index: Optional[int] = None
+        if previous is not None and get_old_range is not None:
+            old_range = get_old_range(ts_child.start_byte, ts_child.end_byte)
+            if old_range is not None:
+                old_index = previous._child_index.get((*old_range, ts_child.type))
+        if old_index is not None:
+            assert previous is not None
+            child = previous._children[old_index]
+            child_id = previous._child_ids[old_index]
+        else:
+            node = tree_sitter_talon.from_tree_sitter(
+                ts_child, encoding=_ENCODING, raise_parse_error=True
+            )
+            child = cast(TalonSourceFileChild, node)
+            child_id = next(_child_ids)
+        document._children.append(child)
+        document._child_ids.append(child_id)
+        document._child_index[
+            (ts_child.start_byte, ts_child.end_byte, ts_child.type)
+        ] = index
+
+    # Format the groups, reusing the output for those that are unchanged
+    talon_formatter = talon_fmt.get_talon_formatter(indent_size)
+    groups = talon_formatter.group_declarations(document._children, lines=lines)
+    outputs: List[str] = []
+    index = 0
+    for group in groups:
+        child_ids = tuple(document._child_ids[index : index + len(group.children)])
+        index += len(group.children)
+        key: _GroupKey = (group.short_commands, child_ids, tuple(group.blank_lines))
+        output = None if previous is None else previous._outputs.get(key, None)
+        if output is None:
+            output = _format_group(talon_fmt, group, indent_size, max_line_width)
+            document.formatted_groups += 1
+        else:
+            document.reused_groups += 1
+        document._outputs[key] = output
+        outputs.append(output)
+    document.output = "".join(outputs)
+    return document
+
+
+def _format_group(
+    talon_fmt: TalonFmt,
+    group: TalonDeclarationGroup,
+    indent_size: int,
+    max_line_width: Optional[int],
+) -> str:
+    talon_formatter = talon_fmt.get_talon_formatter(indent_size)
+
+    # Discard any state left over from a previous call
+    talon_formatter._match_context_comment_buffer.clear()
+
+    docs = talon_formatter.format_declaration_group(group)
+    return "".join(talon_fmt.render_docs(docs, max_line_width=max_line_width))
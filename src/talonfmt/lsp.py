@@ -0,0 +1,464 @@
+import bisect
+import json
+import sys
+import urllib.parse
+import urllib.request
+from dataclasses import dataclass, field
+from typing import IO, Any, Callable, Dict, List, Optional, Tuple
+
+import tree_sitter
+import tree_sitter_talon
+from tree_sitter_talon import ParseError, TalonCommandDeclaration
+
+from . import LimitExceeded, TalonFmt
+
+# A JSON-RPC message, position, range, or text edit, as sent by the client
+Message = Dict[str, Any]
+
+Position = Dict[str, int]
+
+Range = Dict[str, Position]
+
+TextEdit = Dict[str, Any]
+
+# JSON-RPC error codes
+_PARSE_ERROR: int = -32700
+_INVALID_REQUEST: int = -32600
+_METHOD_NOT_FOUND: int = -32601
+_INTERNAL_ERROR: int = -32603
+_REQUEST_FAILED: int = -32803
+
+# LSP text document sync kinds
+_TEXT_DOCUMENT_SYNC_INCREMENTAL: int = 2
+
+
+class LanguageServerError(Exception):
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+################################################################################
+# Base Protocol
+################################################################################
+
+
+def read_message(rfile: IO[bytes]) -> Optional[Message]:
+    """
+    Read a message with its headers. Returns None at the end of the stream.
+    """
+    content_length: Optional[int] = None
+    while True:
+        header = rfile.readline()
+        if not header:
+            return None
+        header = header.strip()
+        if not header:
+            break
+        name, _, value = header.decode("ascii").partition(":")
+        if name.strip().lower() == "content-length":
+            content_length = int(value.strip())
+    if content_length is None:
+        raise LanguageServerError(_PARSE_ERROR, "Missing Content-Length header")
+    try:
+        message: Message = json.loads(rfile.read(content_length).decode("utf-8"))
+    except ValueError as e:
+        raise LanguageServerError(_PARSE_ERROR, str(e))
+    return message
+
+
+def write_message(wfile: IO[bytes], message: Message) -> None:
+    """
+    Write a message with its headers.
+    """
+    body = json.dumps(message, separators=(",", ":")).encode("utf-8")
+    wfile.write(f"Content-Length: {len(body)}\r\n\r\n".encode("ascii"))
+    wfile.write(body)
+    wfile.flush()
+
+
+################################################################################
+# Text Documents
+################################################################################
+
+
+def _utf16_len(text: str) -> int:
+    if text.isascii():
+        return len(text)
+    return len(text.encode("utf-16-le")) // 2
+
+
+@dataclass
+class TextDocument:
+    """
+    An open text document, which is kept in sync with the client.
+
+    Positions are given in lines and UTF-16 code units, as per the protocol.
+    """
+
+    uri: str
+    text: str
+    version: int = 0
+
+    # The offsets at which each line starts, computed on demand
+    _line_starts: Optional[List[int]] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+
+    @property
+    def filename(self) -> Optional[str]:
+        url = urllib.parse.urlparse(self.uri)
+        if url.scheme == "file":
+            return urllib.request.url2pathname(urllib.parse.unquote(url.path))
+        return None
+
+    @property
+    def line_starts(self) -> List[int]:
+        if self._line_starts is None:
+            line_starts = [0]
+            offset = self.text.find("\n")
+            while offset != -1:
+                line_starts.append(offset + 1)
+                offset = self.text.find("\n", offset + 1)
+            self._line_starts = line_starts
+        return self._line_starts
+
+    def get_line(self, line: int) -> Tuple[int, str]:
+        line_starts = self.line_starts
+        if line >= len(line_starts):
+            return (len(self.text), "")
+        start = line_starts[line]
+        end = line_starts[line + 1] if line + 1 < len(line_starts) else len(self.text)
+        return (start, self.text[start:end])
+
+    def get_offset(self, position: Position) -> int:
+        """
+        Get the character offset for a position.
+        """
+        start, text = self.get_line(position["line"])
+        character = position["character"]
+        if text.isascii():
+            return start + min(character, len(text))
+        units = 0
+        for index, char in enumerate(text):
+            if units >= character:
+                return start + index
+            units += 2 if ord(char) > 0xFFFF else 1
+        return start + len(text)
+
+    def get_position(self, offset: int) -> Position:
+        """
+        Get the position for a character offset.
+        """
+        line = bisect.bisect_right(self.line_starts, offset) - 1
+        start = self.line_starts[line]
+        return {"line": line, "character": _utf16_len(self.text[start:offset])}
+
+    def get_offset_from_point(self, point: Tuple[int, int]) -> int:
+        """
+        Get the character offset for a tree-sitter point, whose column is in bytes.
+        """
+        row, column = point
+        start, text = self.get_line(row)
+        if text.isascii():
+            return start + column
+        return start + len(text.encode("utf-8")[:column].decode("utf-8"))
+
+    def get_range(self, start: int, end: int) -> Range:
+        return {"start": self.get_position(start), "end": self.get_position(end)}
+
+    def apply_change(self, change: Message) -> None:
+        """
+        Apply a content change from a didChange notification.
+        """
+        if "range" in change:
+            start = self.get_offset(change["range"]["start"])
+            end = self.get_offset(change["range"]["end"])
+            self.text = self.text[:start] + change["text"] + self.text[end:]
+        else:
+            self.text = change["text"]
+        self._line_starts = None
+
+
+################################################################################
+# Language Server
+################################################################################
+
+
+@dataclass
+class LanguageServer:
+    """
+    A language server, which provides document, range, and on-type formatting.
+    """
+
+    talon_fmt: TalonFmt = field(default_factory=TalonFmt)
+
+    # The open documents by their URI
+    documents: Dict[str, TextDocument] = field(default_factory=dict)
+
+    _shutdown: bool = field(default=False, init=False, repr=False)
+
+    def serve(self, rfile: IO[bytes], wfile: IO[bytes]) -> int:
+        """
+        Serve requests until the exit notification or the end of the stream.
+
+        Returns the exit code, which is 0 if the client requested a shutdown.
+        """
+        while True:
+            try:
+                message = read_message(rfile)
+            except LanguageServerError as e:
+                write_message(wfile, self.error_response(None, e))
+                continue
+            if message is None:
+                return 1
+            if not isinstance(message, dict):
+                error = LanguageServerError(_INVALID_REQUEST, "Expected an object")
+                write_message(wfile, self.error_response(None, error))
+                continue
+            if message.get("method", None) == "exit":
+                return 0 if self._shutdown else 1
+            response = self.handle(message)
+            if response is not None:
+                write_message(wfile, response)
+
+    def serve_stdio(self) -> int:
+        return self.serve(sys.stdin.buffer, sys.stdout.buffer)
+
+    def handle(self, message: Message) -> Optional[Message]:
+        """
+        Handle a message. Returns the response, or None for notifications.
+        """
+        method = message.get("method", None)
+        params = message.get("params", None) or {}
+        is_request = "id" in message
+        handler = _handlers.get(method, None) if method else None
+        try:
+            if is_request and self._shutdown and method != "shutdown":
+                raise LanguageServerError(_INVALID_REQUEST, "Server is shut down")
+            if handler is None:
+                if is_request:
+                    raise LanguageServerError(
+                        _METHOD_NOT_FOUND, f"Unknown method '{method}'"
+                    )
+                return None
+            result = handler(self, params)
+        except LanguageServerError as e:
+            return (
+                self.error_response(message.get("id", None), e) if is_request else None
+            )
+        except Exception as e:
+            # NOTE: an unexpected error, e.g., from malformed parameters, must
+            #       not stop the server, so it is reported or logged instead
+            if is_request:
+                return self.error_response(
+                    message.get("id", None),
+                    LanguageServerError(
+                        _INTERNAL_ERROR, f"{e.__class__.__name__}: {e}"
+                    ),
+                )
+            sys.stderr.write(
+                f"Error handling '{method}': {e.__class__.__name__}: {e}\n"
+            )
+            return None
+        if is_request:
+            return {"jsonrpc": "2.0", "id": message["id"], "result": result}
+        return None
+
+    @staticmethod
+    def error_response(id: Any, error: LanguageServerError) -> Message:
+        return {
+            "jsonrpc": "2.0",
+            "id": id,
+            "error": {"code": error.code, "message": error.message},
+        }
+
+    ###########################################################################
+    # Lifecycle
+    ###########################################################################
+
+    def initialize(self, params: Message) -> Any:
+        return {
+            "capabilities": {
+                "textDocumentSync": {
+                    "openClose": True,
+                    "change": _TEXT_DOCUMENT_SYNC_INCREMENTAL,
+                },
+                "documentFormattingProvider": True,
+                "documentRangeFormattingProvider": True,
+                "documentOnTypeFormattingProvider": {"firstTriggerCharacter": "\n"},
+            },
+            "serverInfo": {"name": "talonfmt"},
+        }
+
+    def shutdown(self, params: Message) -> Any:
+        self._shutdown = True
+        return None
+
+    ###########################################################################
+    # Document Synchronisation
+    ###########################################################################
+
+    def did_open(self, params: Message) -> Any:
+        text_document = params["textDocument"]
+        self.documents[text_document["uri"]] = TextDocument(
+            uri=text_document["uri"],
+            text=text_document["text"],
+            version=text_document.get("version", 0),
+        )
+
+    def did_change(self, params: Message) -> Any:
+        document = self.get_document(params)
+        for change in params["contentChanges"]:
+            document.apply_change(change)
+        document.version = params["textDocument"].get("version", document.version)
+
+    def did_close(self, params: Message) -> Any:
+        self.documents.pop(params["textDocument"]["uri"], None)
+
+    def get_document(self, params: Message) -> TextDocument:
+        uri = params["textDocument"]["uri"]
+        document = self.documents.get(uri, None)
+        if document is None:
+            raise LanguageServerError(_REQUEST_FAILED, f"Unknown document '{uri}'")
+        return document
+
+    ###########################################################################
+    # Formatting
+    ###########################################################################
+
+    def formatting(self, params: Message) -> Any:
+        document = self.get_document(params)
+        try:
+            output = self.talon_fmt(document.text, filename=document.filename)
+        except (ParseError, AssertionError, LimitExceeded) as e:
+            raise LanguageServerError(_REQUEST_FAILED, str(e))
+        if output == document.text:
+            return []
+        return [{"range": document.get_range(0, len(document.text)), "newText": output}]
+
+    def range_formatting(self, params: Message) -> Any:
+        document = self.get_document(params)
+        start_line = params["range"]["start"]["line"]
+        end_line = params["range"]["end"]["line"]
+        try:
+            return self.format_lines(document, start_line, end_line)
+        except (ParseError, AssertionError, LimitExceeded) as e:
+            raise LanguageServerError(_REQUEST_FAILED, str(e))
+
+    def on_type_formatting(self, params: Message) -> Any:
+        document = self.get_document(params)
+        # NOTE: format the declaration on the line that was just completed
+        line = max(0, params["position"]["line"] - 1)
+        try:
+            return self.format_lines(document, line, line)
+        except (ParseError, AssertionError, LimitExceeded):
+            # NOTE: the document is likely incomplete while typing
+            return []
+
+    def format_lines(
+        self, document: TextDocument, start_line: int, end_line: int
+    ) -> List[TextEdit]:
+        """
+        Format the top-level nodes that overlap with the given lines.
+
+        The header, which consists of the match context and any comments before
+        it, is formatted as a whole. Declarations in the body are formatted as
+        a single span, which is extended to include any adjacent short commands
+        if they are aligned.
+        """
+        tree = tree_sitter_talon.parser.parse(document.text.encode("utf-8"))
+        ts_children: List[tree_sitter.Node] = []
+        for ts_child in tree.root_node.named_children:
+            if ts_child.type == "declarations":
+                ts_children.extend(ts_child.named_children)
+            else:
+                ts_children.append(ts_child)
+
+        # Find the nodes in the header and the body that overlap with the lines
+        header_end = 0
+        for index, ts_child in enumerate(ts_children):
+            if ts_child.type == "matches":
+                header_end = index + 1
+                break
+        overlaps = [
+            index
+            for index, ts_child in enumerate(ts_children)
+            if ts_child.start_point[0] <= end_line
+            and start_line <= ts_child.end_point[0]
+        ]
+
+        text_edits: List[TextEdit] = []
+
+        header = [index for index in overlaps if index < header_end]
+        matches = ts_children[header_end - 1] if header_end else None
+        if header and matches is not None and matches.end_byte > matches.start_byte:
+            text_edit = self.format_span(
+                document,
+                document.get_offset_from_point(ts_children[0].start_point),
+                document.get_offset_from_point(matches.end_point),
+                prefix="",
+            )
+            if text_edit:
+                text_edits.append(text_edit)
+
+        body = [index for index in overlaps if index >= header_end]
+        if body:
+            first, last = body[0], body[-1]
+            if self.talon_fmt.align_short_commands is True:
+                # NOTE: short commands are aligned with adjacent short commands
+                while first > header_end and self.is_short_command(
+                    ts_children[first - 1]
+                ):
+                    first -= 1
+                while last + 1 < len(ts_children) and self.is_short_command(
+                    ts_children[last + 1]
+                ):
+                    last += 1
+            # NOTE: the declarations are formatted after an empty match context,
+            #       so that they are never parsed as part of the match context
+            text_edit = self.format_span(
+                document,
+                document.get_offset_from_point(ts_children[first].start_point),
+                document.get_offset_from_point(ts_children[last].end_point),
+                prefix="-\n",
+            )
+            if text_edit:
+                text_edits.append(text_edit)
+
+        return text_edits
+
+    @staticmethod
+    def is_short_command(ts_child: tree_sitter.Node) -> bool:
+        if ts_child.type != "command_declaration" or ts_child.has_error:
+            return False
+        node = tree_sitter_talon.from_tree_sitter(ts_child)
+        return isinstance(node, TalonCommandDeclaration) and node.is_short()
+
+    def format_span(
+        self, document: TextDocument, start: int, end: int, *, prefix: str
+    ) -> Optional[TextEdit]:
+        # NOTE: include the newline after the span, as the output ends with one
+        if document.text.startswith("\n", end):
+            end += 1
+        contents = document.text[start:end]
+        output = self.talon_fmt(prefix + contents, filename=document.filename)
+        if prefix and output.startswith(prefix):
+            output = output[len(prefix) :]
+        if output == contents:
+            return None
+        return {"range": document.get_range(start, end), "newText": output}
+
+
+# The handlers for each method
+_handlers: Dict[str, Callable[[LanguageServer, Message], Any]] = {
+    "initialize": LanguageServer.initialize,
+    "shutdown": LanguageServer.shutdown,
+    "textDocument/didOpen": LanguageServer.did_open,
+    "textDocument/didChange": LanguageServer.did_change,
+    "textDocument/didClose": LanguageServer.did_close,
+    "textDocument/formatting": LanguageServer.formatting,
+    "textDocument/rangeFormatting": LanguageServer.range_formatting,
+    "textDocument/onTypeFormatting": LanguageServer.on_type_formatting,
+}
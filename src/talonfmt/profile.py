@@ -0,0 +1,80 @@
+import json
+from dataclasses import asdict, dataclass, field
+from typing import IO, Any, Dict, List, Mapping
+
+
+@dataclass
+class FileProfile:
+    """
+    The time spent on a file, in total and in each phase, and its counters.
+    """
+
+    filename: str
+    seconds: float
+    timings: Dict[str, float] = field(default_factory=dict)
+    counts: Dict[str, int] = field(default_factory=dict)
+
+
+@dataclass
+class Profile:
+    """
+    The time spent on a run of talonfmt, in total, in each phase, and on each
+    file, and the counters summed over all files.
+    """
+
+    seconds: float = 0.0
+    timings: Dict[str, float] = field(default_factory=dict)
+    counts: Dict[str, int] = field(default_factory=dict)
+    files: List[FileProfile] = field(default_factory=list)
+
+    def add(
+        self,
+        filename: str,
+        seconds: float,
+        timings: Mapping[str, float],
+        counts: Mapping[str, int],
+    ) -> None:
+        self.files.append(
+            FileProfile(
+                filename=filename,
+                seconds=seconds,
+                timings=dict(timings),
+                counts=dict(counts),
+            )
+        )
+        for phase, phase_seconds in timings.items():
+            self.timings[phase] = self.timings.get(phase, 0.0) + phase_seconds
+        for name, count in counts.items():
+            self.counts[name] = self.counts.get(name, 0) + count
+
+    def slowest(self, count: int) -> List[FileProfile]:
+        return sorted(self.files, key=lambda file: file.seconds, reverse=True)[:count]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    def write_json(self, handle: IO[str]) -> None:
+        json.dump(self.to_dict(), handle, indent=2)
+        handle.write("\n")
+
+    def write_report(self, handle: IO[str], *, slowest: int = 10) -> None:
+        files_per_second = len(self.files) / self.seconds if self.seconds else 0.0
+        handle.write(
+            f"Processed {len(self.files)} file(s) in {self.seconds:.3f}s "
+            f"({files_per_second:.1f} files/s)\n"
+        )
+        if self.timings:
+            handle.write("Time spent in each phase:\n")
+            for phase, seconds in sorted(self.timings.items()):
+                handle.write(f"  {phase:<24} {seconds:>9.3f}s\n")
+        if self.counts:
+            handle.write("Counters:\n")
+            for name, count in sorted(self.counts.items()):
+                handle.write(f"  {name:<24} {count:>10}\n")
+        slowest_files = self.slowest(slowest)
+        if slowest_files:
+            handle.write(f"Slowest {len(slowest_files)} file(s):\n")
+            for file in slowest_files:
+                handle.write(f"  {file.seconds:>9.3f}s  {file.filename}\n")
+                for phase, seconds in sorted(file.timings.items()):
+                    handle.write(f"      {phase:<20} {seconds:>9.3f}s\n")
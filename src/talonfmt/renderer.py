@@ -0,0 +1,99 @@
+import contextlib
+import dataclasses
+from time import perf_counter
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from doc_printer import Doc, Line, SimpleDocRenderer, SmartDocRenderer, Token
+from doc_printer.smart import LineWidthExceeded
+
+
+class RenderTimeExceeded(Exception):
+    pass
+
+
+def check_deadline(deadline: Optional[float]) -> None:
+    """
+    Raise RenderTimeExceeded if the deadline, as given by perf_counter, has
+    passed.
+    """
+    if deadline is not None and perf_counter() > deadline:
+        raise RenderTimeExceeded()
+
+
+@contextlib.contextmanager
+def render_deadline(doc_renderer: SimpleDocRenderer, deadline: float) -> Iterator[None]:
+    """
+    Raise RenderTimeExceeded from the renderer once the deadline, as given by
+    perf_counter, has passed.
+
+    The deadline is checked for every token, including the tokens rendered
+    while the smart renderer tries each alternative.
+    """
+
+    def check_deadline(token: Token) -> Token:
+        if perf_counter() > deadline:
+            raise RenderTimeExceeded()
+        return token
+
+    doc_renderer.on_emit.append(check_deadline)
+    try:
+        yield None
+    finally:
+        doc_renderer.on_emit.remove(check_deadline)
+
+
+@dataclasses.dataclass
+class BoundedSmartDocRenderer(SmartDocRenderer):
+    """
+    A smart renderer, which looks ahead at most the given number of lines when
+    it chooses between alternatives.
+
+    The smart renderer tries each alternative, and commits to the first that
+    fits within the maximum line width, which requires it to render and buffer
+    the whole alternative. For instance, an aligned group of short commands
+    is a single alternative, which may be as long as the whole file.
+
+    This renderer commits to an alternative once its first lookahead lines
+    fit, and streams the rest of it, so the time and memory spent choosing
+    between alternatives are bounded by the lookahead. The output is the same
+    as that of the smart renderer, unless a line past the lookahead exceeds
+    the maximum line width.
+    """
+
+    lookahead: int = 100
+
+    def render_with_lookahead(self, alts: Sequence[Doc]) -> Iterator[Token]:
+        fallback, *rest = alts
+        for alt in reversed(rest):
+            with self.strict():
+                try:
+                    token_buffer, token_stream = self.buffer_lines(
+                        self.render_simple(alt), self.lookahead
+                    )
+                except LineWidthExceeded:
+                    continue
+            yield from map(self.emit, token_buffer)
+            # NOTE: the remaining tokens are emitted as they are rendered
+            if token_stream is not None:
+                yield from token_stream
+            return
+        yield from self.render(fallback)
+
+    def buffer_lines(
+        self, token_stream: Iterator[Token], lines: int
+    ) -> Tuple[List[Token], Optional[Iterator[Token]]]:
+        """
+        Buffer the given number of lines from the token stream.
+
+        Returns the buffered tokens and the rest of the token stream, or None
+        if the token stream ended.
+        """
+        token_buffer: List[Token] = []
+        with self.buffering():
+            for token in token_stream:
+                token_buffer.append(token)
+                if token is Line:
+                    lines -= 1
+                    if lines <= 0:
+                        return (token_buffer, token_stream)
+        return (token_buffer, None)
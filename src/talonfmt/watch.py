@@ -0,0 +1,306 @@
+import abc
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from . import TalonFmt
+from .discovery import FileFinder
+from .files import FormatResult, format_file
+
+# The default time to wait for a burst of writes to end, in seconds
+DEFAULT_DEBOUNCE: float = 0.1
+
+# The default time between two scans by the polling backend, in seconds
+DEFAULT_POLL_INTERVAL: float = 0.5
+
+# The identity of a version of a file: its inode, size, and mtime
+FileStat = Tuple[int, int, int]
+
+
+def get_file_stat(path: str) -> Optional[FileStat]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+################################################################################
+# Backends
+################################################################################
+
+
+class WatchBackend(abc.ABC):
+    """
+    A source of file change events for a set of files and directory trees.
+    """
+
+    def __init__(self, file_finder: FileFinder, paths: Sequence[Path]) -> None:
+        self.file_finder = file_finder
+        self.paths = [Path(os.path.abspath(path)) for path in paths]
+
+    def is_watched(self, path: str) -> bool:
+        """
+        Test whether changes to the file should be reported.
+        """
+        for watched_path in self.paths:
+            if os.fspath(watched_path) == path:
+                return True
+            if self.file_finder.includes(watched_path, Path(path)):
+                return True
+        return False
+
+    @abc.abstractmethod
+    def wait(self, timeout: float) -> Set[str]:
+        """
+        Wait at most timeout seconds for changes, and return the paths of the
+        files which changed.
+        """
+
+    def close(self) -> None:
+        pass
+
+
+class PollingBackend(WatchBackend):
+    """
+    Detect changes by scanning the files and comparing their mtimes.
+    """
+
+    def __init__(
+        self,
+        file_finder: FileFinder,
+        paths: Sequence[Path],
+        *,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+    ) -> None:
+        super().__init__(file_finder, paths)
+        self.poll_interval = poll_interval
+        self._file_stats = self.scan()
+        self._last_scan = time.monotonic()
+
+    def scan(self) -> Dict[str, Optional[FileStat]]:
+        file_stats: Dict[str, Optional[FileStat]] = {}
+        for path in self.paths:
+            if path.is_dir():
+                for file in self.file_finder.walk(path):
+                    file_stats[os.fspath(file)] = get_file_stat(os.fspath(file))
+            else:
+                file_stats[os.fspath(path)] = get_file_stat(os.fspath(path))
+        return file_stats
+
+    def wait(self, timeout: float) -> Set[str]:
+        next_scan = self._last_scan + self.poll_interval
+        time.sleep(max(0.0, min(timeout, next_scan - time.monotonic())))
+        if time.monotonic() < next_scan:
+            return set()
+        file_stats = self.scan()
+        self._last_scan = time.monotonic()
+        changed = {
+            path
+            for path, file_stat in file_stats.items()
+            if file_stat is not None and self._file_stats.get(path) != file_stat
+        }
+        self._file_stats = file_stats
+        return changed
+
+
+class InotifyBackend(WatchBackend):
+    """
+    Detect changes with inotify, which is only available on Linux.
+    """
+
+    # See inotify(7)
+    IN_CLOSE_WRITE: int = 0x00000008
+    IN_MOVED_TO: int = 0x00000080
+    IN_CREATE: int = 0x00000100
+    IN_Q_OVERFLOW: int = 0x00004000
+    IN_IGNORED: int = 0x00008000
+    IN_ONLYDIR: int = 0x01000000
+    IN_ISDIR: int = 0x40000000
+
+    MASK: int = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, file_finder: FileFinder, paths: Sequence[Path]) -> None:
+        super().__init__(file_finder, paths)
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd: int = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        # The watched directories by watch descriptor
+        self._watches: Dict[int, str] = {}
+        for path in self.paths:
+            if path.is_dir():
+                self.add_tree(path)
+            else:
+                self.add_watch(os.fspath(path.parent))
+
+    def add_watch(self, directory: str) -> None:
+        wd = self._libc.inotify_add_watch(
+            self._fd, os.fsencode(directory), self.MASK | self.IN_ONLYDIR
+        )
+        if wd >= 0:
+            self._watches[wd] = directory
+
+    def add_tree(self, root: Path) -> None:
+        for directory in self.file_finder.walk(root, directories=True):
+            if directory.is_dir():
+                self.add_watch(os.path.abspath(directory))
+
+    def is_watched_directory(self, path: str) -> bool:
+        for watched_path in self.paths:
+            if watched_path.is_dir():
+                if self.file_finder.includes(watched_path, Path(path), is_dir=True):
+                    return True
+        return False
+
+    def wait(self, timeout: float) -> Set[str]:
+        changed: Set[str] = set()
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return changed
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & self.IN_Q_OVERFLOW:
+                # NOTE: events were lost, so report every file
+                for watched_path in self.paths:
+                    if watched_path.is_dir():
+                        files = self.file_finder.walk(watched_path)
+                        changed.update(map(os.fspath, files))
+                    else:
+                        changed.add(os.fspath(watched_path))
+                continue
+            if mask & self.IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            directory = self._watches.get(wd)
+            if directory is None:
+                continue
+            path = os.path.join(directory, name)
+            if mask & self.IN_ISDIR:
+                # NOTE: watch new directories, and report the files in them,
+                #       which may have been written before the watch was added
+                if self.is_watched_directory(path):
+                    self.add_tree(Path(path))
+                    changed.update(map(os.fspath, self.file_finder.walk(Path(path))))
+            elif mask & (self.IN_CLOSE_WRITE | self.IN_MOVED_TO):
+                if self.is_watched(path):
+                    changed.add(path)
+        return changed
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+def create_backend(
+    file_finder: FileFinder,
+    paths: Sequence[Path],
+    *,
+    backend: str = "auto",
+    poll_interval: float = DEFAULT_POLL_INTERVAL,
+) -> WatchBackend:
+    """
+    Create a backend, using inotify if it is available, unless backend is
+    "poll", and polling otherwise.
+    """
+    if backend in ("auto", "inotify") and sys.platform.startswith("linux"):
+        try:
+            return InotifyBackend(file_finder, paths)
+        except (OSError, AttributeError):
+            # NOTE: libc does not provide inotify, or the limit is reached
+            if backend == "inotify":
+                raise
+    elif backend == "inotify":
+        raise OSError(f"inotify is not available on {sys.platform}")
+    return PollingBackend(file_finder, paths, poll_interval=poll_interval)
+
+
+################################################################################
+# Watcher
+################################################################################
+
+
+@dataclass
+class Watcher:
+    """
+    Format files in place whenever they are written.
+
+    The same instance of TalonFmt is used for every file, so the formatter,
+    renderer, and .editorconfig lookups stay warm. Bursts of writes are
+    debounced, and writes by the watcher itself are ignored.
+    """
+
+    talon_fmt: TalonFmt
+    paths: Sequence[Path]
+    file_finder: FileFinder = field(default_factory=FileFinder)
+    backend: str = "auto"
+    debounce: float = DEFAULT_DEBOUNCE
+    poll_interval: float = DEFAULT_POLL_INTERVAL
+    on_result: Optional[Callable[[FormatResult], None]] = None
+
+    # The version of each file written by the watcher
+    _written: Dict[str, FileStat] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+
+    def run(self, stop: Optional[threading.Event] = None) -> None:
+        """
+        Watch the files until stop is set, or forever if it is not given.
+        """
+        watch_backend = create_backend(
+            self.file_finder,
+            self.paths,
+            backend=self.backend,
+            poll_interval=self.poll_interval,
+        )
+        try:
+            while stop is None or not stop.is_set():
+                changed = watch_backend.wait(self.poll_interval)
+                if not changed:
+                    continue
+                # NOTE: wait until the files have been quiet for the debounce
+                #       interval, but no longer than ten times the interval
+                deadline = time.monotonic() + 10 * self.debounce
+                while time.monotonic() < deadline:
+                    more_changed = watch_backend.wait(self.debounce)
+                    if not more_changed:
+                        break
+                    changed.update(more_changed)
+                self.format_files(sorted(changed))
+        finally:
+            watch_backend.close()
+
+    def format_files(self, paths: Sequence[str]) -> List[FormatResult]:
+        results: List[FormatResult] = []
+        for path in paths:
+            file_stat = get_file_stat(path)
+            if file_stat is None or self._written.get(path) == file_stat:
+                continue
+            self._written.pop(path, None)
+            result = format_file(self.talon_fmt, Path(path), in_place=True)
+            if result.changed and result.error is None:
+                written_file_stat = get_file_stat(path)
+                if written_file_stat is not None:
+                    self._written[path] = written_file_stat
+            if self.on_result is not None:
+                self.on_result(result)
+            results.append(result)
+        return results
@@ -0,0 +1,26 @@
+from pathlib import Path
+from typing import List
+
+import pytest
+from ruamel.yaml import YAML
+
+GOLDEN_DIR = Path(__file__).parent / "data" / "golden" / "simple" / "default"
+
+
+def get_golden_inputs(count: int) -> List[str]:
+    yaml = YAML(typ="safe")
+    return [
+        yaml.load(golden_path.read_text(encoding="utf-8"))["input"]
+        for golden_path in sorted(GOLDEN_DIR.glob("knausj_*.yml"))[:count]
+    ]
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(
+    tmp_path_factory: pytest.TempPathFactory, monkeypatch: pytest.MonkeyPatch
+) -> Path:
+    # NOTE: the tests must not write to the user's cache directory, which is
+    #       used by default, including by talonfmt in subprocesses
+    cache_dir = tmp_path_factory.mktemp("cache")
+    monkeypatch.setenv("TALONFMT_CACHE_DIR", str(cache_dir))
+    return cache_dir
@@ -0,0 +1,71 @@
+import os
+from pathlib import Path
+
+import pytest
+
+import talonfmt.cache
+from talonfmt.cache import ResultCache
+
+from .test_cli import create_talon_files, run_talonfmt
+
+
+def test_cache_key_depends_on_options(tmp_path: Path) -> None:
+    cache = ResultCache(tmp_path)
+    key1 = cache.key(b"hello: world\n", options={"indent_size": 4})
+    key2 = cache.key(b"hello: world\n", options={"indent_size": 2})
+    key3 = cache.key(b"hello: there\n", options={"indent_size": 4})
+    assert len({key1, key2, key3}) == 3
+    assert key1 == cache.key(b"hello: world\n", options={"indent_size": 4})
+
+
+def test_cache_key_depends_on_source(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    cache = ResultCache(tmp_path)
+    key1 = cache.key(b"hello: world\n", options={})
+    monkeypatch.setattr(talonfmt.cache, "_get_source_digest", lambda: "changed")
+    key2 = cache.key(b"hello: world\n", options={})
+    assert key1 != key2
+
+
+def test_cache_get_put(tmp_path: Path) -> None:
+    cache = ResultCache(tmp_path)
+    key1 = cache.key(b"formatted", options={})
+    key2 = cache.key(b"unformatted", options={})
+    assert cache.get(key1) is None
+    cache.put(key1, output=None)
+    cache.put(key2, output="formatted\n")
+    entry1 = cache.get(key1)
+    entry2 = cache.get(key2)
+    assert entry1 is not None and entry1.unchanged
+    assert entry2 is not None and entry2.output == "formatted\n"
+
+
+def test_cache_prune(tmp_path: Path) -> None:
+    cache = ResultCache(tmp_path, max_size=100)
+    keys = [cache.key(str(i).encode(), options={}) for i in range(10)]
+    for i, key in enumerate(keys):
+        cache.put(key, output="x" * 39)
+        os.utime(cache.path(key), (i, i))
+    cache.prune()
+    assert [cache.get(key) is not None for key in keys] == [False] * 8 + [True] * 2
+
+
+def test_cache_cli(tmp_path: Path) -> None:
+    talon_dir = tmp_path / "talon"
+    talon_dir.mkdir()
+    cache_dir = tmp_path / "cache"
+    create_talon_files(talon_dir, 8)
+    uncached = run_talonfmt("--no-cache", str(talon_dir))
+    cold = run_talonfmt("--cache-dir", str(cache_dir), str(talon_dir))
+    warm = run_talonfmt("--cache-dir", str(cache_dir), str(talon_dir))
+    assert len(list(cache_dir.glob("*/*"))) == 8
+    assert uncached.stdout == cold.stdout == warm.stdout
+    assert uncached.stderr == cold.stderr == warm.stderr
+
+
+def test_cache_cli_default_dir(tmp_path: Path, cache_dir: Path) -> None:
+    create_talon_files(tmp_path, 2)
+    assert run_talonfmt(str(tmp_path)).returncode == 0
+    # NOTE: the cache_dir fixture sets the default cache directory for tests
+    assert len(list(cache_dir.glob("*/*"))) == 2
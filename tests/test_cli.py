@@ -0,0 +1,230 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from pytest import mark
+from ruamel.yaml import YAML
+
+from talonfmt.files import decode
+
+GOLDEN_DIR = Path(__file__).parent / "data" / "golden" / "simple" / "default"
+
+# The maximum time to import talonfmt.cli, in seconds
+IMPORT_TIME_BUDGET: float = 0.2
+
+# The modules that should only be imported when formatting
+LAZY_MODULES: Tuple[str, ...] = (
+    "doc_printer",
+    "tree_sitter_talon",
+    "talonfmt.formatter",
+)
+
+
+def create_talon_files(directory: Path, count: int) -> List[Path]:
+    yaml = YAML(typ="safe")
+    files: List[Path] = []
+    for golden_path in sorted(GOLDEN_DIR.glob("knausj_*.yml"))[:count]:
+        golden = yaml.load(golden_path.read_text(encoding="utf-8"))
+        file = directory / f"{golden_path.stem}.talon"
+        file.write_text(golden["input"], encoding="utf-8")
+        files.append(file)
+    return files
+
+
+def run_talonfmt(*args: str) -> "subprocess.CompletedProcess[str]":
+    return subprocess.run(
+        ["talonfmt", *args], capture_output=True, encoding="utf-8", check=False
+    )
+
+
+def test_jobs_is_deterministic(tmp_path: Path) -> None:
+    create_talon_files(tmp_path, 12)
+    (tmp_path / "invalid.talon").write_text("this is not talon(\n")
+    sequential = run_talonfmt("--jobs", "1", str(tmp_path))
+    parallel = run_talonfmt("--jobs", "4", str(tmp_path))
+    assert sequential.returncode == parallel.returncode == 0
+    assert sequential.stdout == parallel.stdout
+    assert sequential.stderr == parallel.stderr
+    assert "Fixed" in parallel.stderr
+
+
+def test_jobs_fail_on_change(tmp_path: Path) -> None:
+    create_talon_files(tmp_path, 4)
+    result = run_talonfmt("--jobs", "2", "--fail-on-change", str(tmp_path))
+    assert result.returncode == 2
+
+
+def test_jobs_in_place_stops_at_error(tmp_path: Path) -> None:
+    contents: Dict[int, Dict[str, str]] = {}
+    for jobs in (1, 2):
+        directory = tmp_path / f"jobs{jobs}"
+        directory.mkdir()
+        files = create_talon_files(directory, 8)
+        invalid = directory / f"{files[len(files) // 2].stem}_invalid.talon"
+        invalid.write_text("this is not talon(\n", encoding="utf-8")
+        original = {
+            file.name: file.read_text(encoding="utf-8")
+            for file in sorted(directory.glob("*.talon"))
+        }
+        result = run_talonfmt(
+            "--jobs",
+            str(jobs),
+            "--no-cache",
+            "--in-place",
+            "--fail-on-error",
+            str(directory),
+        )
+        assert result.returncode == 1
+        contents[jobs] = {
+            file.name: file.read_text(encoding="utf-8")
+            for file in sorted(directory.glob("*.talon"))
+        }
+        # NOTE: the files after the invalid file must not be written
+        names = list(original)
+        after = names[names.index(invalid.name) :]
+        assert all(contents[jobs][name] == original[name] for name in after)
+        assert any(contents[jobs][name] != original[name] for name in names)
+    assert contents[1] == contents[2]
+
+
+def test_check_does_not_write(tmp_path: Path) -> None:
+    files = create_talon_files(tmp_path, 4)
+    contents = [file.read_text(encoding="utf-8") for file in files]
+    result = run_talonfmt("--check", "--no-cache", "--in-place", str(tmp_path))
+    assert result.returncode == 2
+    assert result.stdout == ""
+    assert "Would fix" in result.stderr
+    assert [file.read_text(encoding="utf-8") for file in files] == contents
+
+
+def test_check_formatted(tmp_path: Path) -> None:
+    create_talon_files(tmp_path, 4)
+    assert run_talonfmt("--no-cache", "--in-place", str(tmp_path)).returncode == 0
+    for cache in ("--no-cache", "--cache"):
+        result = run_talonfmt("--check", cache, str(tmp_path))
+        assert result.returncode == 0
+        assert result.stdout == ""
+
+
+def test_in_place_only_writes_changed_files(tmp_path: Path) -> None:
+    files = create_talon_files(tmp_path, 4)
+    assert run_talonfmt("--no-cache", "--in-place", str(tmp_path)).returncode == 0
+    for file in files:
+        os.utime(file, ns=(0, 0))
+    profile_json = tmp_path / "profile.json"
+    for cache in ("--no-cache", "--cache"):
+        result = run_talonfmt(
+            cache, "--in-place", "--profile-json", str(profile_json), str(tmp_path)
+        )
+        assert result.returncode == 0
+        assert [file.stat().st_mtime_ns for file in files] == [0] * len(files)
+        profile = json.loads(profile_json.read_text(encoding="utf-8"))
+        assert "write:bytes" not in profile["counts"]
+
+
+def test_in_place_preserves_encoding_and_newlines(tmp_path: Path) -> None:
+    file = tmp_path / "bom.talon"
+    file.write_bytes("-\r\ncaf\u00e9  :   key(a)\r\n".encode("utf-8-sig"))
+    profile_json = tmp_path / "profile.json"
+    result = run_talonfmt(
+        "--no-cache", "--in-place", "--profile-json", str(profile_json), str(file)
+    )
+    assert result.returncode == 0
+    output = "-\r\ncaf\u00e9:\r\n    key(a)\r\n".encode("utf-8-sig")
+    assert file.read_bytes() == output
+    assert list(tmp_path.glob(".*")) == []
+    profile = json.loads(profile_json.read_text(encoding="utf-8"))
+    assert profile["counts"]["write:files"] == 1
+    assert profile["counts"]["write:bytes"] == len(output)
+
+
+@mark.skipif(sys.platform == "win32", reason="symbolic links need privileges")
+def test_in_place_writes_through_symlinks(tmp_path: Path) -> None:
+    real = tmp_path / "real.talon"
+    real.write_text("foo:   bar()\n", encoding="utf-8")
+    link = tmp_path / "link.talon"
+    link.symlink_to(real.name)
+    result = run_talonfmt("--no-cache", "--in-place", str(link))
+    assert result.returncode == 0
+    assert link.is_symlink()
+    assert real.read_text(encoding="utf-8") == "foo:\n    bar()\n"
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "link.talon",
+        "real.talon",
+    ]
+
+
+def test_decode() -> None:
+    # NOTE: UTF-8 contents are passed to the parser as they are read
+    contents = "-\ncaf\u00e9: key(a)\n".encode("utf-8")
+    assert decode(contents) == (contents, "utf-8")
+    assert decode(contents.replace(b"\n", b"\r\n")) == (contents.decode(), "utf-8")
+    assert decode(b"\xef\xbb\xbf" + contents) == (contents.decode(), "utf-8-sig")
+
+
+def test_profile(tmp_path: Path) -> None:
+    files = create_talon_files(tmp_path, 4)
+    profile_json = tmp_path / "profile.json"
+    result = run_talonfmt(
+        "--no-cache",
+        "--profile",
+        "--profile-slowest",
+        "2",
+        "--profile-json",
+        str(profile_json),
+        *map(str, files),
+    )
+    assert result.returncode == 0
+    assert "Time spent in each phase:" in result.stderr
+    assert "Slowest 2 file(s):" in result.stderr
+    profile = json.loads(profile_json.read_text(encoding="utf-8"))
+    assert [file["filename"] for file in profile["files"]] == list(map(str, files))
+    assert {"read", "parse", "format", "render"} <= set(profile["timings"])
+    assert profile["counts"]["format:groups"] > 0
+    for file in profile["files"]:
+        assert file["seconds"] >= sum(file["timings"].values())
+
+
+def get_import_times(*args: str) -> Dict[str, float]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        input="",
+        capture_output=True,
+        encoding="utf-8",
+        check=False,
+    )
+    import_times: Dict[str, float] = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:"):
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                import_times[name.strip()] = int(cumulative) / 1_000_000
+    return import_times
+
+
+@mark.parametrize(
+    "args",
+    [
+        ("-c", "import talonfmt.cli"),
+        ("-m", "talonfmt.cli", "--version"),
+        ("-m", "talonfmt.cli", "--help"),
+        ("-m", "talonfmt.cli"),
+    ],
+    ids=["import", "version", "help", "empty"],
+)
+def test_startup_is_lazy(args: Tuple[str, ...]) -> None:
+    import_times = get_import_times(*args)
+    assert "talonfmt" in import_times
+    for module in LAZY_MODULES:
+        assert module not in import_times
+
+
+def test_startup_import_time() -> None:
+    # NOTE: take the best of three runs to reduce noise
+    import_time = min(
+        get_import_times("-c", "import talonfmt.cli")["talonfmt.cli"] for _ in range(3)
+    )
+    assert import_time < IMPORT_TIME_BUDGET
@@ -0,0 +1,132 @@
+import io
+import json
+import os
+import stat
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+
+import talonfmt
+from talonfmt.daemon import (
+    MAX_TALON_FMTS,
+    Daemon,
+    DaemonClient,
+    DaemonError,
+    format_with_daemon,
+    get_default_socket_path,
+)
+
+UNFORMATTED = "hello  world:   key( enter )\n"
+
+FORMATTED = "hello world:\n    key(enter)\n"
+
+
+@pytest.fixture
+def socket_path(tmp_path: Path) -> Iterator[str]:
+    socket_path = str(tmp_path / "talonfmt.sock")
+    thread = threading.Thread(target=Daemon().serve_socket, args=(socket_path,))
+    thread.start()
+    deadline = time.monotonic() + 10.0
+    while True:
+        try:
+            with DaemonClient(socket_path) as client:
+                client.request({"method": "ping"})
+            break
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.01)
+    yield socket_path
+    with DaemonClient(socket_path) as client:
+        client.request({"method": "shutdown"})
+    thread.join()
+    assert not Path(socket_path).exists()
+
+
+def test_daemon_socket(socket_path: str) -> None:
+    with DaemonClient(socket_path) as client:
+        for id in range(3):
+            response = client.request({"id": id, "contents": UNFORMATTED})
+            assert response == {"id": id, "output": FORMATTED}
+        response = client.request({"method": "check", "contents": FORMATTED})
+        assert response == {"id": None, "changed": False}
+        response = client.request({"contents": "hello(\n"})
+        assert "error" in response
+    output = format_with_daemon(
+        UNFORMATTED, options={"max_line_width": 80}, socket_path=socket_path
+    )
+    assert output == talonfmt.talonfmt(UNFORMATTED, max_line_width=80)
+
+
+def test_daemon_fallback(tmp_path: Path) -> None:
+    socket_path = str(tmp_path / "missing.sock")
+    output = format_with_daemon(UNFORMATTED, socket_path=socket_path)
+    assert output == FORMATTED
+    with pytest.raises(OSError):
+        format_with_daemon(UNFORMATTED, socket_path=socket_path, fallback=False)
+    with pytest.raises(DaemonError):
+        format_with_daemon("hello(\n", socket_path=socket_path)
+
+
+def test_daemon_stdio() -> None:
+    requests = [
+        {"id": 1, "contents": UNFORMATTED},
+        {"id": 2, "contents": UNFORMATTED, "options": {"simple_layout": "longest"}},
+        {"id": 3, "method": "shutdown"},
+        {"id": 4, "contents": UNFORMATTED},
+    ]
+    rfile = io.StringIO("".join(json.dumps(request) + "\n" for request in requests))
+    wfile = io.StringIO()
+    assert not Daemon().serve(rfile, wfile)
+    responses = [json.loads(line) for line in wfile.getvalue().splitlines()]
+    assert responses == [
+        {"id": 1, "output": FORMATTED},
+        {"id": 2, "output": talonfmt.talonfmt(UNFORMATTED, simple_layout="longest")},
+        {"id": 3},
+    ]
+
+
+def test_daemon_default_socket_path(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.delenv("TALONFMT_SOCKET", raising=False)
+    monkeypatch.delenv("XDG_RUNTIME_DIR", raising=False)
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    socket_path = Path(get_default_socket_path())
+    assert socket_path.parent.parent == tmp_path
+    assert stat.S_IMODE(socket_path.parent.stat().st_mode) == 0o700
+    assert get_default_socket_path() == str(socket_path)
+    # NOTE: a directory which other users can access is refused
+    socket_path.parent.chmod(0o777)
+    with pytest.raises(PermissionError):
+        get_default_socket_path()
+
+
+def test_daemon_refuses_socket_of_other_user(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    socket_path = tmp_path / "talonfmt.sock"
+    socket_path.touch()
+    monkeypatch.setattr(os, "getuid", lambda: socket_path.stat().st_uid + 1)
+    with pytest.raises(PermissionError):
+        DaemonClient(str(socket_path))
+    with pytest.raises(DaemonError, match="owned by another user"):
+        Daemon().serve_socket(str(socket_path))
+    assert format_with_daemon(UNFORMATTED, socket_path=str(socket_path)) == FORMATTED
+
+
+def test_daemon_evicts_talon_fmts() -> None:
+    daemon = Daemon()
+    first = daemon.get_talon_fmt({"max_line_width": 1})
+    used = daemon.get_talon_fmt({"max_line_width": 2})
+    for max_line_width in range(3, MAX_TALON_FMTS + 3):
+        assert daemon.get_talon_fmt({"max_line_width": 2}) is used
+        daemon.get_talon_fmt({"max_line_width": max_line_width})
+    assert len(daemon._talon_fmts) == MAX_TALON_FMTS
+    # NOTE: the least recently used instances are evicted first
+    assert daemon.get_talon_fmt({"max_line_width": 2}) is used
+    assert daemon.get_talon_fmt({"max_line_width": 1}) is not first
@@ -0,0 +1,136 @@
+import os
+import subprocess
+from pathlib import Path
+from typing import Any, Iterator, List
+
+import pytest
+
+from talonfmt.discovery import FileFinder, deduplicate
+
+
+def make_tree(root: Path, *names: str) -> None:
+    for name in names:
+        file = root / name
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.write_text("-\nhello  :   key(a)\n", encoding="utf-8")
+
+
+def walk(root: Path, **kwargs: Any) -> List[str]:
+    return [
+        file.relative_to(root).as_posix() for file in FileFinder(**kwargs).walk(root)
+    ]
+
+
+def test_walk_agrees_with_glob(tmp_path: Path) -> None:
+    make_tree(tmp_path, "a.talon", "b.py", "x/b.talon", "x/y/c.talon", ".h/d.talon")
+    found = sorted(FileFinder(exclude=(), gitignore=False).walk(tmp_path))
+    assert found == sorted(tmp_path.glob("**/*.talon"))
+
+
+def test_walk_default_excludes(tmp_path: Path) -> None:
+    make_tree(
+        tmp_path,
+        "a.talon",
+        ".git/b.talon",
+        ".venv/lib/c.talon",
+        "node_modules/d/e.talon",
+        "x/node_modules/f.talon",
+        "x/g.talon",
+    )
+    assert walk(tmp_path) == ["a.talon", "x/g.talon"]
+
+
+def test_walk_exclude(tmp_path: Path) -> None:
+    make_tree(tmp_path, "a.talon", "vendor/b.talon", "x/vendor/c.talon", "x/d.talon")
+    assert walk(tmp_path, exclude=("vendor",)) == ["a.talon", "x/d.talon"]
+    assert walk(tmp_path, exclude=("x/vendor",)) == [
+        "a.talon",
+        "vendor/b.talon",
+        "x/d.talon",
+    ]
+    assert walk(tmp_path, exclude=("*/d.talon", "a.*")) == [
+        "vendor/b.talon",
+        "x/vendor/c.talon",
+    ]
+
+
+def test_walk_gitignore(tmp_path: Path) -> None:
+    make_tree(
+        tmp_path,
+        "a.talon",
+        "a.gen.talon",
+        "keep.gen.talon",
+        "build/b.talon",
+        "x/c.talon",
+        "x/d.talon",
+    )
+    (tmp_path / ".gitignore").write_text("*.gen.talon\n!keep.gen.talon\nbuild/\n")
+    (tmp_path / "x" / ".gitignore").write_text("/d.talon\n")
+    assert walk(tmp_path) == ["a.talon", "keep.gen.talon", "x/c.talon"]
+    assert walk(tmp_path, gitignore=False) == [
+        "a.gen.talon",
+        "a.talon",
+        "keep.gen.talon",
+        "build/b.talon",
+        "x/c.talon",
+        "x/d.talon",
+    ]
+
+
+def test_walk_parent_gitignore(tmp_path: Path) -> None:
+    make_tree(tmp_path / "repo", "x/a.talon", "x/ignored/b.talon")
+    (tmp_path / "repo" / ".git").mkdir()
+    (tmp_path / "repo" / ".gitignore").write_text("ignored/\n")
+    # NOTE: .gitignore files outside the repository are not used
+    (tmp_path / ".gitignore").write_text("*.talon\n")
+    assert walk(tmp_path / "repo" / "x") == ["a.talon"]
+
+
+def test_walk_prunes_excluded_directories(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    make_tree(tmp_path, "a.talon", "node_modules/x/y/b.talon", "ignored/c.talon")
+    (tmp_path / ".gitignore").write_text("ignored\n")
+    scanned: List[str] = []
+    scandir = os.scandir
+
+    def scandir_and_record(path: str) -> Iterator["os.DirEntry[str]"]:
+        scanned.append(Path(path).relative_to(tmp_path).as_posix())
+        return scandir(path)
+
+    monkeypatch.setattr(os, "scandir", scandir_and_record)
+    assert walk(tmp_path) == ["a.talon"]
+    assert scanned == ["."]
+
+
+def test_includes_agrees_with_walk(tmp_path: Path) -> None:
+    make_tree(tmp_path, "a.talon", "x/b.talon", "x/c.talon", "node_modules/d.talon")
+    (tmp_path / "x" / ".gitignore").write_text("c.talon\n")
+    file_finder = FileFinder()
+    found = list(file_finder.walk(tmp_path))
+    for file in [*tmp_path.glob("**/*.talon"), tmp_path / "a.py"]:
+        assert file_finder.includes(tmp_path, file) == (file in found)
+    assert file_finder.includes(tmp_path, tmp_path / "x", is_dir=True)
+    assert not file_finder.includes(tmp_path, tmp_path / "node_modules", is_dir=True)
+    assert not file_finder.includes(tmp_path / "x", tmp_path / "a.talon")
+
+
+def test_deduplicate(tmp_path: Path) -> None:
+    a, b = tmp_path / "a.talon", tmp_path / "x" / "b.talon"
+    assert deduplicate([a, b, tmp_path / "x" / ".." / "a.talon", b]) == [a, b]
+
+
+def test_cli_deduplicates_paths(tmp_path: Path) -> None:
+    make_tree(tmp_path, "a.talon", "x/b.talon", "node_modules/c.talon")
+    result = subprocess.run(
+        ["talonfmt", "--no-cache", "--check", ".", "x", "x/b.talon", "a.talon"],
+        cwd=tmp_path,
+        capture_output=True,
+        encoding="utf-8",
+        check=False,
+    )
+    assert result.returncode == 2
+    assert result.stderr.splitlines() == [
+        "Would fix a.talon",
+        f"Would fix {Path('x', 'b.talon')}",
+    ]
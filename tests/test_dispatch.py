@@ -0,0 +1,83 @@
+import functools
+from pathlib import Path
+from typing import Any, Iterator, List
+
+import pytest
+from ruamel.yaml import YAML
+from tree_sitter_talon import Node, parse
+from tree_sitter_type_provider.node_types import Branch
+
+from talonfmt._dispatchmethod import dispatchmethod
+from talonfmt.formatter import TalonFormatter
+
+GOLDEN_DIR = Path(__file__).parent / "data" / "golden" / "simple" / "default"
+
+
+def iter_nodes(node: Node) -> Iterator[Node]:
+    yield node
+    if isinstance(node, Branch):
+        for child in node.children:
+            yield from iter_nodes(child)
+
+
+@functools.lru_cache(maxsize=None)
+def get_corpus_nodes() -> List[Node]:
+    yaml = YAML(typ="safe")
+    nodes: List[Node] = []
+    for golden_path in sorted(GOLDEN_DIR.glob("*.yml")):
+        contents = yaml.load(golden_path.read_text(encoding="utf-8"))["input"]
+        try:
+            nodes.extend(iter_nodes(parse(contents, raise_parse_error=True)))
+        except Exception:
+            # NOTE: some golden files test parse errors
+            pass
+    return nodes
+
+
+@pytest.mark.parametrize("name", ["format", "format_lines", "format_steps"])
+def test_dispatch_agrees_with_singledispatch(name: str) -> None:
+    method: dispatchmethod[Any] = TalonFormatter.__dict__[name]
+    reference = functools.singledispatch(method.func)
+    for cls, impl in method.registry.items():
+        reference.register(cls, impl)
+    for cls in sorted({type(node) for node in get_corpus_nodes()}, key=repr):
+        assert method.dispatch(cls) is reference.dispatch(cls), cls
+
+
+def test_dispatch_falls_back_to_mro() -> None:
+    class Base:
+        pass
+
+    class Derived(Base):
+        pass
+
+    class Dispatcher:
+        @dispatchmethod
+        def visit(self, arg: object) -> str:
+            return "object"
+
+        @visit.register
+        def _(self, arg: Base) -> str:
+            return "base"
+
+    assert Dispatcher().visit(Derived()) == "base"
+    assert Dispatcher().visit(1) == "object"
+
+    @Dispatcher.visit.register
+    def _(self: Dispatcher, arg: Derived) -> str:
+        return "derived"
+
+    assert Dispatcher().visit(Derived()) == "derived"
+
+
+def test_dispatch_requires_class_annotation() -> None:
+    with pytest.raises(TypeError):
+
+        class Dispatcher:
+            @dispatchmethod
+            def visit(self, arg: object) -> None:
+                pass
+
+            @visit.register
+            def _(self, arg) -> None:  # type: ignore[no-untyped-def]
+                pass
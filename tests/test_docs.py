@@ -0,0 +1,42 @@
+from typing import List
+
+import pytest
+from doc_printer import Doc, Empty, Line, Space, Text, cat
+
+from talonfmt.formatter import COMMA_SPACE, PIPE, concat, join, spaced, words
+
+DOCS: List[Doc] = [
+    Empty,
+    Space,
+    Line,
+    Text("a"),
+    cat(Text("b"), Space, Text("c")),
+    cat(Space, Text("d")),
+    cat(Text("e"), Space),
+]
+
+
+@pytest.mark.parametrize("left", DOCS)
+@pytest.mark.parametrize("right", DOCS)
+def test_concat_and_spaced(left: Doc, right: Doc) -> None:
+    assert concat(left, right) == left / right
+    assert spaced(left, right) == left // right
+    assert spaced(left, right, left) == left // right // left
+
+
+@pytest.mark.parametrize("separator", [Empty, Space, COMMA_SPACE, PIPE])
+@pytest.mark.parametrize("count", [0, 1, 2, 3])
+def test_join(separator: Doc, count: int) -> None:
+    for start in range(len(DOCS)):
+        docs = (DOCS * 2)[start : start + count]
+        assert join(separator, docs) == separator.join(docs)
+
+
+@pytest.mark.parametrize(
+    "text", ["", "a", "a b", " a  b ", "a\tb", "#  comment   text"]
+)
+@pytest.mark.parametrize("collapse_whitespace", [False, True])
+def test_words(text: str, collapse_whitespace: bool) -> None:
+    assert words(text, collapse_whitespace=collapse_whitespace) == Text.words(
+        text, collapse_whitespace=collapse_whitespace
+    )
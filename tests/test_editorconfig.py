@@ -0,0 +1,105 @@
+import os
+from pathlib import Path
+from typing import Dict
+
+from editorconfig import get_properties
+
+from talonfmt import TalonFmt
+from talonfmt.editorconfig import (
+    clear_editorconfig_cache,
+    get_editorconfig,
+    get_editorconfig_cache_info,
+)
+
+ROOT_EDITORCONFIG = """\
+root = true
+
+[*]
+indent_size = 2
+
+[*.talon]
+indent_size = 4
+max_line_length = 80
+"""
+
+NESTED_EDITORCONFIG = """\
+[*.talon]
+max_line_length = 120
+
+[sub/special.talon]
+indent_size = tab
+tab_width = 8
+"""
+
+
+def create_tree(tmp_path: Path) -> None:
+    (tmp_path / ".editorconfig").write_text(ROOT_EDITORCONFIG)
+    (tmp_path / "a" / "b" / "sub").mkdir(parents=True)
+    (tmp_path / "a" / ".editorconfig").write_text(NESTED_EDITORCONFIG)
+    (tmp_path / "c" / "d").mkdir(parents=True)
+
+
+FILES = [
+    "x.talon",
+    "x.py",
+    "a/x.talon",
+    "a/b/x.talon",
+    "a/sub/special.talon",
+    "a/b/sub/special.talon",
+    "c/d/x.talon",
+    "c/d/y.talon",
+]
+
+
+def test_editorconfig_matches_library(tmp_path: Path) -> None:
+    create_tree(tmp_path)
+    clear_editorconfig_cache()
+    for file in FILES:
+        path = str((tmp_path / file).absolute())
+        assert get_editorconfig(path) == dict(get_properties(path))
+
+
+def test_editorconfig_cache(tmp_path: Path) -> None:
+    create_tree(tmp_path)
+    clear_editorconfig_cache()
+    for file in FILES:
+        get_editorconfig(str(tmp_path / file))
+    for file in FILES:
+        get_editorconfig(str(tmp_path / file))
+    cache_info = get_editorconfig_cache_info()
+    # NOTE: each .editorconfig file is parsed exactly once
+    assert cache_info.parse_misses == 2
+    assert cache_info.hits >= len(FILES)
+
+
+def test_editorconfig_reparses_modified_files(tmp_path: Path) -> None:
+    create_tree(tmp_path)
+    clear_editorconfig_cache()
+    path = str(tmp_path / "c" / "d" / "x.talon")
+    assert get_editorconfig(path)["max_line_length"] == "80"
+    editorconfig = tmp_path / ".editorconfig"
+    editorconfig.write_text(ROOT_EDITORCONFIG.replace("80", "100"))
+    stat = editorconfig.stat()
+    os.utime(editorconfig, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert get_editorconfig(path)["max_line_length"] == "100"
+
+
+def test_editorconfig_cache_counts(tmp_path: Path) -> None:
+    create_tree(tmp_path)
+    clear_editorconfig_cache()
+    counts: Dict[str, int] = {}
+
+    def on_count(name: str, count: int) -> None:
+        counts[name] = counts.get(name, 0) + count
+
+    talon_fmt = TalonFmt()
+    for file in ("c/d/x.talon", "c/d/y.talon", "c/d/x.talon"):
+        talon_fmt(
+            "-\nhello: key(a)\n", filename=str(tmp_path / file), on_count=on_count
+        )
+    assert counts["editorconfig:lookups"] == 3
+    assert counts["editorconfig:parse_misses"] == 1
+    assert counts["editorconfig:parse_hits"] == 2
+    # NOTE: the properties of x.talon are resolved once, and reused once
+    assert counts["editorconfig:misses"] == 2
+    assert counts["editorconfig:hits"] == 1
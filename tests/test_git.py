@@ -0,0 +1,138 @@
+import os
+import subprocess
+from pathlib import Path
+from typing import Dict, List
+
+import pytest
+
+from talonfmt.git import GitError, get_changed_files
+
+UNFORMATTED: str = "-\nhello  :   key(a)\n"
+
+FORMATTED: str = "-\nhello:\n    key(a)\n"
+
+
+@pytest.fixture
+def git_env(tmp_path: Path) -> Dict[str, str]:
+    # NOTE: stop git from finding any repository which contains tmp_path
+    return {
+        **os.environ,
+        "GIT_CEILING_DIRECTORIES": str(tmp_path),
+        "GIT_AUTHOR_NAME": "talonfmt",
+        "GIT_AUTHOR_EMAIL": "talonfmt@example.com",
+        "GIT_COMMITTER_NAME": "talonfmt",
+        "GIT_COMMITTER_EMAIL": "talonfmt@example.com",
+    }
+
+
+@pytest.fixture
+def repo(tmp_path: Path, git_env: Dict[str, str]) -> Path:
+    repo = tmp_path / "repo"
+    (repo / "sub").mkdir(parents=True)
+    for name in ("a.talon", "b.talon", "sub/c.talon", "d.py"):
+        (repo / name).write_text(UNFORMATTED, encoding="utf-8")
+    git(repo, git_env, "init", "--quiet")
+    git(repo, git_env, "add", ".")
+    git(repo, git_env, "commit", "--quiet", "--message", "initial")
+    return repo
+
+
+def git(repo: Path, env: Dict[str, str], *args: str) -> None:
+    subprocess.run(["git", *args], cwd=repo, env=env, check=True)
+
+
+def run_talonfmt(
+    cwd: Path, env: Dict[str, str], *args: str
+) -> "subprocess.CompletedProcess[str]":
+    return subprocess.run(
+        ["talonfmt", "--no-cache", *args],
+        cwd=cwd,
+        env=env,
+        capture_output=True,
+        encoding="utf-8",
+        check=False,
+    )
+
+
+def test_get_changed_files(repo: Path, git_env: Dict[str, str]) -> None:
+    (repo / "b.talon").write_text(UNFORMATTED + "\n", encoding="utf-8")
+    (repo / "sub" / "c.talon").write_text(UNFORMATTED + "\n", encoding="utf-8")
+    (repo / "d.py").write_text("", encoding="utf-8")
+    (repo / "a.talon").unlink()
+    assert get_changed_files(repo, staged=True) == []
+    changed: List[Path] = [repo / "b.talon", repo / "sub" / "c.talon"]
+    assert get_changed_files(repo, since="HEAD") == changed
+    assert get_changed_files(repo / "sub") == [repo / "sub" / "c.talon"]
+    assert get_changed_files(repo / "b.talon") == [repo / "b.talon"]
+    git(repo, git_env, "add", "b.talon")
+    assert get_changed_files(repo, staged=True) == [repo / "b.talon"]
+
+
+def test_get_changed_files_untracked(repo: Path, git_env: Dict[str, str]) -> None:
+    (repo / ".gitignore").write_text("ignored.talon\n", encoding="utf-8")
+    (repo / "ignored.talon").write_text(UNFORMATTED, encoding="utf-8")
+    (repo / "new.talon").write_text(UNFORMATTED, encoding="utf-8")
+    (repo / "sub" / "new.talon").write_text(UNFORMATTED, encoding="utf-8")
+    changed: List[Path] = [repo / "new.talon", repo / "sub" / "new.talon"]
+    assert get_changed_files(repo, since="HEAD") == changed
+    assert get_changed_files(repo) == changed
+    assert get_changed_files(repo / "sub") == [repo / "sub" / "new.talon"]
+    assert get_changed_files(repo / "new.talon") == [repo / "new.talon"]
+    assert get_changed_files(repo, staged=True) == []
+
+
+def test_get_changed_files_outside_repo(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setenv("GIT_CEILING_DIRECTORIES", str(tmp_path))
+    assert get_changed_files(tmp_path, staged=True) is None
+
+
+def test_get_changed_files_unknown_ref(repo: Path) -> None:
+    with pytest.raises(GitError):
+        get_changed_files(repo, since="no-such-ref")
+
+
+def test_cli_staged(repo: Path, git_env: Dict[str, str]) -> None:
+    (repo / "b.talon").write_text(UNFORMATTED + "\n", encoding="utf-8")
+    git(repo, git_env, "add", "b.talon")
+    result = run_talonfmt(repo, git_env, "--staged", "--in-place")
+    assert result.returncode == 0
+    assert result.stderr == "Fixed b.talon\n"
+    assert (repo / "a.talon").read_text(encoding="utf-8") == UNFORMATTED
+    assert (repo / "b.talon").read_text(encoding="utf-8") == FORMATTED
+
+
+def test_cli_changed_since(repo: Path, git_env: Dict[str, str]) -> None:
+    (repo / "sub" / "c.talon").write_text(UNFORMATTED + "\n", encoding="utf-8")
+    git(repo, git_env, "commit", "--quiet", "--all", "--message", "change")
+    result = run_talonfmt(repo, git_env, "--changed-since", "HEAD~1", "--check", ".")
+    assert result.returncode == 2
+    assert result.stderr == f"Would fix {Path('sub', 'c.talon')}\n"
+    result = run_talonfmt(repo, git_env, "--changed-since", "no-such-ref", ".")
+    assert result.returncode == 1
+
+
+def test_cli_outside_repo(tmp_path: Path, git_env: Dict[str, str]) -> None:
+    (tmp_path / "a.talon").write_text(UNFORMATTED, encoding="utf-8")
+    result = run_talonfmt(tmp_path, git_env, "--staged", "--check", ".")
+    assert result.returncode == 2
+    assert result.stderr == "Would fix a.talon\n"
+
+
+def test_cli_changed_since_excludes(repo: Path, git_env: Dict[str, str]) -> None:
+    (repo / "b.talon").write_text(UNFORMATTED + "\n", encoding="utf-8")
+    (repo / "sub" / "c.talon").write_text(UNFORMATTED + "\n", encoding="utf-8")
+    (repo / "sub" / "new.talon").write_text(UNFORMATTED, encoding="utf-8")
+    result = run_talonfmt(
+        repo, git_env, "--changed-since", "HEAD", "--exclude", "sub", "--check", "."
+    )
+    assert result.returncode == 2
+    assert result.stderr == "Would fix b.talon\n"
+    result = run_talonfmt(repo, git_env, "--changed-since", "HEAD", "--check", ".")
+    assert result.returncode == 2
+    assert result.stderr.splitlines() == [
+        "Would fix b.talon",
+        f"Would fix {Path('sub', 'c.talon')}",
+        f"Would fix {Path('sub', 'new.talon')}",
+    ]
@@ -0,0 +1,92 @@
+import random
+from pathlib import Path
+from typing import Any, Dict
+
+import pytest
+from ruamel.yaml import YAML
+from tree_sitter_talon import ParseError
+
+from talonfmt import TalonFmt
+from talonfmt.incremental import TextEdit, format_document, reformat_document
+
+GOLDEN_DIR = Path(__file__).parent / "data" / "golden" / "simple" / "default"
+
+SHORT_COMMANDS = """\
+-
+first:    key(a)
+second: key(b)
+third:  key(c)
+
+fourth:
+    key(d)
+    key(e)
+fifth: key(f)
+"""
+
+
+def assert_reformat(talon_fmt: TalonFmt, contents: str, edit: TextEdit) -> int:
+    document = format_document(talon_fmt, contents)
+    assert document.output == talon_fmt(contents)
+    document = reformat_document(talon_fmt, document, edit)
+    assert document.contents == edit.apply(contents)
+    assert document.output == talon_fmt(document.contents)
+    return document.formatted_groups
+
+
+@pytest.mark.parametrize(
+    "options", [{}, {"align_short_commands": True}], ids=["default", "align"]
+)
+@pytest.mark.parametrize(
+    "old,new",
+    [
+        ("second: key(b)", "second:\n    key(b)\n    key(x)"),
+        ("third:  key(c)\n", "third:  key(c)\nsixth: key(x)\n"),
+        ("\nfourth", "fourth"),
+        ("fifth: key(f)", "fifth: key(ffffffffffff)"),
+        ("-\n", ""),
+    ],
+)
+def test_reformat(options: Dict[str, Any], old: str, new: str) -> None:
+    talon_fmt = TalonFmt(safe=False, **options)
+    start = SHORT_COMMANDS.index(old)
+    assert_reformat(talon_fmt, SHORT_COMMANDS, TextEdit(start, start + len(old), new))
+
+
+def test_reformat_only_changed_declarations() -> None:
+    talon_fmt = TalonFmt(safe=False)
+    start = SHORT_COMMANDS.index("key(b)")
+    edit = TextEdit(start, start + len("key(b)"), "key( b )")
+    assert assert_reformat(talon_fmt, SHORT_COMMANDS, edit) == 1
+
+
+def test_reformat_parse_error() -> None:
+    talon_fmt = TalonFmt(safe=False)
+    document = format_document(talon_fmt, SHORT_COMMANDS)
+    start = SHORT_COMMANDS.index("key(b)")
+    with pytest.raises(ParseError):
+        reformat_document(talon_fmt, document, TextEdit(start, start + 4, "key"))
+
+
+def test_reformat_golden() -> None:
+    yaml = YAML(typ="safe")
+    random_state = random.Random(0)
+    talon_fmt = TalonFmt(safe=False, align_short_commands=True)
+    for golden_path in sorted(GOLDEN_DIR.glob("knausj_*.yml"))[:20]:
+        contents = yaml.load(golden_path.read_text(encoding="utf-8"))["input"]
+        document = format_document(talon_fmt, contents)
+        lines = contents.splitlines(keepends=True)
+        for _ in range(5):
+            # duplicate or remove a random line
+            index = random_state.randrange(len(lines))
+            start = sum(map(len, lines[:index]))
+            if random_state.random() < 0.5:
+                edit = TextEdit(start, start, lines[index])
+            else:
+                edit = TextEdit(start, start + len(lines[index]), "")
+            try:
+                expected = talon_fmt(edit.apply(document.contents))
+            except ParseError:
+                continue
+            document = reformat_document(talon_fmt, document, edit)
+            assert document.output == expected
+            lines = document.contents.splitlines(keepends=True)
@@ -0,0 +1,92 @@
+import subprocess
+from pathlib import Path
+from typing import Dict
+
+import pytest
+
+from talonfmt import LimitExceeded, TalonFmt
+
+CONTENTS: str = (
+    "app: vscode\n"
+    "-\n"
+    "hello (world | there) [please]: key(a)\n"
+    "\n"
+    "settings():\n"
+    "    speech.timeout = 0.3\n"
+)
+
+
+def nested(depth: int) -> str:
+    return "-\n" + "(" * depth + "a" + ")" * depth + ": key(a)\n"
+
+
+@pytest.mark.parametrize("safe", [False, True])
+def test_max_input_size(safe: bool) -> None:
+    size = len(CONTENTS.encode("utf-8"))
+    talon_fmt = TalonFmt(safe=safe, max_input_size=size - 1)
+    with pytest.raises(LimitExceeded, match=f"its size is {size} bytes"):
+        talon_fmt(CONTENTS)
+    with pytest.raises(LimitExceeded):
+        talon_fmt(CONTENTS.encode("utf-8"))
+    with pytest.raises(LimitExceeded):
+        talon_fmt.check(CONTENTS)
+    assert TalonFmt(safe=safe, max_input_size=size)(CONTENTS) == TalonFmt()(CONTENTS)
+
+
+@pytest.mark.parametrize("safe", [False, True])
+def test_max_nesting_depth(safe: bool) -> None:
+    talon_fmt = TalonFmt(safe=safe, max_nesting_depth=50)
+    with pytest.raises(LimitExceeded, match="nested deeper than the limit"):
+        talon_fmt(nested(100), filename="deep.talon")
+    with pytest.raises(LimitExceeded):
+        talon_fmt.check(nested(100))
+    assert talon_fmt(nested(10)) == TalonFmt()(nested(10))
+
+
+@pytest.mark.parametrize("safe", [False, True])
+def test_max_nesting_depth_default(safe: bool) -> None:
+    with pytest.raises(LimitExceeded, match="limit of 200 levels"):
+        TalonFmt(safe=safe)(nested(1000))
+    # NOTE: without a limit, running out of stack is reported the same way
+    with pytest.raises(LimitExceeded, match="nested too deeply"):
+        TalonFmt(safe=safe, max_nesting_depth=None)(nested(10_000))
+    with pytest.raises(LimitExceeded, match="nested too deeply"):
+        TalonFmt(safe=safe, max_nesting_depth=None).check(nested(10_000))
+
+
+@pytest.mark.parametrize("safe", [False, True])
+def test_max_render_time_falls_back_to_simple_layout(safe: bool) -> None:
+    counts: Dict[str, int] = {}
+
+    def on_count(key: str, count: int) -> None:
+        counts[key] = counts.get(key, 0) + count
+
+    talon_fmt = TalonFmt(safe=safe, max_line_width=80, max_render_time=0.0)
+    output = talon_fmt(CONTENTS, on_count=on_count)
+    assert output == TalonFmt(safe=safe)(CONTENTS)
+    assert counts["render:fallback"] >= 1
+
+
+def test_max_render_time_is_not_exceeded() -> None:
+    talon_fmt = TalonFmt(max_line_width=80, max_render_time=60.0)
+    assert talon_fmt(CONTENTS) == TalonFmt(max_line_width=80)(CONTENTS)
+
+
+def test_cli_reports_limits(tmp_path: Path) -> None:
+    file = tmp_path / "deep.talon"
+    file.write_text(nested(100), encoding="utf-8")
+    result = subprocess.run(
+        [
+            "talonfmt",
+            "--no-cache",
+            "--fail-on-error",
+            "--max-nesting-depth",
+            "50",
+            str(file),
+        ],
+        capture_output=True,
+        encoding="utf-8",
+        check=False,
+    )
+    assert result.returncode == 1
+    assert "nested deeper than the limit of 50 levels" in result.stderr
@@ -0,0 +1,77 @@
+from typing import Any, Callable
+
+from pytest import mark
+from pytest_golden.plugin import GoldenTestFixture
+
+from talonfmt import TalonFmt
+from talonfmt.renderer import BoundedSmartDocRenderer
+
+from . import (
+    format_smart1k,
+    format_smart1k_align_dynamic,
+    format_smart1k_align_fixed32,
+    format_smart80,
+    format_smart80_align_dynamic,
+    format_smart80_align_fixed32,
+    golden_path,
+)
+
+# The default lookahead for the bounded renderer agrees with the goldens
+LOOKAHEAD: int = BoundedSmartDocRenderer.lookahead
+
+
+def assert_lookahead(golden: GoldenTestFixture, format: Callable[..., str]) -> None:
+    # NOTE: the safety checks are covered by the golden tests without lookahead
+    output = format(
+        golden["input"], filename=golden_path(golden), lookahead=LOOKAHEAD, safe=False
+    )
+    assert output == golden.out["output"]
+
+
+@mark.golden_test("data/golden/smart80/default/*.yml")
+def test_smart80_lookahead(golden: GoldenTestFixture) -> None:
+    assert_lookahead(golden, format_smart80)
+
+
+@mark.golden_test("data/golden/smart80/align/dynamic/*.yml")
+def test_smart80_align_dynamic_lookahead(golden: GoldenTestFixture) -> None:
+    assert_lookahead(golden, format_smart80_align_dynamic)
+
+
+@mark.golden_test("data/golden/smart80/align/fixed32/*.yml")
+def test_smart80_align_fixed32_lookahead(golden: GoldenTestFixture) -> None:
+    assert_lookahead(golden, format_smart80_align_fixed32)
+
+
+@mark.golden_test("data/golden/smart1k/default/*.yml")
+def test_smart1k_lookahead(golden: GoldenTestFixture) -> None:
+    assert_lookahead(golden, format_smart1k)
+
+
+@mark.golden_test("data/golden/smart1k/align/dynamic/*.yml")
+def test_smart1k_align_dynamic_lookahead(golden: GoldenTestFixture) -> None:
+    assert_lookahead(golden, format_smart1k_align_dynamic)
+
+
+@mark.golden_test("data/golden/smart1k/align/fixed32/*.yml")
+def test_smart1k_align_fixed32_lookahead(golden: GoldenTestFixture) -> None:
+    assert_lookahead(golden, format_smart1k_align_fixed32)
+
+
+def test_lookahead_streams_rest_of_alternative() -> None:
+    # NOTE: with a lookahead of one line, the table is chosen since its first
+    #       row fits, even though its last row exceeds the maximum line width
+    contents = "".join(
+        [
+            "-\n",
+            "first: key(a)\n",
+            "second: key(b)\n",
+            "a much longer phrase here: key(ctrl-shift-alt-z)\n",
+        ]
+    )
+    kwargs: Any = {"safe": True, "max_line_width": 40, "align_short_commands": True}
+    bounded = TalonFmt(lookahead=1, **kwargs)(contents)
+    assert bounded.splitlines()[1] == "first:                     key(a)"
+    unbounded = TalonFmt(**kwargs)(contents)
+    assert unbounded.splitlines()[1] == "first: key(a)"
+    assert TalonFmt(lookahead=3, **kwargs)(contents) == unbounded
@@ -0,0 +1,231 @@
+import io
+import subprocess
+from typing import Any, Dict, List
+
+import pytest
+
+from talonfmt import TalonFmt
+from talonfmt.lsp import LanguageServer, TextDocument, read_message, write_message
+
+URI = "file:///tmp/test.talon"
+
+CONTENTS = """\
+app:   vscode
+-
+first:    key(a)
+second:  key( b )
+
+third:
+    key(c)
+        key(d)
+"""
+
+
+def apply_text_edits(text: str, text_edits: List[Dict[str, Any]]) -> str:
+    document = TextDocument(uri=URI, text=text)
+    for text_edit in reversed(text_edits):
+        document.apply_change(
+            {"range": text_edit["range"], "text": text_edit["newText"]}
+        )
+    return document.text
+
+
+def open_document(language_server: LanguageServer, text: str) -> None:
+    language_server.handle(
+        {
+            "jsonrpc": "2.0",
+            "method": "textDocument/didOpen",
+            "params": {"textDocument": {"uri": URI, "text": text, "version": 1}},
+        }
+    )
+
+
+def request(language_server: LanguageServer, method: str, **params: Any) -> Any:
+    response = language_server.handle(
+        {
+            "jsonrpc": "2.0",
+            "id": 1,
+            "method": method,
+            "params": {"textDocument": {"uri": URI}, **params},
+        }
+    )
+    assert response is not None
+    assert "error" not in response, response["error"]
+    return response["result"]
+
+
+def test_text_document_positions() -> None:
+    document = TextDocument(uri=URI, text="a: 😀b\nc: d\n")
+    assert document.get_offset({"line": 0, "character": 5}) == 4
+    assert document.get_position(5) == {"line": 0, "character": 6}
+    assert document.get_offset_from_point((0, 7)) == 4
+    document.apply_change(
+        {
+            "range": {
+                "start": {"line": 0, "character": 3},
+                "end": {"line": 0, "character": 5},
+            },
+            "text": "x",
+        }
+    )
+    assert document.text == "a: xb\nc: d\n"
+    assert document.get_position(len(document.text)) == {"line": 2, "character": 0}
+
+
+def test_formatting() -> None:
+    talon_fmt = TalonFmt(safe=True, max_line_width=80)
+    language_server = LanguageServer(talon_fmt=talon_fmt)
+    open_document(language_server, CONTENTS)
+    text_edits = request(language_server, "textDocument/formatting")
+    assert apply_text_edits(CONTENTS, text_edits) == talon_fmt(CONTENTS)
+
+
+def test_range_formatting() -> None:
+    language_server = LanguageServer(talon_fmt=TalonFmt(safe=True, max_line_width=80))
+    open_document(language_server, CONTENTS)
+    range = {"start": {"line": 3, "character": 0}, "end": {"line": 3, "character": 0}}
+    text_edits = request(language_server, "textDocument/rangeFormatting", range=range)
+    assert apply_text_edits(CONTENTS, text_edits) == CONTENTS.replace(
+        "second:  key( b )", "second: key(b)"
+    )
+
+
+def test_range_formatting_header() -> None:
+    language_server = LanguageServer(talon_fmt=TalonFmt(safe=True, max_line_width=80))
+    open_document(language_server, CONTENTS)
+    range = {"start": {"line": 0, "character": 0}, "end": {"line": 1, "character": 0}}
+    text_edits = request(language_server, "textDocument/rangeFormatting", range=range)
+    assert apply_text_edits(CONTENTS, text_edits) == CONTENTS.replace(
+        "app:   vscode", "app: vscode"
+    )
+
+
+def test_range_formatting_aligns_short_commands() -> None:
+    talon_fmt = TalonFmt(safe=True, max_line_width=80, align_short_commands=True)
+    language_server = LanguageServer(talon_fmt=talon_fmt)
+    contents = CONTENTS.replace("\n\nthird:\n    key(c)\n        key(d)", "")
+    open_document(language_server, contents)
+    range = {"start": {"line": 3, "character": 0}, "end": {"line": 3, "character": 0}}
+    text_edits = request(language_server, "textDocument/rangeFormatting", range=range)
+    # NOTE: the header is not in the range, so it is left as is
+    header, body = talon_fmt(contents).split("-\n", maxsplit=1)
+    assert apply_text_edits(contents, text_edits) == "app:   vscode\n-\n" + body
+
+
+def test_did_change_and_on_type_formatting() -> None:
+    language_server = LanguageServer(talon_fmt=TalonFmt(safe=True, max_line_width=80))
+    open_document(language_server, CONTENTS)
+    language_server.handle(
+        {
+            "jsonrpc": "2.0",
+            "method": "textDocument/didChange",
+            "params": {
+                "textDocument": {"uri": URI, "version": 2},
+                "contentChanges": [
+                    {
+                        "range": {
+                            "start": {"line": 2, "character": 0},
+                            "end": {"line": 2, "character": 0},
+                        },
+                        "text": "zeroth :key( z )\n",
+                    }
+                ],
+            },
+        }
+    )
+    text = language_server.documents[URI].text
+    assert text.startswith("app:   vscode\n-\nzeroth :key( z )\nfirst:")
+    position = {"line": 3, "character": 0}
+    text_edits = request(
+        language_server, "textDocument/onTypeFormatting", position=position, ch="\n"
+    )
+    assert apply_text_edits(text, text_edits) == text.replace(
+        "zeroth :key( z )", "zeroth: key(z)"
+    )
+
+
+def test_serve() -> None:
+    messages: List[Dict[str, Any]] = [
+        {"jsonrpc": "2.0", "id": 1, "method": "initialize", "params": {}},
+        {"jsonrpc": "2.0", "id": 2, "method": "unknown", "params": {}},
+        {"jsonrpc": "2.0", "id": 3, "method": "shutdown"},
+        {"jsonrpc": "2.0", "method": "exit"},
+    ]
+    rfile = io.BytesIO()
+    for message in messages:
+        write_message(rfile, message)
+    rfile.seek(0)
+    wfile = io.BytesIO()
+    assert LanguageServer().serve(rfile, wfile) == 0
+    wfile.seek(0)
+    initialize = read_message(wfile)
+    assert initialize is not None
+    assert initialize["result"]["capabilities"]["documentRangeFormattingProvider"]
+    unknown = read_message(wfile)
+    assert unknown is not None and unknown["error"]["code"] == -32601
+    assert read_message(wfile) == {"jsonrpc": "2.0", "id": 3, "result": None}
+    assert read_message(wfile) is None
+
+
+def test_serve_recovers_from_errors(capsys: pytest.CaptureFixture[str]) -> None:
+    messages: List[Any] = [
+        {
+            "jsonrpc": "2.0",
+            "method": "textDocument/didOpen",
+            "params": {"textDocument": {"uri": URI, "text": CONTENTS}},
+        },
+        # NOTE: the message is not an object
+        ["textDocument/formatting"],
+        # NOTE: the contentChanges are missing
+        {
+            "jsonrpc": "2.0",
+            "method": "textDocument/didChange",
+            "params": {"textDocument": {"uri": URI}},
+        },
+        # NOTE: the range is missing
+        {
+            "jsonrpc": "2.0",
+            "id": 1,
+            "method": "textDocument/rangeFormatting",
+            "params": {"textDocument": {"uri": URI}},
+        },
+        {
+            "jsonrpc": "2.0",
+            "id": 2,
+            "method": "textDocument/formatting",
+            "params": {"textDocument": {"uri": URI}},
+        },
+        {"jsonrpc": "2.0", "id": 3, "method": "shutdown"},
+        {"jsonrpc": "2.0", "method": "exit"},
+    ]
+    rfile = io.BytesIO()
+    for message in messages:
+        write_message(rfile, message)
+    rfile.seek(0)
+    wfile = io.BytesIO()
+    language_server = LanguageServer(talon_fmt=TalonFmt(max_input_size=10))
+    assert language_server.serve(rfile, wfile) == 0
+    assert "Error handling 'textDocument/didChange'" in capsys.readouterr().err
+    wfile.seek(0)
+    not_an_object = read_message(wfile)
+    assert not_an_object is not None and not_an_object["error"]["code"] == -32600
+    malformed = read_message(wfile)
+    assert malformed is not None and malformed["error"]["code"] == -32603
+    too_large = read_message(wfile)
+    assert too_large is not None and too_large["error"]["code"] == -32803
+    assert read_message(wfile) == {"jsonrpc": "2.0", "id": 3, "result": None}
+
+
+def test_lsp_cli() -> None:
+    stdin = io.BytesIO()
+    write_message(stdin, {"jsonrpc": "2.0", "id": 1, "method": "shutdown"})
+    write_message(stdin, {"jsonrpc": "2.0", "method": "exit"})
+    result = subprocess.run(
+        ["talonfmt", "--lsp"], input=stdin.getvalue(), capture_output=True, check=False
+    )
+    assert result.returncode == 0
+    assert read_message(io.BytesIO(result.stdout)) == {
+        "jsonrpc": "2.0",
+        "id": 1,
+        "result": None,
+    }
@@ -0,0 +1,68 @@
+from typing import Any, Dict, Iterator, List
+
+import pytest
+from tree_sitter_talon import ParseError
+
+import talonfmt
+
+from .conftest import get_golden_inputs
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_talonfmt_many(jobs: int) -> None:
+    inputs = get_golden_inputs(8)
+    results = list(
+        talonfmt.talonfmt_many(
+            [("invalid.talon", "this is not talon(\n"), *inputs], safe=True, jobs=jobs
+        )
+    )
+    assert results[0].filename == "invalid.talon"
+    assert results[0].output is None
+    assert isinstance(results[0].error, ParseError)
+    assert [result.output for result in results[1:]] == [
+        talonfmt.talonfmt(contents, safe=True) for contents in inputs
+    ]
+    assert all(result.error is None for result in results[1:])
+
+
+def test_format_many_reuses_formatter() -> None:
+    talon_fmt = talonfmt.TalonFmt(safe=False)
+    inputs = get_golden_inputs(4)
+    list(talon_fmt.format_many(inputs[:1]))
+    talon_formatter = talon_fmt.get_talon_formatter(4)
+    doc_renderer = talon_fmt.get_doc_renderer(None)
+    list(talon_fmt.format_many(inputs[1:]))
+    assert talon_fmt._talon_formatters == {4: talon_formatter}
+    assert talon_fmt._doc_renderers == {None: doc_renderer}
+
+
+def test_format_many_is_lazy() -> None:
+    consumed: List[int] = []
+
+    def inputs() -> Iterator[str]:
+        for index, contents in enumerate(get_golden_inputs(4)):
+            consumed.append(index)
+            yield contents
+
+    results = talonfmt.talonfmt_many(inputs(), safe=False)
+    next(results)
+    assert consumed == [0]
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {"safe": "sometimes"},
+        {"empty_match_context": "always"},
+        {"simple_layout": "widest"},
+        {"preserve_blank_lines": ("footer",)},
+        {"max_line_width": 0},
+        {"lookahead": 0},
+        {"max_input_size": -1},
+        {"max_nesting_depth": 0},
+        {"max_render_time": -1.0},
+    ],
+)
+def test_options_are_validated(options: Dict[str, Any]) -> None:
+    with pytest.raises(ValueError):
+        talonfmt.talonfmt_many([], **options)
@@ -0,0 +1,168 @@
+import subprocess
+from pathlib import Path
+from typing import List, Type, TypeVar
+
+import pytest
+from doc_printer import Doc
+from tree_sitter_talon import (
+    Branch,
+    Leaf,
+    Node,
+    Point,
+    TalonBinaryOperator,
+    TalonChoice,
+    TalonExpression,
+    TalonIdentifier,
+    TalonOperator,
+    TalonOptional,
+    TalonParenthesizedExpression,
+    TalonParenthesizedRule,
+    TalonRule,
+    TalonSeq,
+    TalonVariable,
+    TalonWord,
+)
+
+from talonfmt import LimitExceeded, TalonFmt
+
+# NOTE: these nodes are built directly, because converting the parse tree
+#       to nodes recurses once for every level of nesting, and the depth is
+#       kept low, because the tests check the assertions in talonfmt, which
+#       show the nodes
+
+DEPTH: int = 2_000
+
+# The depth of the source text formatted from start to end
+SOURCE_DEPTH: int = 10_000
+
+ALTERNATIVES: int = 100_000
+
+BranchVar = TypeVar("BranchVar", bound=Branch)
+
+LeafVar = TypeVar("LeafVar", bound=Leaf)
+
+
+def leaf(cls: Type[LeafVar], type_name: str, text: str) -> LeafVar:
+    return cls(
+        text=text,
+        type_name=type_name,
+        start_position=Point(0, 0),
+        end_position=Point(0, 0),
+    )
+
+
+def branch(cls: Type[BranchVar], type_name: str, children: List[Node]) -> BranchVar:
+    return cls(
+        text="",
+        type_name=type_name,
+        start_position=Point(0, 0),
+        end_position=Point(0, 0),
+        children=children,
+    )
+
+
+def variable(name: str) -> TalonVariable:
+    return TalonVariable(
+        text=name,
+        type_name="variable",
+        start_position=Point(0, 0),
+        end_position=Point(0, 0),
+        children=[],
+        variable_name=leaf(TalonIdentifier, "identifier", name),
+    )
+
+
+def nested(depth: int) -> str:
+    return "-\n" + "(" * depth + "a" + ")" * depth + ": key(a)\n"
+
+
+def render(doc: Doc) -> str:
+    return "".join(TalonFmt().render_docs([doc], max_line_width=None))
+
+
+def format_node(node: Node) -> str:
+    return render(TalonFmt().get_talon_formatter(4).format(node))
+
+
+def test_format_deeply_nested_rule() -> None:
+    rule: Node = branch(
+        TalonSeq,
+        "seq",
+        [leaf(TalonWord, "word", "hello"), leaf(TalonWord, "word", "world")],
+    )
+    for depth in range(DEPTH):
+        if depth % 2 == 0:
+            rule = branch(TalonParenthesizedRule, "parenthesized_rule", [rule])
+        else:
+            rule = branch(TalonOptional, "optional", [rule])
+    rule = branch(TalonRule, "rule", [rule])
+    assert format_node(rule) == "[(" * (DEPTH // 2) + "hello world" + ")]" * (
+        DEPTH // 2
+    )
+
+
+def test_format_deeply_nested_expression() -> None:
+    expression: TalonExpression = variable("x")
+    for _ in range(DEPTH):
+        expression = TalonBinaryOperator(
+            text="",
+            type_name="binary_operator",
+            start_position=Point(0, 0),
+            end_position=Point(0, 0),
+            children=[],
+            left=variable("y"),
+            operator=leaf(TalonOperator, "operator", "+"),
+            right=branch(
+                TalonParenthesizedExpression, "parenthesized_expression", [expression]
+            ),
+        )
+    assert format_node(expression) == "y + (" * DEPTH + "x" + ")" * DEPTH
+
+
+def test_format_long_choice() -> None:
+    alternatives = [f"word{index}" for index in range(ALTERNATIVES)]
+    rule = branch(
+        TalonRule,
+        "rule",
+        [
+            branch(
+                TalonChoice,
+                "choice",
+                [leaf(TalonWord, "word", text) for text in alternatives],
+            )
+        ],
+    )
+    assert format_node(rule) == " | ".join(alternatives)
+
+
+@pytest.mark.parametrize("safe", [False, True])
+def test_talonfmt_long_choice(safe: bool) -> None:
+    alternatives = " | ".join(f"word{index}" for index in range(10_000))
+    contents = f"-\n{alternatives}:\n    key(a)\n"
+    assert TalonFmt(safe=safe)(contents) == contents
+
+
+@pytest.mark.parametrize("safe", [False, True])
+def test_talonfmt_deeply_nested_source(safe: bool) -> None:
+    assert TalonFmt(safe=safe)(nested(100)) == nested(100).replace(": ", ":\n    ")
+    for max_nesting_depth in (None, 200):
+        talon_fmt = TalonFmt(safe=safe, max_nesting_depth=max_nesting_depth)
+        with pytest.raises(LimitExceeded):
+            talon_fmt(nested(SOURCE_DEPTH))
+        with pytest.raises(LimitExceeded):
+            talon_fmt.check(nested(SOURCE_DEPTH))
+
+
+def test_cli_deeply_nested_source(tmp_path: Path) -> None:
+    file = tmp_path / "deep.talon"
+    file.write_text(nested(SOURCE_DEPTH), encoding="utf-8")
+    result = subprocess.run(
+        ["talonfmt", "--no-cache", "--fail-on-error", str(file)],
+        capture_output=True,
+        encoding="utf-8",
+        check=False,
+    )
+    assert result.returncode == 1
+    assert result.stdout == ""
+    assert "nested deeper than the limit" in result.stderr
+    assert "Traceback" not in result.stderr
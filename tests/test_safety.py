@@ -0,0 +1,65 @@
+from typing import Dict, Union
+
+from pytest import mark
+
+import talonfmt
+
+UNFORMATTED = "hello  world:   key( enter )\n"
+
+FORMATTED = "hello world:\n    key(enter)\n"
+
+
+@mark.parametrize(
+    "safe,phases",
+    [
+        (False, set()),
+        ("none", set()),
+        ("equivalence", {"safety:parse", "safety:equivalence"}),
+        ("idempotence", {"safety:parse", "safety:idempotence"}),
+        ("full", {"safety:parse", "safety:equivalence", "safety:idempotence"}),
+        (True, {"safety:parse", "safety:equivalence", "safety:idempotence"}),
+    ],
+)
+def test_safety_phases(safe: Union[bool, str], phases: set[str]) -> None:
+    timings: Dict[str, float] = {}
+
+    def on_timing(phase: str, seconds: float) -> None:
+        timings[phase] = seconds
+
+    output = talonfmt.talonfmt(UNFORMATTED, safe=safe, on_timing=on_timing)
+    assert output == FORMATTED
+    assert set(timings) == {"parse", "format", "render"} | phases
+
+
+def test_safety_skipped_for_unchanged_input() -> None:
+    timings: Dict[str, float] = {}
+
+    def on_timing(phase: str, seconds: float) -> None:
+        timings[phase] = seconds
+
+    output = talonfmt.talonfmt(FORMATTED, safe=True, on_timing=on_timing)
+    assert output == FORMATTED
+    assert set(timings) == {"parse", "format", "render"}
+
+
+def test_counters() -> None:
+    counts: Dict[str, int] = {}
+
+    def on_count(name: str, count: int) -> None:
+        counts[name] = counts.get(name, 0) + count
+
+    talonfmt.talonfmt(FORMATTED, safe=True, on_count=on_count)
+    assert counts == {
+        "input:characters": len(FORMATTED),
+        "output:characters": len(FORMATTED),
+        "format:groups": 2,
+        "safety:skipped": 1,
+    }
+
+
+def test_check() -> None:
+    talon_fmt = talonfmt.TalonFmt()
+    assert talon_fmt.check(FORMATTED)
+    assert not talon_fmt.check(UNFORMATTED)
+    assert not talon_fmt.check(FORMATTED[:-1])
+    assert not talon_fmt.check(FORMATTED + "\n")
@@ -0,0 +1,196 @@
+import collections
+import io
+import subprocess
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+import pytest
+from tree_sitter_talon import ParseError, parse
+
+import talonfmt
+from talonfmt.cache import ResultCache
+from talonfmt.files import format_file
+
+from .conftest import get_golden_inputs
+
+
+@pytest.mark.parametrize("max_line_width", [None, 80])
+def test_stream_unsafe(max_line_width: Optional[int]) -> None:
+    for contents in get_golden_inputs(10):
+        chunks = list(
+            talonfmt.talonfmt_stream(
+                contents, safe=False, max_line_width=max_line_width
+            )
+        )
+        output = talonfmt.talonfmt(contents, safe=False, max_line_width=max_line_width)
+        assert "".join(chunks) == output
+        # NOTE: the output is streamed one declaration at a time
+        assert len(chunks) > 1
+        assert all(chunks)
+
+
+def test_stream_safe() -> None:
+    for contents in get_golden_inputs(10):
+        chunks = list(talonfmt.talonfmt_stream(contents, safe=True))
+        assert chunks == [talonfmt.talonfmt(contents, safe=True)]
+
+
+def test_stream_whitespace() -> None:
+    assert list(talonfmt.talonfmt_stream("  \n\n")) == []
+
+
+def test_stream_parse_error() -> None:
+    chunks = talonfmt.talonfmt_stream("this is not talon(\n", safe=False)
+    with pytest.raises(ParseError):
+        next(iter(chunks))
+
+
+def get_peak_memory(function: Callable[[], None]) -> int:
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_stream_memory() -> None:
+    contents = "-\n" + "".join(f"command {i}: key(a)\n" for i in range(2000))
+    talon_fmt = talonfmt.TalonFmt(safe=False)
+
+    def consume_stream() -> None:
+        for _ in talon_fmt.stream(contents):
+            pass
+
+    def parse_contents() -> None:
+        parse(contents, raise_parse_error=True)
+
+    # NOTE: the source is converted one declaration at a time, so streaming
+    #       uses much less memory than parsing the whole source file
+    consume_stream()
+    assert get_peak_memory(consume_stream) * 4 < get_peak_memory(parse_contents)
+
+
+class NullWriter(io.StringIO):
+    def write(self, text: str) -> int:
+        return len(text)
+
+
+def test_stream_file_memory(tmp_path: Path) -> None:
+    file = tmp_path / "a.talon"
+    file.write_text(
+        "-\n" + "".join(f"command {i}:\n    key(a)\n" for i in range(1000)),
+        encoding="utf-8",
+    )
+    talon_fmt = talonfmt.TalonFmt(safe=False)
+    cache_dirs = iter(range(3))
+
+    def stream_file(*, use_cache: bool) -> None:
+        cache: Optional[ResultCache] = None
+        if use_cache:
+            cache = ResultCache(tmp_path / f"cache{next(cache_dirs)}")
+        format_file(talon_fmt, file, cache=cache, handle=NullWriter())
+
+    stream_file(use_cache=True)
+    # NOTE: the streamed output is only kept if it is cached
+    peak_with_cache = get_peak_memory(lambda: stream_file(use_cache=True))
+    peak_without_cache = get_peak_memory(lambda: stream_file(use_cache=False))
+    output_size = file.stat().st_size
+    assert peak_without_cache + output_size < peak_with_cache
+
+
+def test_stream_stdin() -> None:
+    contents = get_golden_inputs(1)[0]
+    result = subprocess.run(
+        ["talonfmt", "--unsafe"],
+        input=contents,
+        capture_output=True,
+        encoding="utf-8",
+        check=False,
+    )
+    assert result.returncode == 0
+    assert result.stdout == talonfmt.talonfmt(contents, safe=False)
+
+
+@pytest.mark.parametrize("safe", [False, True])
+def test_stream_reuses_unchanged_groups(tmp_path: Path, safe: bool) -> None:
+    talon_fmt = talonfmt.TalonFmt(safe=safe)
+    filename = str(tmp_path / "test.talon")
+    for contents in get_golden_inputs(10):
+        formatted = talon_fmt(talon_fmt(contents, filename=filename), filename=filename)
+        counts: Dict[str, int] = collections.Counter()
+
+        def on_count(name: str, count: int) -> None:
+            counts[name] += count
+
+        assert talon_fmt(formatted, filename=filename, on_count=on_count) == formatted
+        assert (
+            talon_fmt(formatted.encode(), filename=filename, on_count=on_count)
+            == formatted
+        )
+        assert talon_fmt.check(formatted, filename=filename, on_count=on_count)
+        # NOTE: formatting the output again reuses every group of declarations,
+        #       so no documents are built
+        assert counts["format:reused"] > 0
+        assert counts["format:groups"] == 0
+
+
+def test_stream_does_not_reuse_groups_when_cold(tmp_path: Path) -> None:
+    talon_fmt = talonfmt.TalonFmt(safe=False)
+    formatted = talon_fmt(get_golden_inputs(1)[0])
+    counts: Dict[str, int] = collections.Counter()
+
+    def on_count(name: str, count: int) -> None:
+        counts[name] += count
+
+    # NOTE: the groups are only compared once a file is formatted again
+    for _ in range(2):
+        assert talon_fmt(formatted, on_count=on_count) == formatted
+    assert talon_fmt(formatted, filename=str(tmp_path / "a.talon")) == formatted
+    assert talon_fmt(formatted, filename=str(tmp_path / "b.talon")) == formatted
+    assert talon_fmt._unchanged_groups == set()
+    assert counts["format:reused"] == 0
+
+
+def test_stream_forgets_formatted_filenames(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(talonfmt, "FORMATTED_FILENAMES_MAX_COUNT", 2)
+    talon_fmt = talonfmt.TalonFmt(safe=False)
+    for name in ("a", "b", "c", "d", "e"):
+        talon_fmt("-\nhello: key(a)\n", filename=str(tmp_path / f"{name}.talon"))
+        assert len(talon_fmt._formatted_filenames) <= 2
+
+
+def test_stream_reuses_groups_per_layout(tmp_path: Path) -> None:
+    talon_fmt = talonfmt.TalonFmt(safe=False)
+    for indent_size in (2, 4):
+        directory = tmp_path / f"indent{indent_size}"
+        directory.mkdir()
+        (directory / ".editorconfig").write_text(
+            f"root = true\n[*.talon]\nindent_size = {indent_size}\n",
+            encoding="utf-8",
+        )
+    formatted = "-\nhello:\n    key(a)\n"
+    filename = str(tmp_path / "indent4" / "test.talon")
+    for _ in range(3):
+        assert talon_fmt(formatted, filename=filename) == formatted
+    # NOTE: the indent size from the .editorconfig is part of the key
+    filename = str(tmp_path / "indent2" / "test.talon")
+    for _ in range(3):
+        assert talon_fmt(formatted, filename=filename) == "-\nhello:\n  key(a)\n"
+
+
+def test_stream_reformats_edited_groups(tmp_path: Path) -> None:
+    talon_fmt = talonfmt.TalonFmt(safe=False)
+    filename = str(tmp_path / "test.talon")
+    formatted = "-\nhello:\n    key(a)\nworld:\n    key(b)\n"
+    assert talon_fmt(formatted, filename=filename) == formatted
+    assert talon_fmt(formatted, filename=filename) == formatted
+    edited = formatted.replace("    key(b)", "  key(c)")
+    assert (
+        talon_fmt(edited, filename=filename)
+        == "-\nhello:\n    key(a)\nworld:\n    key(c)\n"
+    )
+    assert not talon_fmt.check(edited, filename=filename)
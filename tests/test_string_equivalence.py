@@ -0,0 +1,93 @@
+import ast
+import dataclasses
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+import pytest
+from ruamel.yaml import YAML
+from tree_sitter_talon import Node, TalonString, parse
+
+import talonfmt.formatter  # NOTE: patches TalonString.assert_equivalent
+
+GOLDEN_DIR = Path(__file__).parent / "data" / "golden" / "smart80" / "default"
+
+
+def find_strings(node: Node) -> Iterator[TalonString]:
+    if isinstance(node, TalonString):
+        yield node
+    else:
+        for field in dataclasses.fields(node):
+            value = getattr(node, field.name)
+            if isinstance(value, Node):
+                yield from find_strings(value)
+            elif isinstance(value, (list, tuple)):
+                for child in value:
+                    if isinstance(child, Node):
+                        yield from find_strings(child)
+
+
+def golden_string_pairs() -> List[Tuple[TalonString, TalonString]]:
+    yaml = YAML(typ="safe")
+    pairs: List[Tuple[TalonString, TalonString]] = []
+    for golden_path in sorted(GOLDEN_DIR.glob("*.yml")):
+        golden = yaml.load(golden_path.read_text(encoding="utf-8"))
+        strings1 = list(find_strings(parse(golden["input"], raise_parse_error=True)))
+        strings2 = list(find_strings(parse(golden["output"], raise_parse_error=True)))
+        assert len(strings1) == len(strings2)
+        pairs.extend(zip(strings1, strings2))
+    return pairs
+
+
+def assert_equivalent_with_python_ast(self: TalonString, other: TalonString) -> None:
+    # NOTE: the previous implementation, which uses the Python parser
+    try:
+        ast1 = ast.parse("f" + self.text)
+        ast2 = ast.parse("f" + other.text)
+    except SyntaxError:
+        ast1 = ast.parse(self.text)
+        ast2 = ast.parse(other.text)
+    assert ast.unparse(ast1) == ast.unparse(ast2)
+
+
+def parse_string(text: str) -> TalonString:
+    strings = list(find_strings(parse(f"test: insert({text})\n")))
+    assert len(strings) == 1
+    return strings[0]
+
+
+@pytest.mark.parametrize(
+    "text1,text2",
+    [
+        ('"hello"', "'hello'"),
+        ("'it\\'s'", '"it\'s"'),
+        ('"say \\"hi\\""', "'say \"hi\"'"),
+        ('"\\x41\\n"', '"A\\n"'),
+        ('"{user.text}"', "'{user.text}'"),
+    ],
+)
+def test_string_equivalent(text1: str, text2: str) -> None:
+    string1, string2 = parse_string(text1), parse_string(text2)
+    assert_equivalent_with_python_ast(string1, string2)
+    string1.assert_equivalent(string2)
+
+
+@pytest.mark.parametrize(
+    "text1,text2",
+    [
+        ('"hello"', "'hallo'"),
+        ('"a\\tb"', '"a b"'),
+        ('"a\\\\n"', '"a\\n"'),
+        ('"{x}"', '"{y}"'),
+    ],
+)
+def test_string_not_equivalent(text1: str, text2: str) -> None:
+    string1, string2 = parse_string(text1), parse_string(text2)
+    with pytest.raises(AssertionError):
+        assert_equivalent_with_python_ast(string1, string2)
+    with pytest.raises(AssertionError):
+        string1.assert_equivalent(string2)
+
+
+def test_string_equivalent_golden() -> None:
+    for string1, string2 in golden_string_pairs():
+        string1.assert_equivalent(string2)
@@ -0,0 +1,93 @@
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Iterator, List
+
+import pytest
+
+from talonfmt import TalonFmt
+from talonfmt.files import FormatResult
+from talonfmt.watch import Watcher
+
+UNFORMATTED: str = "-\nhello  :   key(a)\n"
+
+FORMATTED: str = "-\nhello:\n    key(a)\n"
+
+BACKENDS: List[str] = ["poll"]
+if sys.platform.startswith("linux"):
+    BACKENDS.append("inotify")
+
+
+def wait_until(condition: Callable[[], bool], timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return condition()
+
+
+@pytest.fixture(params=BACKENDS)
+def watch(
+    request: pytest.FixtureRequest, tmp_path: Path
+) -> Iterator[List[FormatResult]]:
+    results: List[FormatResult] = []
+    watcher = Watcher(
+        talon_fmt=TalonFmt(safe=True),
+        paths=[tmp_path],
+        backend=request.param,
+        debounce=0.05,
+        poll_interval=0.1,
+        on_result=results.append,
+    )
+    stop = threading.Event()
+    thread = threading.Thread(target=watcher.run, args=(stop,))
+    thread.start()
+    # NOTE: give the watcher time to scan the directory or add its watches
+    time.sleep(0.3)
+    try:
+        yield results
+    finally:
+        stop.set()
+        thread.join()
+
+
+def read(file: Path) -> str:
+    return file.read_text(encoding="utf-8")
+
+
+def test_watch_formats_written_files(tmp_path: Path, watch: List[FormatResult]) -> None:
+    file = tmp_path / "a.talon"
+    file.write_text(UNFORMATTED, encoding="utf-8")
+    assert wait_until(lambda: read(file) == FORMATTED)
+    # NOTE: the watcher must not react to its own write
+    time.sleep(0.5)
+    assert [(result.filename, result.changed) for result in watch] == [
+        (str(file), True)
+    ]
+    file.write_text(UNFORMATTED, encoding="utf-8")
+    assert wait_until(lambda: len(watch) == 2)
+    assert read(file) == FORMATTED
+
+
+def test_watch_new_directories(tmp_path: Path, watch: List[FormatResult]) -> None:
+    file = tmp_path / "x" / "y" / "b.talon"
+    file.parent.mkdir(parents=True)
+    file.write_text(UNFORMATTED, encoding="utf-8")
+    assert wait_until(lambda: read(file) == FORMATTED)
+
+
+def test_watch_ignores_excluded_files(
+    tmp_path: Path, watch: List[FormatResult]
+) -> None:
+    excluded = tmp_path / "node_modules" / "c.talon"
+    excluded.parent.mkdir()
+    excluded.write_text(UNFORMATTED, encoding="utf-8")
+    (tmp_path / "c.py").write_text(UNFORMATTED, encoding="utf-8")
+    file = tmp_path / "c.talon"
+    file.write_text(UNFORMATTED, encoding="utf-8")
+    assert wait_until(lambda: read(file) == FORMATTED)
+    time.sleep(0.3)
+    assert read(excluded) == UNFORMATTED
+    assert [result.filename for result in watch] == [str(file)]